@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,11 +47,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "Library.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "Library.profiling.ProfilingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "debug_toolbar.middleware.DebugToolbarMiddleware",
@@ -83,10 +87,60 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # On disk rather than in memory: concurrent test requests wait for
+        # each other's locks like in production instead of failing with
+        # "database table is locked".
+        "TEST": {"NAME": BASE_DIR / "cache" / "test.sqlite3"},
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# A file based cache is shared by every worker process on the host. Switch to
+# django.core.cache.backends.redis.RedisCache when running on several hosts.
+# Library.caching relies on cache.add() and cache.incr() being atomic, as they
+# are on Redis and Memcached; for this backend it takes a file lock (see
+# Library.caching.atomic), which only works within one host.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "cache" / "django",
+        "TIMEOUT": 300,
+        "OPTIONS": {
+            "MAX_ENTRIES": 10000,
+        },
+    }
+}
+
+# Library.profiling.ProfilingMiddleware, see the admin's request profiles.
+PROFILING = {
+    "SAMPLE_RATE": 0.01,
+    "HEADER": "X-Profile",
+}
+
+# Library.metrics, served at /metrics. Every worker process writes its
+# values to DIR, the endpoint adds them up.
+METRICS = {
+    "DIR": BASE_DIR / "cache" / "metrics",
+    "FLUSH_INTERVAL": 5,
+    # Scrapers from these addresses don't need to sign in as staff.
+    "ALLOWED_IPS": INTERNAL_IPS,
+}
+
+# Route the catalog pages to Library.async_views. asgi.py turns it on; under
+# WSGI every async view would run in an event loop of its own.
+LIBRARY_ASYNC_VIEWS = os.environ.get("LIBRARY_ASYNC_VIEWS", "0") == "1"
+
+if "test" in sys.argv:
+    # Keep test runs from bumping versions and filling the dev server's cache.
+    CACHES["default"]["LOCATION"] = BASE_DIR / "cache" / "test"
+    # Random samples would add queries to the budget tests.
+    PROFILING["SAMPLE_RATE"] = 0
+    METRICS["DIR"] = BASE_DIR / "cache" / "test-metrics"
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -146,6 +200,12 @@ AUTHENTICATION_BACKENDS = [
 
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 
+OPENLIBRARY_CACHE = {
+    "DIR": BASE_DIR / "cache" / "openlibrary",
+    "TTL": 7 * 24 * 60 * 60,
+    "MAX_SIZE": 512 * 2**20,
+}
+
 X_FRAME_OPTIONS = "SAMEORIGIN"
 
 XS_SHARING_ALLOWED_METHODS = ["POST", "GET", "OPTIONS", "PUT", "DELETE"]
@@ -1,9 +1,20 @@
 from django.contrib import admin
+from django.db.models import QuerySet
+from django.http import HttpRequest
 from django.utils.safestring import SafeText, mark_safe
 
 from BookLibrary.settings import MEDIA_URL
 
-from .models import Author, Book, Category, Review
+from . import profiling
+from .models import (
+    Author,
+    Book,
+    Category,
+    ImportJob,
+    Loan,
+    RequestProfile,
+    Review,
+)
 
 
 # Register your models here.
@@ -60,6 +71,7 @@ class BookAdmin(admin.ModelAdmin):
         "publisher_slug",
         "language",
         "pages",
+        "review_count",
         "is_published",
     )
     prepopulated_fields = {"slug": ("name",), "publisher_slug": ("publisher",)}
@@ -77,3 +89,86 @@ class ReviewAdmin(admin.ModelAdmin):
         review_text = review.review_text
 
         return review_text[:50] + ("..." if len(review_text) > 50 else "")
+
+
+@admin.register(Loan)
+class LoanAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "book",
+        "user",
+        "time_borrowed",
+        "due_date",
+        "time_returned",
+        "time_reminded",
+    )
+    list_filter = ("time_returned", "time_reminded")
+    list_select_related = ("book", "user")
+    raw_id_fields = ("book", "user")
+    date_hierarchy = "time_borrowed"
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "method",
+        "bibkey",
+        "status",
+        "attempts",
+        "run_after",
+        "book",
+        "user",
+        "time_update",
+    )
+    list_filter = ("status", "method")
+    search_fields = ("bibkey",)
+    raw_id_fields = ("user", "submitters", "book")
+    readonly_fields = ("time_create", "time_update")
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = (
+        "time_create",
+        "view_name",
+        "method",
+        "path",
+        "status",
+        "total_ms",
+        "db_ms",
+        "queries",
+        "template_ms",
+        "profiled",
+    )
+    list_filter = ("view_name", "method", "status")
+    date_hierarchy = "time_create"
+    search_fields = ("path",)
+    actions = ["capture_profile"]
+
+    def has_add_permission(self, request: HttpRequest) -> bool:
+        return False
+
+    def has_change_permission(self, request: HttpRequest, obj=None) -> bool:
+        return False
+
+    @admin.display(boolean=True, description="cProfile")
+    def profiled(self, profile: RequestProfile) -> bool:
+        return bool(profile.profile)
+
+    @admin.action(description="Profile the next request to the selected views")
+    def capture_profile(self, request: HttpRequest, queryset: QuerySet) -> None:
+        views = set(queryset.values_list("view_name", flat=True))
+        profiling.request_captures(views)
+        self.message_user(
+            request, f"The next request to {', '.join(sorted(views))} is profiled."
+        )
+
+    def changelist_view(self, request: HttpRequest, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        context = getattr(response, "context_data", None)
+        if context and "cl" in context:
+            # Summarizes what the filters and date drill-down selected.
+            samples = context["cl"].queryset.defer("profile", "path")
+            context["view_summaries"] = profiling.summarize(samples)
+        return response
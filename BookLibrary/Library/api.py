@@ -0,0 +1,211 @@
+import json
+from typing import Any, Callable, Optional
+
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import QuerySet
+from django.http import Http404, HttpRequest, HttpResponse
+from django.views.generic import View
+
+from .models import Author, Book, Category
+from .pagination import KeysetPaginator
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# Largest primary key the database holds (signed 64-bit).
+MAX_ID = 2**63 - 1
+
+
+def dumps(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, cls=DjangoJSONEncoder, separators=(",", ":")).encode()
+
+
+class APIResponse(HttpResponse):
+    def __init__(self, data: Any, **kwargs: Any) -> None:
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(content=dumps(data), **kwargs)
+
+
+class APIError(Exception):
+    pass
+
+
+def media_url(name: Optional[str]) -> Optional[str]:
+    return default_storage.url(name) if name else None
+
+
+class CatalogAPIView(View):
+    """
+    Read-only JSON over a catalog model. Rows come from values() over the
+    requested ?fields= only, so nothing else is read or built:
+
+        ?fields=slug,name,rating    sparse fieldset (default_fields if absent)
+        ?slug=a,b or ?id=1,2        up to MAX_LIMIT rows in one query
+        ?sort=...&limit=...&after=  keyset pages, "next" holds the next URL
+    """
+
+    http_method_names = ["get"]
+    # Public name -> ORM path; related paths are joined by values().
+    fields: dict[str, str] = {}
+    default_fields: tuple[str, ...] = ()
+    # Public name -> ordering, the first one is the default.
+    sorts: dict[str, tuple[str, ...]] = {"id": ("pk",)}
+    lookups = ("id", "slug")
+    # Values turned into something JSON can hold.
+    converters: dict[str, Callable[[Any], Any]] = {}
+
+    def get_queryset(self) -> QuerySet:
+        raise NotImplementedError
+
+    def get(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        try:
+            return APIResponse(self.get_data())
+        except APIError as e:
+            return APIResponse({"error": str(e)}, status=400)
+
+    def get_list(self, param: str) -> list[str]:
+        value = self.request.GET.get(param, "")
+        return [item for item in value.split(",") if item]
+
+    def get_fields(self) -> list[str]:
+        names = self.get_list("fields") or list(self.default_fields)
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise APIError(f"Unknown fields: {', '.join(unknown)}")
+        return list(dict.fromkeys(names))
+
+    def get_limit(self) -> int:
+        try:
+            limit = int(self.request.GET.get("limit", DEFAULT_LIMIT))
+        except ValueError:
+            raise APIError("limit must be a number")
+        return min(max(limit, 1), MAX_LIMIT)
+
+    def get_paths(self, names: list[str], *extra: str) -> list[str]:
+        return list(dict.fromkeys([*extra, *(self.fields[name] for name in names)]))
+
+    def serialize(self, rows: list[dict[str, Any]], names: list[str]) -> list[dict]:
+        paths = [(name, self.fields[name], self.converters.get(name)) for name in names]
+        return [
+            {
+                name: convert(row[path]) if convert else row[path]
+                for name, path, convert in paths
+            }
+            for row in rows
+        ]
+
+    def get_data(self) -> dict[str, Any]:
+        names = self.get_fields()
+        queryset = self.get_queryset()
+
+        for lookup in self.lookups:
+            keys = self.get_list(lookup)
+            if not keys:
+                continue
+            if len(keys) > MAX_LIMIT:
+                raise APIError(f"At most {MAX_LIMIT} values of {lookup}")
+            if lookup == "id" and not all(
+                key.isdigit() and int(key) <= MAX_ID for key in keys
+            ):
+                raise APIError(f"id must be numbers up to {MAX_ID}")
+            path = "pk" if lookup == "id" else lookup
+            # The lookup column comes along to put rows in the asked order.
+            rows = queryset.filter(**{f"{path}__in": keys}).values(
+                *self.get_paths(names, path)
+            )
+            found = {str(row[path]): row for row in rows}
+            ordered = [found[key] for key in dict.fromkeys(keys) if key in found]
+            return {"results": self.serialize(ordered, names), "next": None}
+
+        sort = self.request.GET.get("sort", next(iter(self.sorts)))
+        if sort not in self.sorts:
+            raise APIError(f"sort must be one of: {', '.join(self.sorts)}")
+        queryset = queryset.order_by(*self.sorts[sort]).values(*self.get_paths(names))
+        paginator = KeysetPaginator(queryset, self.get_limit())
+        try:
+            page = paginator.page(after=self.request.GET.get("after"))
+        except (Http404, ValidationError, ValueError, TypeError):
+            # A cursor from another sort, or one edited by hand.
+            raise APIError("after is not a valid cursor")
+        next_url = None
+        if page.has_next():
+            query = self.request.GET.copy()
+            query["after"] = page.next_cursor
+            next_url = f"{self.request.path}?{query.urlencode()}"
+        return {"results": self.serialize(page.object_list, names), "next": next_url}
+
+
+class BookAPIView(CatalogAPIView):
+    fields = {
+        "id": "pk",
+        "slug": "slug",
+        "name": "name",
+        "author": "author__slug",
+        "author_name": "author__full_name",
+        "category": "category__slug",
+        "category_name": "category__name",
+        "cover": "book_cover",
+        "description": "description",
+        "publisher": "publisher",
+        "publish_date": "publish_date",
+        "language": "language",
+        "pages": "pages",
+        "is_taken": "is_taken",
+        "return_date": "return_date",
+        "rating": "rating_summary__average",
+        "rating_count": "rating_summary__rating_count",
+        "review_count": "review_count",
+        "time_create": "time_create",
+        "time_update": "time_update",
+    }
+    default_fields = ("id", "slug", "name", "author", "category", "rating")
+    sorts = {
+        "id": ("pk",),
+        "newest": ("-time_create",),
+        "oldest": ("time_create",),
+    }
+    converters = {"cover": media_url, "rating_count": lambda count: count or 0}
+
+    def get_queryset(self) -> QuerySet:
+        return Book.book.published()
+
+
+class AuthorAPIView(CatalogAPIView):
+    fields = {
+        "id": "pk",
+        "slug": "slug",
+        "full_name": "full_name",
+        "country": "country",
+        "bio": "bio",
+        "wiki_page": "wiki_page",
+        "photo": "photo",
+        "time_create": "time_create",
+        "time_update": "time_update",
+    }
+    default_fields = ("id", "slug", "full_name")
+    converters = {"photo": media_url}
+
+    def get_queryset(self) -> QuerySet:
+        return Author.objects.all()
+
+
+class CategoryAPIView(CatalogAPIView):
+    fields = {
+        "id": "pk",
+        "slug": "slug",
+        "name": "name",
+        "cover": "cover",
+    }
+    default_fields = ("id", "slug", "name")
+    converters = {"cover": media_url}
+
+    def get_queryset(self) -> QuerySet:
+        return Category.objects.all()
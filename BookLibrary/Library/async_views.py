@@ -0,0 +1,143 @@
+import asyncio
+from typing import Any
+
+from django.http import Http404, HttpRequest, HttpResponse
+from django.shortcuts import redirect
+from django.views.generic.base import ContextMixin
+
+from .models import Author, Book, Category, Review
+from .pagination import KeysetPage, KeysetPaginator
+from .views import (
+    AuthorView,
+    BookCommentsView,
+    BookView,
+    CategoryView,
+    IndexView,
+    SearchView,
+)
+
+# Async versions of the read-heavy catalog pages, routed instead of the sync
+# ones when LIBRARY_ASYNC_VIEWS is on (asgi.py turns it on). Independent reads
+# are gathered; Django runs the ORM of one request on one sync thread, so
+# they don't overlap on the database, but the event loop isn't held while
+# they run. Templates are rendered on that thread as well.
+
+
+async def alist(queryset: Any) -> list[Any]:
+    return [obj async for obj in queryset]
+
+
+class AsyncListMixin:
+    async def get_page(self) -> KeysetPage:
+        paginator = KeysetPaginator(
+            self.get_queryset(), self.paginate_by, self.count_mode
+        )
+        return await paginator.apage(
+            after=self.request.GET.get("after"),
+            before=self.request.GET.get("before"),
+        )
+
+    def get_page_context(self, page: KeysetPage, **kwargs: Any) -> dict[str, Any]:
+        # ListView.get_context_data() would paginate again, synchronously.
+        self.object_list = page.object_list
+        return ContextMixin.get_context_data(
+            self,
+            paginator=page.paginator,
+            page_obj=page,
+            is_paginated=page.has_other_pages(),
+            object_list=page.object_list,
+            **{self.context_object_name: page.object_list},
+            **kwargs,
+        )
+
+
+class AsyncIndexView(IndexView):
+    async def get(
+        self, request: HttpRequest, *args: Any, **kwargs: Any
+    ) -> HttpResponse:
+        # The sections are lazy and mostly served from cached fragments.
+        return self.render_to_response(self.get_context_data(**kwargs))
+
+
+class AsyncAuthorView(AuthorView):
+    async def get(
+        self, request: HttpRequest, *args: Any, **kwargs: Any
+    ) -> HttpResponse:
+        slug = self.kwargs["slug"]
+        try:
+            author, related_books = await asyncio.gather(
+                Author.objects.aget_cached(slug=slug),
+                alist(Book.book.top_rated().filter(author__slug=slug)),
+            )
+        except Author.DoesNotExist:
+            raise Http404("No Author matches the given query.")
+        context = ContextMixin.get_context_data(
+            self,
+            title=author.full_name,
+            author=author,
+            related_books=related_books,
+            **kwargs,
+        )
+        return self.render_to_response(context)
+
+
+class AsyncCategoryView(AsyncListMixin, CategoryView):
+    async def get(
+        self, request: HttpRequest, *args: Any, **kwargs: Any
+    ) -> HttpResponse:
+        try:
+            category, page = await asyncio.gather(
+                Category.objects.aget_cached(slug=self.kwargs["slug"]),
+                self.get_page(),
+            )
+        except Category.DoesNotExist:
+            raise Http404("No Category matches the given query.")
+        return self.render_to_response(self.get_page_context(page, category=category))
+
+
+class AsyncSearchView(AsyncListMixin, SearchView):
+    async def get(
+        self, request: HttpRequest, *args: Any, **kwargs: Any
+    ) -> HttpResponse:
+        page = await self.get_page()
+        context = self.get_page_context(
+            page,
+            search=request.GET.get("q", ""),
+            publisher=request.GET.get("publisher", None),
+        )
+        return self.render_to_response(context)
+
+
+class AsyncBookView(BookView):
+    async def aget_book(self) -> Book:
+        # Usually already loaded for the ETag, on the sync thread.
+        if not hasattr(self, "book"):
+            try:
+                self.book = await Book.book.detail(self.request.user).aget(
+                    slug=self.kwargs["slug"]
+                )
+            except Book.DoesNotExist:
+                raise Http404("No Book matches the given query.")
+        return self.book
+
+    async def get(
+        self, request: HttpRequest, *args: Any, **kwargs: Any
+    ) -> HttpResponse:
+        error = request.GET.get("error", None)
+        if error and len(errors := error.split("?")) > 1:
+            return redirect(request.path + "?" + errors[-1])
+
+        book = await self.aget_book()
+        comments = await KeysetPaginator(
+            Review.objects.for_book(book.pk), BookCommentsView.paginate_by
+        ).apage()
+        context = ContextMixin.get_context_data(
+            self,
+            book=book,
+            comments=comments.object_list,
+            page_obj=comments,
+            error=error,
+            stars=range(5, 0, -1),
+            **kwargs,
+        )
+        return self.render_to_response(context)
@@ -0,0 +1,178 @@
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator, TypeVar
+
+from asgiref.sync import sync_to_async
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db import models
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+T = TypeVar("T")
+
+LOCK_TIMEOUT = 30
+WAIT_INTERVAL = 0.05
+
+_missing = object()
+_local_lock = threading.Lock()
+
+
+@contextmanager
+def atomic() -> Iterator[None]:
+    """
+    Makes the cache.add() and cache.incr() calls in it atomic. Redis and
+    Memcached do that themselves; FileBasedCache reads and then writes, so
+    every process takes a lock file in the cache directory around them.
+    """
+    backend = caches[DEFAULT_CACHE_ALIAS]
+    if not isinstance(backend, FileBasedCache):
+        yield
+        return
+    if fcntl is None:
+        # Only threads of this process are kept apart.
+        with _local_lock:
+            yield
+        return
+    os.makedirs(backend._dir, exist_ok=True)
+    # flock() locks belong to the open file, so threads exclude each other too.
+    with open(os.path.join(backend._dir, "atomic.lock"), "a") as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+# Cached values are stored under "<name>:<version>". Invalidation only bumps
+# the version, so stale entries are never read again and simply expire.
+def get_versions(*names: str) -> list[int]:
+    keys = [f"{name}:version" for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # A clock based start can't collide with a version evicted earlier.
+            with atomic():
+                cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def get_version(name: str) -> int:
+    return get_versions(name)[0]
+
+
+def bump_version(*names: str) -> None:
+    with atomic():
+        for name in names:
+            try:
+                cache.incr(f"{name}:version")
+            except ValueError:
+                cache.set(f"{name}:version", time.time_ns(), None)
+
+
+def get_cached(name: str, default: Any = None) -> Any:
+    return cache.get(f"{name}:{get_version(name)}", default)
+
+
+def add_lock(lock: str) -> bool:
+    with atomic():
+        return cache.add(lock, 1, LOCK_TIMEOUT)
+
+
+def get_or_build(
+    name: str,
+    build: Callable[[], T],
+    timeout: int | None = None,
+    versions: Iterable[str] = (),
+) -> T:
+    """
+    Cache-aside read of name's current version, or of the combined versions
+    of the names it depends on. After an invalidation only the worker holding
+    the lock runs build(); the others serve the previous value meanwhile, or
+    wait for the new one if there's nothing to serve.
+    """
+    versions = tuple(versions) or (name,)
+    key = f"{name}:{'.'.join(map(str, get_versions(*versions)))}"
+    value = cache.get(key, _missing)
+    if value is not _missing:
+        return value
+
+    lock = f"{key}:lock"
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while not add_lock(lock):
+        stale = cache.get(f"{name}:stale", _missing)
+        if stale is not _missing:
+            return stale
+        time.sleep(WAIT_INTERVAL)
+        value = cache.get(key, _missing)
+        if value is not _missing:
+            return value
+        if time.monotonic() > deadline:
+            return build()
+
+    try:
+        value = build()
+        cache.set_many({key: value, f"{name}:stale": value}, timeout)
+    finally:
+        cache.delete(lock)
+    return value
+
+
+def model_version(model: type[models.Model]) -> str:
+    return model._meta.label_lower
+
+
+def invalidate_model(*model_classes: type[models.Model]) -> None:
+    bump_version(*(model_version(model) for model in model_classes))
+
+
+class CachedManager(models.Manager):
+    """
+    Manager with a cache-aside get_cached(). Entries depend on the version of the
+    model and of every model in cache_related (the select_related ones),
+    which signals bump on save and delete.
+    """
+
+    cache_related: tuple[str, ...] = ()
+    cache_timeout = 5 * 60
+
+    def get_cached(self, **lookup: Any) -> models.Model:
+        model = self.model
+        lookup = {
+            field: value.pk if isinstance(value, models.Model) else value
+            for field, value in lookup.items()
+        }
+        query = "&".join(f"{field}={value}" for field, value in sorted(lookup.items()))
+        digest = hashlib.md5(query.encode()).hexdigest()
+        related = [
+            model._meta.get_field(field).related_model for field in self.cache_related
+        ]
+
+        def fetch() -> models.Model | None:
+            queryset = self.get_queryset().select_related(*self.cache_related)
+            # Misses are cached too, so a bad slug doesn't hit the database.
+            return queryset.filter(**lookup).first()
+
+        obj = get_or_build(
+            f"{model_version(model)}:get:{digest}",
+            fetch,
+            self.cache_timeout,
+            versions=[model_version(m) for m in (model, *related)],
+        )
+        if obj is None:
+            raise model.DoesNotExist(
+                f"{model._meta.object_name} matching {query} does not exist."
+            )
+        return obj
+
+    async def aget_cached(self, **lookup: Any) -> models.Model:
+        # The cache lock waits in get_or_build() are blocking, so the whole
+        # lookup runs on the request's sync thread, like the async ORM does.
+        return await sync_to_async(self.get_cached)(**lookup)
@@ -0,0 +1,120 @@
+import hashlib
+from typing import Any, Optional
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, Max, QuerySet
+from django.http import HttpRequest, HttpResponse
+from django.template.response import SimpleTemplateResponse
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+
+
+def make_etag(*parts: Any) -> str:
+    digest = hashlib.md5("|".join(map(str, parts)).encode()).hexdigest()
+    # Weak: the markup differs between renders by its masked CSRF tokens.
+    return f'W/"{digest}"'
+
+
+def listing_validators(queryset: QuerySet) -> tuple[Any, ...]:
+    # The count catches books leaving the listing, which no timestamp shows.
+    # Listings show author names too, so a rename changes them.
+    totals = queryset.order_by().aggregate(
+        books=Count("pk"),
+        book_update=Max("time_update"),
+        rating_update=Max("rating_summary__time_update"),
+        author_update=Max("author__time_update"),
+    )
+    return (
+        totals["books"],
+        totals["book_update"],
+        totals["rating_update"],
+        totals["author_update"],
+    )
+
+
+class ConditionalGetMixin:
+    """
+    View mixin that answers GET and HEAD requests carrying a matching
+    If-None-Match with 304 Not Modified, before any context is built or
+    template rendered. get_validators() returns what the page depends on,
+    or None to skip the check (e.g. to let the view raise its 404).
+
+    Anonymous pages may be kept by a shared cache for shared_max_age
+    seconds and revalidated after that; signed-in pages, and pages that set
+    a cookie (e.g. by using the CSRF token), are private. Works
+    for async views too, get_validators() then runs on the sync thread.
+    """
+
+    shared_max_age = 60
+
+    def get_validators(self) -> Optional[tuple[Any, ...]]:
+        raise NotImplementedError
+
+    def get_etag(
+        self, request: HttpRequest, *args: Any, **kwargs: Any
+    ) -> Optional[str]:
+        validators = self.get_validators()
+        if validators is None:
+            return None
+        # Signed-in pages show the viewer's name, rating and loans.
+        viewer = request.user.pk if request.user.is_authenticated else "anonymous"
+        return make_etag(request.path, request.GET.urlencode(), viewer, *validators)
+
+    def dispatch(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        if request.method not in ("GET", "HEAD"):
+            return super().dispatch(request, *args, **kwargs)
+        if self.view_is_async:
+            return self.adispatch(request, *args, **kwargs)
+
+        etag = self.get_etag(request, *args, **kwargs)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+        return self.finalize(request, response, etag)
+
+    async def adispatch(
+        self, request: HttpRequest, *args: Any, **kwargs: Any
+    ) -> HttpResponse:
+        # Resolved once here, request.user would query from the event loop.
+        request.user = await request.auser()
+        etag = await sync_to_async(self.get_etag)(request, *args, **kwargs)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = await super().dispatch(request, *args, **kwargs)
+        return self.finalize(request, response, etag)
+
+    def finalize(
+        self, request: HttpRequest, response: HttpResponse, etag: Optional[str]
+    ) -> HttpResponse:
+        # What django.views.decorators.http.condition() does, for both kinds
+        # of views.
+        if etag:
+            response.headers.setdefault("ETag", etag)
+        if isinstance(response, SimpleTemplateResponse) and not response.is_rendered:
+            # Whether the template used the CSRF token is known once it's
+            # rendered.
+            response.add_post_render_callback(
+                lambda response: self.set_cache_control(request, response)
+            )
+        else:
+            self.set_cache_control(request, response)
+        # The header differs by session, and the CSRF token by its cookie.
+        patch_vary_headers(response, ["Cookie"])
+        return response
+
+    def set_cache_control(self, request: HttpRequest, response: HttpResponse) -> None:
+        # A page with a CSRF token sets its cookie, which a shared cache
+        # would refuse to store or hand to every visitor.
+        if (
+            request.user.is_authenticated
+            or request.META.get("CSRF_COOKIE_NEEDS_UPDATE")
+            or response.cookies
+        ):
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            patch_cache_control(
+                response, public=True, max_age=0, s_maxage=self.shared_max_age
+            )
@@ -0,0 +1,85 @@
+from functools import partial
+from typing import Any, Callable, Iterable
+
+from .caching import bump_version, get_cached, get_or_build
+from .models import Book, Category
+
+PREFIX = "Library:home"
+TIMEOUT = 60 * 60
+
+SECTIONS: dict[str, Callable[[], list[Any]]] = {
+    "top_books": lambda: list(Book.book.top_rated()[:4]),
+    "new_books": lambda: list(Book.book.new_books()[:15]),
+    "cats": lambda: list(Category.objects.all().order_by("name")),
+}
+BOOK_SECTIONS = ("top_books", "new_books")
+
+
+def get_section(section: str) -> list[Any]:
+    return get_or_build(f"{PREFIX}:{section}", SECTIONS[section], TIMEOUT)
+
+
+def lazy_section(section: str) -> Callable[[], list[Any]]:
+    # Templates call it only when the cached HTML fragment is missing.
+    return partial(get_section, section)
+
+
+def get_html(section: str, render: Callable[[], str]) -> str:
+    return get_or_build(f"{PREFIX}:{section}:html", render, TIMEOUT)
+
+
+def invalidate(*sections: str) -> None:
+    bump_version(
+        *(f"{PREFIX}:{section}" for section in sections),
+        *(f"{PREFIX}:{section}:html" for section in sections),
+    )
+
+
+def shown_in(section: str, **filters: Any) -> bool:
+    """
+    Whether a cached section holds an object matching filters, e.g.
+    author_id=3. Unknown (nothing cached) counts as shown.
+    """
+    objects = get_cached(f"{PREFIX}:{section}")
+    if objects is None:
+        return True
+    return any(
+        all(getattr(obj, attr) == value for attr, value in filters.items())
+        for obj in objects
+    )
+
+
+def invalidate_books(pks: Iterable[int], published: bool = False) -> None:
+    # A published book may enter either list; any other book only matters
+    # if it is already on the page.
+    pks = set(pks)
+    invalidate(
+        *(
+            section
+            for section in BOOK_SECTIONS
+            if published or any(shown_in(section, pk=pk) for pk in pks)
+        )
+    )
+
+
+def sort_key(average: Any, count: Any) -> tuple:
+    # top_rated() orders NULL averages (unrated books) last.
+    return (average is not None, average or 0, count or 0)
+
+
+def invalidate_rating(summary: Any) -> None:
+    sections = [s for s in BOOK_SECTIONS if shown_in(s, pk=summary.book_id)]
+    if "top_books" not in sections:
+        top = get_cached(f"{PREFIX}:top_books")
+        if (
+            top is None
+            or len(top) < 4
+            or sort_key(summary.average, summary.rating_count)
+            >= sort_key(top[-1].top, top[-1].total_view)
+        ):
+            sections.append("top_books")
+    invalidate(*sections)
+
+
+def invalidate_author(pk: int) -> None:
+    invalidate(*(s for s in BOOK_SECTIONS if shown_in(s, author_id=pk)))
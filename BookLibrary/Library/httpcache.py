@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional
+
+from . import metrics
+
+
+@dataclass(slots=True)
+class Response:
+    status: int
+    data: bytes
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    stored_at: float = 0.0
+
+    def json(self) -> Any:
+        return json.loads(self.data)
+
+
+# Successful GET responses on disk. Entries older than ttl (never, when ttl is
+# None) are revalidated with ETag/Last-Modified; past max_size bytes the least
+# recently used bodies are evicted. Every process using the directory keeps
+# its own size estimate, checked against the disk before evicting; hits and
+# misses are counted in Library.metrics, which adds up all processes.
+class ResponseCache:
+    def __init__(
+        self,
+        directory: Path | str,
+        ttl: Optional[float] = 86400,
+        max_size: int = 256 * 2**20,
+    ) -> None:
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.max_size = max_size
+        self._size: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def count(self, result: str, amount: int = 1) -> None:
+        metrics.registry.inc(metrics.OPENLIBRARY_CACHE, amount, result=result)
+
+    def _paths(self, url: str) -> tuple[Path, Path]:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        folder = self.directory / key[:2]
+        return folder / f"{key}.body", folder / f"{key}.json"
+
+    def _write(self, path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent)
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        os.replace(tmp, path)
+
+    def _entries(self) -> list[Path]:
+        return list(self.directory.glob("*/*.body"))
+
+    def _disk_size(self) -> int:
+        size = 0
+        for path in self._entries():
+            try:
+                size += path.stat().st_size
+            except FileNotFoundError:
+                # Evicted by another process meanwhile.
+                pass
+        return size
+
+    @property
+    def size(self) -> int:
+        if self._size is None:
+            self._size = self._disk_size()
+        return self._size
+
+    def is_fresh(self, response: Response) -> bool:
+        return self.ttl is None or time.time() - response.stored_at < self.ttl
+
+    def get(self, url: str) -> Optional[Response]:
+        body_path, meta_path = self._paths(url)
+        try:
+            meta = json.loads(meta_path.read_bytes())
+            data = body_path.read_bytes()
+            # The body's mtime is the LRU clock. Another process may have
+            # evicted the entry since the read, which makes it a miss.
+            os.utime(body_path)
+        except (OSError, ValueError):
+            return None
+        return Response(
+            status=meta["status"],
+            data=data,
+            etag=meta.get("etag"),
+            last_modified=meta.get("last_modified"),
+            stored_at=meta["stored_at"],
+        )
+
+    def set(self, url: str, response: Response) -> None:
+        body_path, meta_path = self._paths(url)
+        meta = {
+            "url": url,
+            "status": response.status,
+            "etag": response.etag,
+            "last_modified": response.last_modified,
+            "stored_at": response.stored_at or time.time(),
+        }
+        with self._lock:
+            try:
+                old_size = body_path.stat().st_size
+            except FileNotFoundError:
+                old_size = 0
+            size = self.size - old_size + len(response.data)
+            self._write(body_path, response.data)
+            self._write(meta_path, json.dumps(meta).encode())
+            self._size = size
+            if self._size > self.max_size:
+                # Other processes write and evict too.
+                self._size = self._disk_size()
+            if self._size > self.max_size:
+                self._evict()
+
+    def touch(self, url: str, response: Response) -> None:
+        response.stored_at = time.time()
+        _, meta_path = self._paths(url)
+        try:
+            meta = json.loads(meta_path.read_bytes())
+        except (OSError, ValueError):
+            return
+        meta["stored_at"] = response.stored_at
+        self._write(meta_path, json.dumps(meta).encode())
+
+    def _evict(self) -> None:
+        target = self.max_size * 0.9
+        entries = []
+        for body_path in self._entries():
+            try:
+                stat = body_path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, body_path))
+        evicted = 0
+        for _, size, body_path in sorted(entries):
+            if self._size <= target:
+                break
+            body_path.unlink(missing_ok=True)
+            body_path.with_suffix(".json").unlink(missing_ok=True)
+            self._size -= size
+            evicted += 1
+        if evicted:
+            self.count("evicted", evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            for body_path in self._entries():
+                body_path.unlink(missing_ok=True)
+                body_path.with_suffix(".json").unlink(missing_ok=True)
+            self._size = 0
+
+    def stats(self) -> dict[str, int]:
+        """Counts of every process since the metrics were last reset."""
+        stats = dict.fromkeys(metrics.CACHE_RESULTS, 0)
+        for (name, labels), values in metrics.registry.collect().items():
+            if name == metrics.OPENLIBRARY_CACHE.name:
+                result = dict(labels).get("result")
+                if result in stats:
+                    stats[result] += int(values[0])
+        return {
+            **stats,
+            "entries": len(self._entries()),
+            "size": self._disk_size(),
+        }
+
+
+_default_cache: Optional[ResponseCache] = None
+
+
+def get_default_cache() -> Optional[ResponseCache]:
+    global _default_cache
+    from django.conf import settings
+
+    if not settings.configured:
+        return None
+    config = getattr(settings, "OPENLIBRARY_CACHE", None)
+    if not config:
+        return None
+    if _default_cache is None or _default_cache.directory != Path(config["DIR"]):
+        _default_cache = ResponseCache(
+            directory=config["DIR"],
+            ttl=config.get("TTL", 86400),
+            max_size=config.get("MAX_SIZE", 256 * 2**20),
+        )
+    return _default_cache
@@ -0,0 +1,103 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+from typing import Any
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.db import connection, models, transaction
+from django.db.models.fields.files import FieldFile
+from PIL import Image, UnidentifiedImageError
+
+from . import homepage
+from .caching import invalidate_model
+from .models import Author, Book, Category
+
+WIDTHS = (240, 480, 800)
+FORMATS = {"jpeg": "JPEG", "webp": "WEBP"}
+if ".avif" in Image.registered_extensions():
+    FORMATS["avif"] = "AVIF"
+
+# (image field, field holding its variants) for every model with a picture
+IMAGE_FIELDS: dict[type[models.Model], tuple[str, str]] = {
+    Book: ("book_cover", "cover_variants"),
+    Author: ("photo", "photo_variants"),
+    Category: ("cover", "cover_variants"),
+    get_user_model(): ("photo", "photo_variants"),
+}
+
+executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-variants")
+
+
+def variant_name(name: str, digest: str, width: int, ext: str) -> str:
+    path = PurePosixPath(name)
+    return str(path.with_name(f"{path.stem}.{digest[:12]}.{width}w.{ext}"))
+
+
+def build_variants(image: FieldFile) -> dict[str, Any]:
+    variants: dict[str, Any] = {"source": image.name}
+    try:
+        with image.open("rb") as fp:
+            content = fp.read()
+        original = Image.open(BytesIO(content))
+        original.load()
+    except (OSError, UnidentifiedImageError):
+        # Missing files and formats Pillow can't read (the default SVG cover)
+        # are served as they are.
+        return variants
+
+    digest = hashlib.sha256(content).hexdigest()
+    widths = [width for width in WIDTHS if width < original.width] or [original.width]
+    storage = image.storage
+
+    for ext, pil_format in FORMATS.items():
+        variants[ext] = []
+        for width in widths:
+            name = variant_name(image.name, digest, width, ext)
+            if not storage.exists(name):
+                resized = original.copy()
+                resized.thumbnail((width, original.height * width // original.width))
+                if pil_format == "JPEG" and resized.mode != "RGB":
+                    resized = resized.convert("RGB")
+                buffer = BytesIO()
+                resized.save(buffer, pil_format, quality=80)
+                name = storage.save(name, ContentFile(buffer.getvalue()))
+            variants[ext].append([width, name])
+    return variants
+
+
+def store_variants(model: type[models.Model], pk: Any) -> None:
+    image_field, variants_field = IMAGE_FIELDS[model]
+    instance = model.objects.only(image_field).get(pk=pk)
+    variants = build_variants(getattr(instance, image_field))
+    # update() instead of save() so post_save does not schedule this again,
+    # and only while the image is still the one the variants were built from.
+    updated = model.objects.filter(pk=pk, **{image_field: variants["source"]}).update(
+        **{variants_field: variants}
+    )
+    if updated:
+        invalidate_model(model)
+    if updated and model is Book:
+        homepage.invalidate_books([pk])
+    elif updated and model is Category:
+        homepage.invalidate("cats")
+
+
+def store_variants_task(model: type[models.Model], pk: Any) -> None:
+    try:
+        store_variants(model, pk)
+    finally:
+        connection.close()
+
+
+def needs_variants(instance: models.Model) -> bool:
+    image_field, variants_field = IMAGE_FIELDS[type(instance)]
+    image = getattr(instance, image_field)
+    variants = getattr(instance, variants_field)
+    return bool(image.name) and variants.get("source") != image.name
+
+
+def schedule_variants(instance: models.Model) -> None:
+    model, pk = type(instance), instance.pk
+    transaction.on_commit(lambda: executor.submit(store_variants_task, model, pk))
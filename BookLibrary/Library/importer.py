@@ -0,0 +1,328 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, Optional, TextIO, TypeVar
+
+from asgiref.sync import async_to_sync
+from django.core.files.base import ContentFile
+from django.db import models, transaction
+from slugify import slugify
+
+from .caching import invalidate_model
+from .models import Author, Book, Category
+from .openlibrary import AsyncAPI
+from .images import needs_variants, schedule_variants
+from .search import get_backend
+
+M = TypeVar("M", bound=models.Model)
+
+LANGUAGES = {
+    "English": Book.Language.EN,
+    "Russian": Book.Language.RU,
+    "Belarusian": Book.Language.BY,
+}
+
+
+@dataclass
+class ImportReport:
+    total: int = 0
+    processed: int = 0
+    skipped: int = 0
+    authors_created: int = 0
+    books_created: int = 0
+    not_found: list[str] = field(default_factory=list)
+    failed: dict[str, str] = field(default_factory=dict)
+    books: dict[str, str] = field(default_factory=dict)
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self) -> float:
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.processed}/{self.total - self.skipped} keys in {self.elapsed:.1f}s "
+            f"({self.rate:.1f} keys/s), skipped {self.skipped}, "
+            f"created {self.books_created} books and {self.authors_created} authors, "
+            f"{len(self.not_found)} not found, {len(self.failed)} failed"
+        )
+
+
+def read_bibkeys(stream: TextIO) -> Iterator[str]:
+    for line in stream:
+        key = line.split("#")[0].strip()
+        if key:
+            yield key
+
+
+def chunks(items: list[str], size: int) -> Iterator[list[str]]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def text_value(value: Any) -> Optional[str]:
+    # OpenLibrary returns long texts either as plain strings or typed objects.
+    if isinstance(value, dict):
+        return value.get("value")
+    return value
+
+
+async def fetch_batch(
+    api: AsyncAPI, keys: list[str], bibkey: str
+) -> dict[str, dict[str, Any] | BaseException]:
+    books = await api.get_books(ids=keys, bibkey=bibkey)
+
+    olids: dict[str, str | BaseException] = {}
+    for key, book in books.items():
+        try:
+            olids[key] = book.author_olid
+        except Exception as e:
+            olids[key] = e
+
+    unique_olids = list({olid for olid in olids.values() if isinstance(olid, str)})
+    authors, details = await asyncio.gather(
+        asyncio.gather(
+            *(api.get_author(olid=olid) for olid in unique_olids),
+            return_exceptions=True,
+        ),
+        asyncio.gather(
+            *(api.get_details(url=book.url) for book in books.values()),
+            return_exceptions=True,
+        ),
+    )
+    authors_by_olid = dict(zip(unique_olids, authors))
+
+    result: dict[str, dict[str, Any] | BaseException] = {}
+    for (key, book), detail in zip(books.items(), details):
+        olid = olids[key]
+        author = authors_by_olid[olid] if isinstance(olid, str) else olid
+        if isinstance(author, BaseException):
+            result[key] = author
+        elif isinstance(detail, BaseException):
+            result[key] = detail
+        else:
+            desq, lang = detail
+            result[key] = book.to_dict(
+                author=author.get_ready_dict(), desq=desq, lang=lang
+            )
+    return result
+
+
+async def download_all(
+    api: AsyncAPI, urls: list[Optional[str]]
+) -> list[Optional[bytes]]:
+    async def download(url: Optional[str]) -> Optional[bytes]:
+        if not url:
+            return None
+        try:
+            return await api.download(url=url)
+        except Exception:
+            return None
+
+    return await asyncio.gather(*(download(url) for url in urls))
+
+
+def insert_new(objs: list[M], file_field: str, *fields: str) -> list[M]:
+    """
+    bulk_create() the objects and return the ones that were inserted. A slug
+    another import took in the meantime is skipped by the database; the
+    files saved for those objects are deleted again.
+    """
+    if not objs:
+        return []
+    model = type(objs[0])
+    model.objects.bulk_create(objs, ignore_conflicts=True)
+    columns = [model._meta.get_field(name).attname for name in fields]
+    stored = {
+        slug: rest
+        for slug, *rest in model.objects.filter(
+            slug__in=[obj.slug for obj in objs]
+        ).values_list("slug", file_field, *columns)
+    }
+    default = model._meta.get_field(file_field).default
+    inserted = []
+    for obj in objs:
+        file = getattr(obj, file_field)
+        if stored.get(obj.slug) == [file.name, *(getattr(obj, c) for c in columns)]:
+            inserted.append(obj)
+        elif file.name != default:
+            file.delete(save=False)
+    return inserted
+
+
+def save_batch(
+    api: AsyncAPI,
+    data: dict[str, dict[str, Any]],
+    category: Category,
+    report: ImportReport,
+) -> None:
+    """
+    Saves a fetched batch. Photos and covers are downloaded first, outside
+    the transaction: SQLite holds its write lock from the first insert to
+    the commit, and every other writer would wait on the downloads. Rows
+    another import inserts in the meantime are skipped by insert_new().
+    """
+    names = {book["author"]["name"] for book in data.values()}
+    by_name = {a.full_name: a for a in Author.objects.filter(full_name__in=names)}
+    # Spellings of one name ("J.R.R." and "J. R. R.") share a slug, and so an
+    # author.
+    author_slugs = {name: slugify(name) for name in names if name not in by_name}
+    by_slug = {a.slug: a for a in Author.objects.filter(slug__in=author_slugs.values())}
+
+    new_authors: dict[str, dict[str, Any]] = {}
+    for book in data.values():
+        slug = author_slugs.get(book["author"]["name"])
+        if slug and slug not in by_slug:
+            new_authors.setdefault(slug, book["author"])
+
+    slugs = {key: slugify(book["title"]) for key, book in data.items()}
+    existing = set(
+        Book.objects.filter(slug__in=slugs.values()).values_list("slug", flat=True)
+    )
+    new_books: dict[str, dict[str, Any]] = {}
+    for key, book in data.items():
+        if slugs[key] not in existing:
+            new_books.setdefault(slugs[key], book)
+
+    downloads = async_to_sync(download_all)(
+        api,
+        [author["photo"] for author in new_authors.values()]
+        + [(book["cover"] or {}).get("medium") for book in new_books.values()],
+    )
+    photos = dict(zip(new_authors, downloads))
+    covers = dict(zip(new_books, downloads[len(new_authors) :]))
+
+    with transaction.atomic():
+        author_objs = []
+        for slug, author in new_authors.items():
+            obj = Author(
+                full_name=author["name"],
+                slug=slug,
+                bio=text_value(author["bio"]),
+                wiki_page=author["wikipedia"],
+            )
+            if photos[slug]:
+                obj.photo.save(
+                    author["photo"].split("/")[-1],
+                    ContentFile(photos[slug]),
+                    save=False,
+                )
+            author_objs.append(obj)
+        authors_created = insert_new(author_objs, "photo", "full_name")
+        report.authors_created += len(authors_created)
+        by_slug.update({a.slug: a for a in Author.objects.filter(slug__in=new_authors)})
+
+        def author_of(book: dict[str, Any]) -> Optional[Author]:
+            name = book["author"]["name"]
+            return by_name.get(name) or by_slug.get(author_slugs.get(name, ""))
+
+        for key, book in data.items():
+            if author_of(book) is None:
+                report.failed[key] = (
+                    f"No author could be saved as {book['author']['name']!r}"
+                )
+
+        book_objs = []
+        for slug, book in new_books.items():
+            author = author_of(book)
+            if author is None:
+                continue
+            publisher = (book["publishers"] or [""])[0]
+            obj = Book(
+                name=book["title"],
+                slug=slug,
+                author=author,
+                category=category,
+                description=text_value(book["desq"]) or "",
+                pages=book["num_pages"],
+                publisher=publisher,
+                publisher_slug=slugify(publisher),
+                preview=book["preview"]["embed"],
+                language=LANGUAGES.get(book["lang"], Book.Language.UNSELECTED),
+                is_published=Book.Status.PUBLISHED,
+                publish_date=book["publish_date"],
+            )
+            if covers[slug]:
+                url = book["cover"]["medium"]
+                obj.book_cover.save(
+                    url.split("/")[-1], ContentFile(covers[slug]), save=False
+                )
+            book_objs.append(obj)
+        books_created = insert_new(book_objs, "book_cover", "name", "author")
+        report.books_created += len(books_created)
+        get_backend().index_books(slug__in=[obj.slug for obj in books_created])
+
+    # bulk_create skips post_save, so indexing (above), cache invalidation
+    # and image variants happen here.
+    invalidate_model(Author, Book)
+    for model, slugs_created in (
+        (Author, [obj.slug for obj in authors_created]),
+        (Book, [obj.slug for obj in books_created]),
+    ):
+        for instance in model.objects.filter(slug__in=slugs_created):
+            if needs_variants(instance):
+                schedule_variants(instance)
+
+    # Books whose slug was taken, here or by another import, are that book.
+    for key, slug in slugs.items():
+        if key not in report.failed:
+            report.books[key] = slug
+
+
+def load_state(state_path: Optional[Path]) -> set[str]:
+    if state_path is None or not state_path.exists():
+        return set()
+    with open(state_path) as fp:
+        return set(read_bibkeys(fp))
+
+
+def save_state(state_path: Optional[Path], keys: list[str]) -> None:
+    if state_path is None:
+        return
+    with open(state_path, "a") as fp:
+        fp.writelines(f"{key}\n" for key in keys)
+
+
+def import_bibkeys(
+    keys: Iterable[str],
+    bibkey: str = "ISBN",
+    category: Optional[Category] = None,
+    batch_size: int = 50,
+    state_path: Optional[Path] = None,
+    progress: Optional[Callable[[ImportReport], None]] = None,
+    api: Optional[AsyncAPI] = None,
+) -> ImportReport:
+    api = api or AsyncAPI()
+    category = category or Category.objects.get(pk=1)
+    keys = list(dict.fromkeys(keys))
+    done = load_state(state_path)
+    pending = [key for key in keys if key not in done]
+    report = ImportReport(total=len(keys), skipped=len(keys) - len(pending))
+
+    for batch in chunks(pending, batch_size):
+        try:
+            fetched = async_to_sync(fetch_batch)(api, batch, bibkey)
+        except Exception as e:
+            report.failed.update({key: str(e) for key in batch})
+        else:
+            data = {}
+            for key in batch:
+                result = fetched.get(key)
+                if result is None:
+                    report.not_found.append(key)
+                elif isinstance(result, BaseException):
+                    report.failed[key] = str(result)
+                else:
+                    data[key] = result
+            save_batch(api, data, category, report)
+        save_state(state_path, [key for key in batch if key not in report.failed])
+        report.processed += len(batch)
+        if progress:
+            progress(report)
+
+    return report
@@ -0,0 +1,78 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Optional
+
+from django.db import close_old_connections, connection
+
+from .importer import import_bibkeys
+from .models import Book, ImportJob
+
+STALE_TIMEOUT = timedelta(minutes=10)
+# How often the supervisor hands jobs of dead workers back to the queue.
+REQUEUE_INTERVAL = 60.0
+
+
+def run_job(job: ImportJob) -> None:
+    try:
+        report = import_bibkeys([job.bibkey], bibkey=job.method)
+    except Exception as e:
+        return job.retry_or_fail(str(e))
+
+    if job.bibkey in report.failed:
+        return job.retry_or_fail(report.failed[job.bibkey])
+
+    slug = report.books.get(job.bibkey)
+    book = Book.objects.filter(slug=slug).first() if slug else None
+    if book is None:
+        return job.fail("Book not found")
+
+    job.finish(book)
+
+
+def run_next() -> bool:
+    job = ImportJob.objects.claim()
+    if job is None:
+        return False
+    run_job(job)
+    return True
+
+
+def work(stop: threading.Event, poll_interval: float, once: bool) -> int:
+    done = 0
+    try:
+        while not stop.is_set():
+            close_old_connections()
+            if run_next():
+                done += 1
+            elif once:
+                break
+            else:
+                stop.wait(poll_interval)
+    finally:
+        connection.close()
+    return done
+
+
+def run_workers(
+    workers: int = 4,
+    poll_interval: float = 2.0,
+    once: bool = False,
+    stop: Optional[threading.Event] = None,
+) -> int:
+    stop = stop or threading.Event()
+    ImportJob.objects.requeue_stale(STALE_TIMEOUT)
+    requeued = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(work, stop, poll_interval, once) for _ in range(workers)]
+        try:
+            while not all(future.done() for future in futures):
+                # Another worker process may have died holding jobs since.
+                if time.monotonic() - requeued >= REQUEUE_INTERVAL:
+                    ImportJob.objects.requeue_stale(STALE_TIMEOUT)
+                    requeued = time.monotonic()
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            stop.set()
+    return sum(future.result() for future in futures)
@@ -0,0 +1,367 @@
+import asyncio
+import itertools
+import random
+import resource
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import timedelta
+from io import BytesIO, StringIO
+from typing import Any, Callable, Iterator, Optional
+from urllib.parse import urlsplit
+
+from django.contrib.auth import get_user_model
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from .models import Author, Book, Category
+from .profiling import percentile
+from .testdata import WORDS, zipf_weights
+
+DEFAULT_MIX = {"browse": 60, "search": 20, "rate": 15, "borrow": 5}
+
+# (method, url, POST data)
+Step = tuple[str, str, dict[str, Any]]
+
+
+@dataclass
+class ViewStats:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+
+    def summary(self, elapsed: float) -> dict[str, Any]:
+        latencies = sorted(self.latencies)
+        return {
+            "requests": len(latencies),
+            "errors": self.errors,
+            "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        }
+
+
+@dataclass
+class LoadReport:
+    views: dict[str, ViewStats] = field(default_factory=lambda: defaultdict(ViewStats))
+    elapsed: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, view: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            stats = self.views[view]
+            stats.latencies.append(seconds)
+            stats.errors += not ok
+
+    def summary(self) -> dict[str, Any]:
+        total = ViewStats(
+            latencies=[s for v in self.views.values() for s in v.latencies],
+            errors=sum(v.errors for v in self.views.values()),
+        )
+        return {
+            "elapsed": round(self.elapsed, 2),
+            "total": total.summary(self.elapsed),
+            "views": {
+                name: stats.summary(self.elapsed)
+                for name, stats in sorted(self.views.items())
+            },
+        }
+
+
+class Catalog:
+    """
+    What the simulated readers pick from, with the most rated books and the
+    biggest categories the most likely, like the traffic on a real shelf.
+    """
+
+    def __init__(self, rng: random.Random, skew: float) -> None:
+        self.rng = rng
+        self.books = list(
+            Book.book.top_rated()
+            .order_by("-total_view", "pk")
+            .values_list("pk", "slug")[:5000]
+        )
+        self.categories = list(
+            Category.objects.annotate(books=Count("book"))
+            .order_by("-books", "pk")
+            .values_list("slug", flat=True)
+        )
+        if not self.books or not self.categories:
+            raise ValueError("Nothing to browse, generate some data first")
+        self.book_weights = zipf_weights(len(self.books), skew)
+        self.category_weights = zipf_weights(len(self.categories), skew)
+        self.users = list(
+            get_user_model().objects.order_by("pk").values_list("pk", flat=True)
+        )
+        self.authors = list(
+            Author.objects.annotate(books=Count("book"))
+            .order_by("-books", "pk")
+            .values_list("slug", flat=True)[:5000]
+        )
+        self.author_weights = zipf_weights(len(self.authors), skew)
+
+    def book(self) -> tuple[int, str]:
+        return self.rng.choices(self.books, cum_weights=self.book_weights)[0]
+
+    def category(self) -> str:
+        return self.rng.choices(self.categories, cum_weights=self.category_weights)[0]
+
+    def author(self) -> str:
+        return self.rng.choices(self.authors, cum_weights=self.author_weights)[0]
+
+
+def browse(catalog: Catalog) -> Iterator[Step]:
+    yield "get", reverse("Lib:home"), {}
+    slug = catalog.category()
+    yield "get", reverse("Lib:category", kwargs={"slug": slug}), {}
+    _, slug = catalog.book()
+    yield "get", reverse("Lib:book", kwargs={"slug": slug}), {}
+
+
+def search(catalog: Catalog) -> Iterator[Step]:
+    query = " ".join(catalog.rng.sample(WORDS, catalog.rng.randint(1, 2)))
+    yield "get", f"{reverse('Lib:search')}?q={query}", {}
+    _, slug = catalog.book()
+    yield "get", reverse("Lib:book", kwargs={"slug": slug}), {}
+
+
+def rate(catalog: Catalog) -> Iterator[Step]:
+    pk, slug = catalog.book()
+    yield "get", reverse("Lib:book", kwargs={"slug": slug}), {}
+    data = {"book_id": pk, "rate": catalog.rng.randint(1, 5)}
+    yield "post", reverse("Lib:book_rate", kwargs={"slug": slug}), data
+
+
+def borrow(catalog: Catalog) -> Iterator[Step]:
+    pk, slug = catalog.book()
+    return_date = timezone.now().date() + timedelta(days=14)
+    data = {"book_id": pk, "return_date": return_date.isoformat()}
+    yield "post", reverse("Lib:book_borrow", kwargs={"slug": slug}), data
+    yield "get", reverse("Lib:my_shelf"), {}
+    yield "post", reverse("Lib:book_return", kwargs={"slug": slug}), {"book_id": pk}
+
+
+SCENARIOS: dict[str, Callable[[Catalog], Iterator[Step]]] = {
+    "browse": browse,
+    "search": search,
+    "rate": rate,
+    "borrow": borrow,
+}
+
+
+def run(
+    requests: int = 1000,
+    concurrency: int = 4,
+    mix: Optional[dict[str, int]] = None,
+    skew: float = 1.1,
+    rng_seed: int = 0,
+    host: str = "127.0.0.1",
+) -> LoadReport:
+    """
+    Replays a browse/search/rate/borrow mix against the WSGI handler from
+    concurrency threads, each a signed-in reader with its own Client, until
+    about requests requests have been made. Writes go to the configured
+    database.
+    """
+    mix = mix or DEFAULT_MIX
+    report = LoadReport()
+    budget = itertools.count()
+    seeds = random.Random(rng_seed)
+    worker_seeds = [seeds.random() for _ in range(concurrency)]
+
+    def worker(index: int) -> None:
+        rng = random.Random(worker_seeds[index])
+        catalog = Catalog(rng, skew)
+        client = Client(
+            raise_request_exception=False,
+            HTTP_HOST=host,
+            HTTP_REFERER=f"http://{host}/",
+        )
+        user = get_user_model().objects.get(
+            pk=catalog.users[index % len(catalog.users)]
+        )
+        client.force_login(user)
+        try:
+            while True:
+                scenario = rng.choices(list(mix), weights=list(mix.values()))[0]
+                for method, url, data in SCENARIOS[scenario](catalog):
+                    if next(budget) >= requests:
+                        return
+                    started = time.perf_counter()
+                    response = getattr(client, method)(url, data)
+                    elapsed = time.perf_counter() - started
+                    view = resolve(url.split("?")[0]).view_name
+                    report.record(view, elapsed, response.status_code < 400)
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        for future in [executor.submit(worker, i) for i in range(concurrency)]:
+            future.result()
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+# The read-only pages behind Library.async_views, weighted like browsing.
+CATALOG_MIX = {"home": 10, "category": 25, "book": 40, "author": 15, "search": 10}
+
+
+def catalog_urls(catalog: Catalog, requests: int) -> list[str]:
+    urls = {
+        "home": lambda: reverse("Lib:home"),
+        "category": lambda: reverse(
+            "Lib:category", kwargs={"slug": catalog.category()}
+        ),
+        "book": lambda: reverse("Lib:book", kwargs={"slug": catalog.book()[1]}),
+        "author": lambda: reverse("Lib:author", kwargs={"slug": catalog.author()}),
+        "search": lambda: reverse("Lib:search") + "?q=" + catalog.rng.choice(WORDS),
+    }
+    pages = catalog.rng.choices(
+        list(CATALOG_MIX), weights=list(CATALOG_MIX.values()), k=requests
+    )
+    return [urls[page]() for page in pages]
+
+
+def wsgi_get(app: Callable, url: str, host: str) -> int:
+    path, _, query = url.partition("?")
+    environ = {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": path,
+        "QUERY_STRING": query,
+        "SERVER_NAME": host,
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "REMOTE_ADDR": "127.0.0.1",
+        "HTTP_HOST": host,
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": BytesIO(),
+        "wsgi.errors": StringIO(),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    status = []
+    body = app(environ, lambda s, headers, exc_info=None: status.append(s))
+    try:
+        for _ in body:
+            pass
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+    return int(status[0].split()[0])
+
+
+async def asgi_get(app: Callable, url: str, host: str) -> int:
+    parts = urlsplit(url)
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": parts.path,
+        "raw_path": parts.path.encode(),
+        "query_string": parts.query.encode(),
+        "root_path": "",
+        "headers": [(b"host", host.encode())],
+        "client": ("127.0.0.1", 0),
+        "server": (host, 80),
+    }
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+    status = []
+
+    async def receive() -> dict[str, Any]:
+        if messages:
+            return messages.pop()
+        # The client stays connected until the handler is done with it.
+        await asyncio.Future()
+
+    async def send(message: dict[str, Any]) -> None:
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+@dataclass
+class ServerReport(LoadReport):
+    mode: str = ""
+    concurrency: int = 0
+    peak_threads: int = 0
+
+    def summary(self) -> dict[str, Any]:
+        # ru_maxrss is in kilobytes on Linux.
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return {
+            **super().summary(),
+            "mode": self.mode,
+            "concurrency": self.concurrency,
+            "peak_threads": self.peak_threads,
+            "peak_rss_mb": round(peak_rss, 1),
+        }
+
+    def count_threads(self) -> None:
+        self.peak_threads = max(self.peak_threads, threading.active_count())
+
+
+def bench(
+    mode: str,
+    requests: int = 2000,
+    concurrency: int = 100,
+    skew: float = 1.1,
+    rng_seed: int = 0,
+    host: str = "127.0.0.1",
+) -> ServerReport:
+    """
+    Sends requests anonymous GETs for the catalog pages, concurrency at a
+    time, through Django's WSGI handler from as many threads ("wsgi"), or
+    through its ASGI handler from as many tasks on one event loop ("asgi").
+    Read-only. Peak RSS covers the whole process, so compare runs made in
+    fresh processes.
+    """
+    urls = catalog_urls(Catalog(random.Random(rng_seed), skew), requests)
+    views = {url: resolve(url.split("?")[0]).view_name for url in set(urls)}
+    report = ServerReport(mode=mode, concurrency=concurrency)
+
+    def record(url: str, started: float, status: int) -> None:
+        report.record(views[url], time.perf_counter() - started, status < 400)
+        report.count_threads()
+
+    started = time.perf_counter()
+    if mode == "wsgi":
+        app = get_wsgi_application()
+
+        def get(url: str) -> None:
+            started = time.perf_counter()
+            record(url, started, wsgi_get(app, url, host))
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(get, urls))
+    elif mode == "asgi":
+        app = get_asgi_application()
+
+        async def main() -> None:
+            slots = asyncio.Semaphore(concurrency)
+
+            async def get(url: str) -> None:
+                async with slots:
+                    started = time.perf_counter()
+                    record(url, started, await asgi_get(app, url, host))
+
+            await asyncio.gather(*(get(url) for url in urls))
+
+        asyncio.run(main())
+    else:
+        raise ValueError(f"Unknown mode {mode!r}, expected wsgi or asgi")
+    report.elapsed = time.perf_counter() - started
+    return report
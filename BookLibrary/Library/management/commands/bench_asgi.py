@@ -0,0 +1,99 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from Library.loadtest import bench
+
+MODES = ("wsgi", "asgi")
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare requests/sec, latency and memory of the catalog pages under "
+        "the WSGI handler with the sync views and the ASGI handler with "
+        "Library.async_views, at the same concurrency. Each mode runs in a "
+        "fresh process. Read-only."
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=100)
+        parser.add_argument("--skew", type=float, default=1.1)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--mode", choices=[*MODES, "both"], default="both")
+        parser.add_argument("--json", type=Path, help="Also write the report here")
+
+    def handle(self, *args, **options) -> None:
+        if options["mode"] == "both":
+            reports = [self.spawn(mode, options) for mode in MODES]
+        else:
+            reports = [self.run(options["mode"], options)]
+
+        header = f"{'mode':<6}{'requests':>9}{'errors':>8}{'rps':>9}"
+        header += f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'threads':>9}{'RSS MB':>9}"
+        self.stdout.write(header)
+        for report in reports:
+            total = report["total"]
+            self.stdout.write(
+                f"{report['mode']:<6}{total['requests']:>9}{total['errors']:>8}"
+                f"{total['rps']:>9}{total['p50_ms']:>9}{total['p95_ms']:>9}"
+                f"{total['p99_ms']:>9}{report['peak_threads']:>9}"
+                f"{report['peak_rss_mb']:>9}"
+            )
+
+        if options["json"]:
+            data = reports if len(reports) > 1 else reports[0]
+            options["json"].write_text(json.dumps(data, indent=2))
+
+    def spawn(self, mode: str, options: dict) -> dict:
+        # The URLconf picks the views when it's imported, and peak RSS is per
+        # process, so every mode gets a process of its own.
+        with tempfile.TemporaryDirectory() as tmp:
+            report = Path(tmp) / "report.json"
+            env = {**os.environ, "LIBRARY_ASYNC_VIEWS": "1" if mode == "asgi" else "0"}
+            command = [
+                sys.executable,
+                str(settings.BASE_DIR / "manage.py"),
+                "bench_asgi",
+                f"--mode={mode}",
+                f"--requests={options['requests']}",
+                f"--concurrency={options['concurrency']}",
+                f"--skew={options['skew']}",
+                f"--seed={options['seed']}",
+                f"--json={report}",
+            ]
+            result = subprocess.run(command, env=env, stdout=subprocess.DEVNULL)
+            if result.returncode:
+                raise CommandError(f"The {mode} run failed")
+            return json.loads(report.read_text())
+
+    def run(self, mode: str, options: dict) -> dict:
+        if settings.LIBRARY_ASYNC_VIEWS != (mode == "asgi"):
+            raise CommandError(
+                f"The {mode} run needs LIBRARY_ASYNC_VIEWS="
+                f"{'1' if mode == 'asgi' else '0'}, or use --mode both"
+            )
+        # The debug toolbar is sync only and would put every ASGI request
+        # through a thread; query logging would slow both down.
+        middleware = [
+            m for m in settings.MIDDLEWARE if not m.startswith("debug_toolbar")
+        ]
+        with override_settings(DEBUG=False, MIDDLEWARE=middleware):
+            try:
+                report = bench(
+                    mode,
+                    requests=options["requests"],
+                    concurrency=options["concurrency"],
+                    skew=options["skew"],
+                    rng_seed=options["seed"],
+                )
+            except ValueError as e:
+                raise CommandError(e)
+        return report.summary()
@@ -0,0 +1,51 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.utils.safestring import SafeText, mark_safe
+
+from Library.templatetags.tag import build_stars, render_rating
+
+SAMPLES = [
+    (total, count) for count in range(1, 11) for total in range(count, count * 5 + 1)
+]
+
+
+def render_rating_uncached(
+    total_rating: int, total_review: int, show_rating_amount: bool
+) -> SafeText:
+    mark = min(total_rating / total_review, 5.0)
+    full = int(mark)
+    half = mark - full >= 0.5
+
+    res = f"{build_stars(full, half)}<span>{mark if mark.is_integer() else round(mark, 1)}/5</span>"
+    if show_rating_amount:
+        res += f'<span class="dot">·</span><span>{total_review} Ratings</span>'
+    return mark_safe(res)
+
+
+class Command(BaseCommand):
+    help = "Compare per-call cost of the book_rating markup with and without the fragment table"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--number", type=int, default=200)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options) -> None:
+        number, repeat = options["number"], options["repeat"]
+        calls = number * len(SAMPLES)
+
+        for show_rating_amount in (False, True):
+            for name, func in (
+                ("uncached", render_rating_uncached),
+                ("cached", render_rating),
+            ):
+
+                def run() -> None:
+                    for total, count in SAMPLES:
+                        func(total, count, show_rating_amount)
+
+                best = min(timeit.repeat(run, number=number, repeat=repeat))
+                self.stdout.write(
+                    f"show_rating_amount={show_rating_amount!s:<5} {name:>8}: "
+                    f"{best / calls * 1e9:8.1f} ns/call"
+                )
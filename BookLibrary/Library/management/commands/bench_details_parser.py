@@ -0,0 +1,88 @@
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Optional
+
+from bs4 import BeautifulSoup
+from django.core.management.base import BaseCommand
+
+from Library.openlibrary import Book
+
+
+def parse_details_soup(html: bytes) -> tuple[str, Optional[str]]:
+    bs = BeautifulSoup(html, "lxml")
+    container = bs.find("div", attrs={"class": "read-more__content"})
+
+    desq = ""
+
+    for p in container.findAll("p"):  # type: ignore
+        desq += p.text.strip()
+
+    lang = None
+    try:
+        language = bs.find("span", attrs={"itemprop": "inLanguage"})
+        for a in language.findAll("a"):  # type: ignore
+            lang = a.text.strip()
+            break
+    except:
+        lang = None
+
+    return desq, lang
+
+
+def sample_page() -> bytes:
+    # Roughly the shape of an OpenLibrary edition page: the targets sit near
+    # the top and are followed by a long tail of editions, reviews and lists.
+    row = "<li class='searchResultItem'><a href='/works/OL{0}W'>Edition {0}</a><p>Notes {0}</p></li>"
+    tail = "".join(row.format(i) for i in range(20_000))
+    return (
+        "<html><head><title>Sample</title></head><body>"
+        "<div class='book-description'><div class='read-more__content'>"
+        "<p>A long description paragraph.</p><p>Another one.</p></div></div>"
+        "<span itemprop='inLanguage'><a href='/languages/eng'>English</a></span>"
+        f"<ul>{tail}</ul></body></html>"
+    ).encode()
+
+
+def measure(
+    func: Callable[[bytes], tuple], html: bytes, repeat: int
+) -> tuple[float, int]:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(html)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+class Command(BaseCommand):
+    help = "Compare the BeautifulSoup and streaming parsers on saved OpenLibrary pages"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("pages", nargs="*", type=Path, help="Saved HTML pages")
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options) -> None:
+        pages = {path.name: path.read_bytes() for path in options["pages"]}
+        if not pages:
+            pages = {"synthetic": sample_page()}
+
+        for name, html in pages.items():
+            if parse_details_soup(html) != Book.parse_details(html):
+                self.stderr.write(f"{name}: parsers disagree")
+
+            self.stdout.write(f"{name} ({len(html) / 1024:.0f} KiB)")
+            for label, func in (
+                ("beautifulsoup", parse_details_soup),
+                ("streaming", Book.parse_details),
+            ):
+                seconds, peak = measure(func, html, options["repeat"])
+                self.stdout.write(
+                    f"  {label:>13}: {seconds * 1000:8.2f} ms, "
+                    f"peak {peak / 2**20:7.2f} MiB"
+                )
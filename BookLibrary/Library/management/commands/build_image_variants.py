@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from Library.images import IMAGE_FIELDS, needs_variants, store_variants
+
+
+class Command(BaseCommand):
+    help = "Build missing thumbnails and WebP/AVIF variants for every stored image"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "--force", action="store_true", help="Rebuild variants that look current"
+        )
+
+    def handle(self, *args, **options) -> None:
+        for model, (image_field, variants_field) in IMAGE_FIELDS.items():
+            built = 0
+            queryset = model.objects.only("pk", image_field, variants_field)
+            for instance in queryset.iterator():
+                if options["force"] or needs_variants(instance):
+                    store_variants(model, instance.pk)
+                    built += 1
+            self.stdout.write(f"{model._meta.label}: built variants for {built} images")
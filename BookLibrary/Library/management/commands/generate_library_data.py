@@ -0,0 +1,69 @@
+import time
+from dataclasses import fields
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from Library.models import Category
+from Library.testdata import Scale, seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with synthetic categories, authors, books, users, "
+        "ratings and reviews with Zipf-skewed popularity"
+    )
+
+    def add_arguments(self, parser) -> None:
+        for field in fields(Scale):
+            parser.add_argument(f"--{field.name}", type=int, default=field.default)
+        parser.add_argument(
+            "--scale", type=float, default=1.0, help="Multiplies every row count"
+        )
+        parser.add_argument(
+            "--skew", type=float, default=1.1, help="Zipf exponent, 0 is uniform"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--prefix",
+            default="synthetic-",
+            help="Prefix of generated slugs and usernames, must be unused",
+        )
+
+    def handle(self, *args, **options) -> None:
+        prefix = options["prefix"]
+        if (
+            Category.objects.filter(slug__startswith=prefix).exists()
+            or get_user_model().objects.filter(username__startswith=prefix).exists()
+        ):
+            raise CommandError(f"Prefix {prefix!r} is taken, pass another --prefix")
+
+        scale = Scale(
+            **{
+                field.name: max(1, int(options[field.name] * options["scale"]))
+                for field in fields(Scale)
+            }
+        )
+        started = time.monotonic()
+
+        def progress(name: str, total: int) -> None:
+            self.stdout.write(f"{name}: {total}", ending="\r")
+            self.stdout.flush()
+
+        with transaction.atomic():
+            seed(
+                scale,
+                rng_seed=options["seed"],
+                batch_size=options["batch_size"],
+                skew=options["skew"],
+                prefix=prefix,
+                progress=progress,
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Generated {scale} in {time.monotonic() - started:.1f}s"
+            )
+        )
@@ -0,0 +1,53 @@
+import sys
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Library.importer import ImportReport, import_bibkeys, read_bibkeys
+from Library.models import Category
+
+
+class Command(BaseCommand):
+    help = "Import books from OpenLibrary by a list of ISBNs or OLIDs, one per line"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("path", help="File with bibkeys, '-' reads stdin")
+        parser.add_argument("--bibkey", choices=["ISBN", "OLID"], default="ISBN")
+        parser.add_argument("--category", help="Category slug for imported books")
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument(
+            "--state-file",
+            type=Path,
+            help="Processed keys are recorded here, rerunning skips them",
+        )
+
+    def handle(self, *args, **options) -> None:
+        if options["category"]:
+            try:
+                category = Category.objects.get(slug=options["category"])
+            except Category.DoesNotExist:
+                raise CommandError(f"Category {options['category']!r} does not exist")
+        else:
+            category = None
+
+        if options["path"] == "-":
+            keys = list(read_bibkeys(sys.stdin))
+        else:
+            with open(options["path"]) as fp:
+                keys = list(read_bibkeys(fp))
+
+        def progress(report: ImportReport) -> None:
+            self.stdout.write(report.summary())
+
+        report = import_bibkeys(
+            keys,
+            bibkey=options["bibkey"],
+            category=category,
+            batch_size=options["batch_size"],
+            state_path=options["state_file"],
+            progress=progress,
+        )
+
+        for key, error in report.failed.items():
+            self.stderr.write(f"{key}: {error}")
+        self.stdout.write(self.style.SUCCESS(report.summary()))
@@ -0,0 +1,70 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from Library.loadtest import DEFAULT_MIX, SCENARIOS, run
+
+
+def parse_mix(value: str) -> dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS or not weight.isdigit():
+            raise CommandError(
+                f"Bad mix entry {part!r}, expected name=weight with name in "
+                f"{', '.join(SCENARIOS)}"
+            )
+        mix[name] = int(weight)
+    return mix
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a browse/search/rate/borrow mix against the app in-process and "
+        "report latency percentiles and throughput per view. Rates and "
+        "borrows are written to the configured database."
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument(
+            "--mix",
+            type=parse_mix,
+            default=DEFAULT_MIX,
+            help="Scenario weights, e.g. browse=60,search=20,rate=15,borrow=5",
+        )
+        parser.add_argument("--skew", type=float, default=1.1)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--json", type=Path, help="Also write the report here")
+
+    def handle(self, *args, **options) -> None:
+        if settings.DEBUG:
+            self.stderr.write(
+                "DEBUG is on, the debug toolbar and query logging inflate latencies"
+            )
+        try:
+            report = run(
+                requests=options["requests"],
+                concurrency=options["concurrency"],
+                mix=options["mix"],
+                skew=options["skew"],
+                rng_seed=options["seed"],
+            ).summary()
+        except ValueError as e:
+            raise CommandError(e)
+
+        header = f"{'view':<24}{'requests':>9}{'errors':>8}{'rps':>8}"
+        header += f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+        self.stdout.write(header)
+        for name, row in [*report["views"].items(), ("total", report["total"])]:
+            self.stdout.write(
+                f"{name:<24}{row['requests']:>9}{row['errors']:>8}{row['rps']:>8}"
+                f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}"
+            )
+        self.stdout.write(f"{report['elapsed']}s elapsed")
+
+        if options["json"]:
+            options["json"].write_text(json.dumps(report, indent=2))
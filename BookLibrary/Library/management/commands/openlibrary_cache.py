@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from Library.httpcache import get_default_cache
+
+
+class Command(BaseCommand):
+    help = "Show or clear the on-disk OpenLibrary response cache"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("action", choices=["stats", "clear"])
+
+    def handle(self, *args, **options) -> None:
+        cache = get_default_cache()
+        if cache is None:
+            raise CommandError("OPENLIBRARY_CACHE is not configured")
+
+        if options["action"] == "clear":
+            cache.clear()
+            self.stdout.write(self.style.SUCCESS(f"Cleared {cache.directory}"))
+            return
+
+        stats = cache.stats()
+        self.stdout.write(
+            f"{cache.directory}: {stats['entries']} entries, "
+            f"{stats['size'] / 2**20:.1f} MiB of {cache.max_size / 2**20:.0f} MiB"
+        )
+        # From the metrics every process flushes to METRICS["DIR"].
+        self.stdout.write(
+            f"{stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['revalidated']} revalidated, {stats['evicted']} evicted"
+        )
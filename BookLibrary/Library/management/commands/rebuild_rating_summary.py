@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from Library.models import RatingSummary
+
+
+class Command(BaseCommand):
+    help = "Recalculate the denormalized rating summary of every book"
+
+    def handle(self, *args, **options) -> None:
+        total = RatingSummary.objects.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt rating summary for {total} books")
+        )
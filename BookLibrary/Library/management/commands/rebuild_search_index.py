@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from Library.search import get_backend
+
+
+class Command(BaseCommand):
+    help = "Create the book search index if needed and refill it from the catalog"
+
+    def handle(self, *args, **options) -> None:
+        backend = get_backend()
+        backend.setup()
+        backend.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt search index with {type(backend).__name__}")
+        )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from Library.models import Book
+
+
+class Command(BaseCommand):
+    help = "Recalculate the denormalized review count of every book"
+
+    def handle(self, *args, **options) -> None:
+        total = Book.book.recount_reviews()
+        self.stdout.write(self.style.SUCCESS(f"Recounted reviews for {total} books"))
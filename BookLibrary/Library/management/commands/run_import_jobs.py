@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from Library.jobs import run_workers
+
+
+class Command(BaseCommand):
+    help = "Process queued OpenLibrary import jobs"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--poll-interval", type=float, default=2.0)
+        parser.add_argument(
+            "--once", action="store_true", help="Exit when the queue is empty"
+        )
+
+    def handle(self, *args, **options) -> None:
+        done = run_workers(
+            workers=options["workers"],
+            poll_interval=options["poll_interval"],
+            once=options["once"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Processed {done} jobs"))
@@ -0,0 +1,36 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from Library.reminders import SweepReport, sweep_overdue
+
+
+class Command(BaseCommand):
+    help = (
+        "Email a reminder for every loan past its due date and mark it. "
+        "Meant to run periodically, e.g. daily from cron; an interrupted run "
+        "is picked up by the next one."
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--max-batches", type=int, help="Stop after this many batches"
+        )
+        parser.add_argument(
+            "--date",
+            type=date.fromisoformat,
+            help="Treat loans due before this day as overdue, default today",
+        )
+
+    def handle(self, *args, **options) -> None:
+        def progress(report: SweepReport) -> None:
+            self.stdout.write(report.summary())
+
+        report = sweep_overdue(
+            today=options["date"],
+            batch_size=options["batch_size"],
+            max_batches=options["max_batches"],
+            progress=progress if options["verbosity"] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(report.summary()))
@@ -0,0 +1,366 @@
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional, TypeVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import connections
+from django.http import HttpRequest, HttpResponse
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+@dataclass(frozen=True)
+class Metric:
+    name: str
+    help: str
+    kind: str = "counter"
+    buckets: tuple[float, ...] = ()
+
+    def new(self) -> list[float]:
+        # A counter is [value]; a histogram is per bucket counts (the last
+        # one is +Inf), then sum and count.
+        return [0.0] * (len(self.buckets) + 3 if self.kind == "histogram" else 1)
+
+
+HTTP_REQUESTS = Metric(
+    "library_http_requests_total", "Requests by URL name, method and status."
+)
+HTTP_SECONDS = Metric(
+    "library_http_request_duration_seconds",
+    "Request latency by URL name.",
+    "histogram",
+    LATENCY_BUCKETS,
+)
+HTTP_QUERIES = Metric(
+    "library_http_request_queries",
+    "Database queries per request by URL name.",
+    "histogram",
+    QUERY_BUCKETS,
+)
+DB_QUERIES = Metric(
+    "library_db_queries_total", "Database queries by URL name, writes included."
+)
+DB_SECONDS = Metric(
+    "library_db_query_duration_seconds_total", "Database time by URL name."
+)
+BOOK_QUERYSETS = Metric(
+    "library_book_queryset_duration_seconds",
+    "Evaluation time of Book querysets by the BookQuerySet method they came from.",
+    "histogram",
+    LATENCY_BUCKETS,
+)
+OPENLIBRARY_CALLS = Metric(
+    "library_openlibrary_calls_total",
+    "OpenLibrary API calls by call and outcome (ok or error).",
+)
+OPENLIBRARY_SECONDS = Metric(
+    "library_openlibrary_call_duration_seconds",
+    "OpenLibrary API call latency, cache hits included.",
+    "histogram",
+    LATENCY_BUCKETS,
+)
+OPENLIBRARY_RESPONSES = Metric(
+    "library_openlibrary_responses_total",
+    "Responses from openlibrary.org itself (not the disk cache) by status.",
+)
+OPENLIBRARY_CACHE = Metric(
+    "library_openlibrary_cache_total",
+    "OpenLibrary response cache lookups by result (hits, misses, revalidated) "
+    "and entries evicted.",
+)
+CACHE_RESULTS = ("hits", "misses", "revalidated", "evicted")
+
+METRICS = {
+    metric.name: metric
+    for metric in (
+        HTTP_REQUESTS,
+        HTTP_SECONDS,
+        HTTP_QUERIES,
+        DB_QUERIES,
+        DB_SECONDS,
+        BOOK_QUERYSETS,
+        OPENLIBRARY_CALLS,
+        OPENLIBRARY_SECONDS,
+        OPENLIBRARY_RESPONSES,
+        OPENLIBRARY_CACHE,
+    )
+}
+
+
+def get_directory() -> Optional[Path]:
+    from django.conf import settings
+
+    if not settings.configured:
+        return None
+    directory = getattr(settings, "METRICS", {}).get("DIR")
+    return Path(directory) if directory else None
+
+
+def get_flush_interval() -> float:
+    from django.conf import settings
+
+    return getattr(settings, "METRICS", {}).get("FLUSH_INTERVAL", 5.0)
+
+
+# Each process keeps its values in memory and writes them to its own file in
+# METRICS["DIR"] every FLUSH_INTERVAL seconds and at exit; the endpoint adds
+# up every file. No locking across workers, and a restarted worker's counts
+# stay in its old file, as counters should.
+class Registry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.values: dict[tuple[str, Labels], list[float]] = {}
+            self.pid = os.getpid()
+            self.filename = f"{self.pid}-{uuid.uuid4().hex[:8]}.json"
+            self.flushed = time.monotonic()
+
+    def _check_fork(self) -> None:
+        # A forked worker inherits the parent's values and file name.
+        if os.getpid() != self.pid:
+            self.reset()
+
+    def _get(self, metric: Metric, labels: dict[str, Any]) -> list[float]:
+        key = (metric.name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        values = self.values.get(key)
+        if values is None:
+            values = self.values[key] = metric.new()
+        return values
+
+    def inc(self, metric: Metric, amount: float = 1, **labels: Any) -> None:
+        self._check_fork()
+        with self._lock:
+            self._get(metric, labels)[0] += amount
+        self.maybe_flush()
+
+    def observe(self, metric: Metric, value: float, **labels: Any) -> None:
+        self._check_fork()
+        with self._lock:
+            values = self._get(metric, labels)
+            index = next(
+                (i for i, bound in enumerate(metric.buckets) if value <= bound),
+                len(metric.buckets),
+            )
+            values[index] += 1
+            values[-2] += value
+            values[-1] += 1
+        self.maybe_flush()
+
+    def maybe_flush(self) -> None:
+        if time.monotonic() - self.flushed >= get_flush_interval():
+            self.flush()
+
+    def flush(self) -> None:
+        directory = get_directory()
+        if directory is None:
+            return
+        with self._lock:
+            self.flushed = time.monotonic()
+            data = json.dumps(
+                [
+                    [name, dict(labels), values]
+                    for (name, labels), values in self.values.items()
+                ]
+            )
+            directory.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as fp:
+                fp.write(data)
+            os.replace(tmp, directory / self.filename)
+
+    def collect(self) -> dict[tuple[str, Labels], list[float]]:
+        """Every process's values added up, this one's flushed first."""
+        self.flush()
+        directory = get_directory()
+        if directory is None:
+            return dict(self.values)
+        merged: dict[tuple[str, Labels], list[float]] = {}
+        for path in directory.glob("*.json"):
+            try:
+                entries = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            for name, labels, values in entries:
+                if name not in METRICS:
+                    continue
+                key = (name, tuple(sorted(labels.items())))
+                total = merged.setdefault(key, [0.0] * len(values))
+                if len(total) != len(values):
+                    # Buckets changed between deploys.
+                    continue
+                for i, value in enumerate(values):
+                    total[i] += value
+        return merged
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+
+@contextmanager
+def timer(metric: Metric, **labels: Any) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(metric, time.perf_counter() - started, **labels)
+
+
+def observed(call: str) -> Callable[[F], F]:
+    """Counts and times an OpenLibrary API method."""
+
+    def decorator(func: F) -> F:
+        @wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            outcome = "error"
+            try:
+                with timer(OPENLIBRARY_SECONDS, call=call):
+                    result = func(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                registry.inc(OPENLIBRARY_CALLS, call=call, outcome=outcome)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+class QueryCounter:
+    def __init__(self) -> None:
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context) -> Any:
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.queries += 1
+
+
+class MetricsMiddleware:
+    """
+    Counts requests and times them, with their database queries, by URL
+    name. Unresolved URLs (404s) are counted under view="none". Goes first.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if self.is_async:
+            return self.__acall__(request)
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with self.wrap_connections(counter):
+            response = self.get_response(request)
+        self.record(request, response, counter, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        counter = QueryCounter()
+        started = time.perf_counter()
+        # Queries run on the request's sync thread, which has connections of
+        # its own, so the wrappers go on there.
+        stack = await sync_to_async(self.wrap_connections)(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self.record(request, response, counter, time.perf_counter() - started)
+        return response
+
+    def wrap_connections(self, counter: QueryCounter) -> ExitStack:
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+        return stack
+
+    def record(
+        self,
+        request: HttpRequest,
+        response: HttpResponse,
+        counter: QueryCounter,
+        seconds: float,
+    ) -> None:
+        match = request.resolver_match
+        view = match.view_name if match else "none"
+        registry.inc(
+            HTTP_REQUESTS, view=view, method=request.method, status=response.status_code
+        )
+        registry.observe(HTTP_SECONDS, seconds, view=view)
+        registry.observe(HTTP_QUERIES, counter.queries, view=view)
+        registry.inc(DB_QUERIES, counter.queries, view=view)
+        registry.inc(DB_SECONDS, counter.seconds, view=view)
+
+
+def format_labels(labels: Labels, **extra: str) -> str:
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def render(values: dict[tuple[str, Labels], list[float]]) -> str:
+    """Prometheus text exposition format, version 0.0.4."""
+    lines = []
+    for metric in METRICS.values():
+        series = sorted(
+            (labels, v) for (name, labels), v in values.items() if name == metric.name
+        )
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for labels, v in series:
+            if metric.kind == "counter":
+                lines.append(
+                    f"{metric.name}{format_labels(labels)} {format_value(v[0])}"
+                )
+                continue
+            cumulative = 0.0
+            for bound, count in zip((*metric.buckets, "+Inf"), v[:-2]):
+                cumulative += count
+                le = bound if isinstance(bound, str) else format_value(bound)
+                lines.append(
+                    f"{metric.name}_bucket{format_labels(labels, le=le)} "
+                    f"{format_value(cumulative)}"
+                )
+            lines.append(
+                f"{metric.name}_sum{format_labels(labels)} {format_value(v[-2])}"
+            )
+            lines.append(
+                f"{metric.name}_count{format_labels(labels)} {format_value(v[-1])}"
+            )
+    return "\n".join(lines) + "\n"
@@ -1,8 +1,9 @@
-from datetime import datetime
-from typing import Any, Optional
+from datetime import date, datetime, timedelta
+from typing import Any, Iterable, Optional
 from django.contrib.auth import get_user_model
-from django.db import models
-from django.db.models import F, Count, Sum
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q, Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.core.validators import (
     MaxLengthValidator,
     MaxValueValidator,
@@ -10,8 +11,12 @@ from django.core.validators import (
     MinValueValidator,
 )
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from . import metrics
+from .caching import CachedManager, invalidate_model
+
 
 # Create your models here.
 class Category(models.Model):
@@ -22,9 +27,12 @@ class Category(models.Model):
         default="Lib/category/cover/default.png",
         verbose_name="Category cover",
     )
+    cover_variants = models.JSONField(default=dict, blank=True, editable=False)
     time_create = models.DateTimeField(auto_now_add=True, verbose_name="Create time")
     time_update = models.DateTimeField(auto_now=True, verbose_name="Update time")
 
+    objects = CachedManager()
+
     def __str__(self) -> str:
         return self.name
 
@@ -40,6 +48,7 @@ class Author(models.Model):
         default="Lib/author/photo/default.jpg",
         verbose_name="Author photo",
     )
+    photo_variants = models.JSONField(default=dict, blank=True, editable=False)
     country = models.CharField(
         null=True, blank=True, max_length=50, verbose_name="Author nationality"
     )
@@ -50,6 +59,8 @@ class Author(models.Model):
     time_create = models.DateTimeField(auto_now_add=True, verbose_name="Create time")
     time_update = models.DateTimeField(auto_now=True, verbose_name="Update time")
 
+    objects = CachedManager()
+
     def __str__(self) -> str:
         return self.full_name
 
@@ -57,36 +68,123 @@ class Author(models.Model):
         return reverse("Lib:author", kwargs={"slug": self.slug})
 
 
+# What the book page reads; anything else would be fetched a column at a time.
+BOOK_DETAIL_FIELDS = (
+    "name",
+    "slug",
+    "book_cover",
+    "cover_variants",
+    "pdf",
+    "user",
+    "is_taken",
+    "return_date",
+    "publish_date",
+    "publisher",
+    "publisher_slug",
+    "language",
+    "pages",
+    "preview",
+    "description",
+    "review_count",
+    "time_update",
+    "author__slug",
+    "author__full_name",
+    "author__time_update",
+    "rating_summary__rating_sum",
+    "rating_summary__rating_count",
+    "rating_summary__time_update",
+)
+
+
 class BookQuerySet(models.QuerySet):
+    # The method a queryset came from, its evaluations are timed under it.
+    metric_name: Optional[str] = None
+
+    def _clone(self) -> "BookQuerySet":
+        clone = super()._clone()
+        clone.metric_name = self.metric_name
+        return clone
+
+    def _fetch_all(self) -> None:
+        if self._result_cache is not None or self.metric_name is None:
+            return super()._fetch_all()
+        with metrics.timer(metrics.BOOK_QUERYSETS, method=self.metric_name):
+            super()._fetch_all()
+
+    def _named(self, name: str) -> "BookQuerySet":
+        clone = self._chain()
+        clone.metric_name = name
+        return clone
+
     def published(self):
-        return self.filter(is_published=Book.Status.PUBLISHED)
+        return self.filter(is_published=Book.Status.PUBLISHED)._named("published")
 
     def top_rated(self):
         return (
-            self.select_related("author")
+            self.select_related("author", "rating_summary")
             .published()
-            .annotate(total_view=Count("userrating__rating"))
-            .annotate(top=Sum("userrating__rating") / Count("userrating__rating"))
+            .annotate(total_view=F("rating_summary__rating_count"))
+            .annotate(top=F("rating_summary__average"))
             .order_by("-top", "-total_view")
+            ._named("top_rated")
         )
 
     def unpopular(self):
         return (
-            self.select_related("author")
+            self.select_related("author", "rating_summary")
             .published()
-            .annotate(total_view=Count("userrating__rating"))
-            .annotate(top=Sum("userrating__rating") / Count("userrating__rating"))
+            .annotate(total_view=F("rating_summary__rating_count"))
+            .annotate(top=F("rating_summary__average"))
             .order_by("top", "total_view")
+            ._named("unpopular")
         )
 
     def new_books(self):
-        return self.published().select_related("author").order_by("-time_create")
+        return (
+            self.published()
+            .select_related("author", "rating_summary")
+            .order_by("-time_create")
+            ._named("new_books")
+        )
 
     def old_books(self):
-        return self.published().select_related("author").order_by("time_create")
+        return (
+            self.published()
+            .select_related("author", "rating_summary")
+            .order_by("time_create")
+            ._named("old_books")
+        )
+
+    def detail(self, user: Any) -> "BookQuerySet":
+        """
+        Everything the book page shows, in one query: the columns it renders,
+        the author and rating summary, the viewer's own rating (user_rating)
+        and when the newest review was written (latest_review).
+        """
+        latest_review = (
+            Review.objects.filter(book=OuterRef("pk"))
+            .order_by("-time_create")
+            .values("time_create")[:1]
+        )
+        if user.is_authenticated:
+            user_rating = Subquery(
+                UserRating.objects.filter(book=OuterRef("pk"), user=user).values(
+                    "rating"
+                )[:1]
+            )
+        else:
+            user_rating = Value(None, output_field=models.PositiveSmallIntegerField())
+        return (
+            self.select_related("author", "rating_summary")
+            .only(*BOOK_DETAIL_FIELDS)
+            .annotate(latest_review=Subquery(latest_review), user_rating=user_rating)
+            ._named("detail")
+        )
 
 
-class BookManager(models.Manager):
+class BookManager(CachedManager):
+    cache_related = ("author", "rating_summary")
+
     def get_queryset(self) -> BookQuerySet:
         return BookQuerySet(self.model)
 
@@ -105,12 +203,59 @@ class BookManager(models.Manager):
     def old_books(self) -> BookQuerySet:
         return self.get_queryset().old_books()
 
+    def detail(self, user: Any) -> BookQuerySet:
+        return self.get_queryset().detail(user)
+
+    def recount_reviews(self, **filters: Any) -> int:
+        # review_count is kept up to date by signals; this repairs it after
+        # bulk inserts, which send none.
+        reviews = (
+            Review.objects.filter(book=OuterRef("pk"))
+            .order_by()
+            .values("book")
+            .annotate(total=Count("pk"))
+            .values("total")
+        )
+        updated = Book.objects.filter(**filters).update(
+            review_count=Coalesce(Subquery(reviews), 0)
+        )
+        invalidate_model(Book)
+        return updated
+
 
 def save_pdf_path(instance, filename):
     return f"Lib/book/pdf/{instance.name}/{filename}"
 
 
 class Book(models.Model):
+    class Meta:
+        # Partial indexes: every listing goes through published(), which
+        # Django compiles to a bare "WHERE is_published" that a plain index
+        # on the column can't seek on. time_create (and the implicit pk) give
+        # the new_books()/old_books() order straight from the index.
+        indexes = [
+            models.Index(
+                fields=["time_create"],
+                condition=Q(is_published=True),
+                name="book_published_created_idx",
+            ),
+            models.Index(
+                fields=["category", "time_create"],
+                condition=Q(is_published=True),
+                name="book_category_listing_idx",
+            ),
+            models.Index(
+                fields=["author", "time_create"],
+                condition=Q(is_published=True),
+                name="book_author_listing_idx",
+            ),
+            models.Index(
+                fields=["user", "time_create"],
+                condition=Q(is_published=True),
+                name="book_user_listing_idx",
+            ),
+        ]
+
     class Language(models.TextChoices):
         UNSELECTED = "UNS", _("Unknown")
         BY = "BY", _("Belarusian")
@@ -128,6 +273,7 @@ class Book(models.Model):
         default="Lib/book/cover/default.svg",
         verbose_name="Book cover",
     )
+    cover_variants = models.JSONField(default=dict, blank=True, editable=False)
     pdf = models.FileField(
         null=True,
         blank=True,
@@ -171,6 +317,9 @@ class Book(models.Model):
     )
 
     description = models.TextField(blank=True, verbose_name="Book description")
+    review_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Amount of reviews"
+    )
     time_create = models.DateTimeField(auto_now_add=True, verbose_name="Create time")
     time_update = models.DateTimeField(auto_now=True, verbose_name="Update time")
     author = models.ForeignKey(Author, on_delete=models.CASCADE)
@@ -224,6 +373,17 @@ class UserRatingManager(models.Manager):
 
 
 class UserRating(models.Model):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "book"], name="unique_user_book_rating"
+            ),
+        ]
+        indexes = [
+            # Covers the per-book aggregate in RatingSummaryManager.refresh().
+            models.Index(fields=["book", "rating"], name="rating_book_rating_idx"),
+        ]
+
     user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     rating = models.PositiveSmallIntegerField(
@@ -245,9 +405,31 @@ class UserRating(models.Model):
         )
 
 
+class ReviewQuerySet(models.QuerySet):
+    def for_book(self, book_id: int) -> "ReviewQuerySet":
+        # Newest first, with only the reviewer columns a comment shows.
+        return (
+            self.filter(book=book_id)
+            .select_related("user")
+            .only(
+                "book_id",
+                "review_text",
+                "time_create",
+                "user__username",
+                "user__photo",
+                "user__photo_variants",
+            )
+            .order_by("-time_create")
+        )
+
+
 class Review(models.Model):
     class Meta:
         ordering = ["-time_create"]
+        indexes = [
+            # Pages of a book's comments, newest first, by time_create and pk.
+            models.Index(fields=["book", "time_create"], name="review_book_time_idx"),
+        ]
 
     user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
@@ -256,3 +438,384 @@ class Review(models.Model):
         verbose_name="Review text",
     )
     time_create = models.DateTimeField(auto_now_add=True, verbose_name="Create time")
+
+    objects = ReviewQuerySet.as_manager()
+
+
+class LoanManager(models.Manager):
+    """
+    Book.user, is_taken and return_date hold the current loan; these rows keep
+    every loan, returned ones included. Both change together, and the book
+    row is taken with a conditional UPDATE so only one of several concurrent
+    borrowers gets it.
+    """
+
+    def borrow(self, book_id: int, user: Any, due_date: date) -> Optional["Loan"]:
+        now = timezone.now()
+        with transaction.atomic():
+            taken = Book.objects.filter(pk=book_id, is_taken=False).update(
+                user=user, is_taken=True, return_date=due_date, time_update=now
+            )
+            if not taken:
+                return None
+            loan = self.create(book_id=book_id, user=user, due_date=due_date)
+        invalidate_model(Book)
+        return loan
+
+    def give_back(self, book_id: int, user: Any) -> bool:
+        now = timezone.now()
+        with transaction.atomic():
+            released = Book.objects.filter(pk=book_id, user=user, is_taken=True).update(
+                user=None, is_taken=False, return_date=None, time_update=now
+            )
+            if not released:
+                return False
+            self.filter(book_id=book_id, time_returned__isnull=True).update(
+                time_returned=now
+            )
+        invalidate_model(Book)
+        return True
+
+    def backfill(self, today: date) -> int:
+        """
+        Opens a loan for every taken book without one, i.e. borrowed before
+        loans were recorded, due on its return_date (today if it has none).
+        """
+        open_loans = self.filter(time_returned__isnull=True).values("book")
+        books = Book.objects.filter(is_taken=True, user__isnull=False).exclude(
+            pk__in=open_loans
+        )
+        loans = [
+            self.model(book_id=pk, user_id=user_id, due_date=return_date or today)
+            for pk, user_id, return_date in books.values_list(
+                "pk", "user", "return_date"
+            )
+        ]
+        # unique_open_loan drops any a concurrent borrow opened meanwhile.
+        return len(self.bulk_create(loans, ignore_conflicts=True))
+
+    def overdue(self, today: date) -> models.QuerySet:
+        """
+        Open loans past their due date without a reminder, oldest first.
+        loan_overdue_idx holds only open, unreminded loans, so this reads
+        the overdue ones and not the whole history.
+        """
+        return self.filter(
+            time_returned__isnull=True,
+            time_reminded__isnull=True,
+            due_date__lt=today,
+        ).order_by("due_date", "pk")
+
+
+class Loan(models.Model):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["book"],
+                condition=Q(time_returned__isnull=True),
+                name="unique_open_loan",
+            )
+        ]
+        indexes = [
+            models.Index(fields=["user", "time_borrowed"]),
+            models.Index(
+                fields=["due_date", "id"],
+                condition=Q(time_returned__isnull=True, time_reminded__isnull=True),
+                name="loan_overdue_idx",
+            ),
+        ]
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="loans")
+    user = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, related_name="loans"
+    )
+    due_date = models.DateField(verbose_name="Return date")
+    time_borrowed = models.DateTimeField(auto_now_add=True, verbose_name="Borrowed")
+    time_returned = models.DateTimeField(
+        null=True, blank=True, default=None, verbose_name="Returned"
+    )
+    time_reminded = models.DateTimeField(
+        null=True, blank=True, default=None, verbose_name="Overdue reminder sent"
+    )
+
+    objects = LoanManager()
+
+    def __str__(self) -> str:
+        return f"{self.book_id} to {self.user_id} until {self.due_date}"
+
+
+class RatingSummaryManager(models.Manager):
+    def refresh(self, book_id: int) -> "RatingSummary":
+        totals = UserRating.objects.filter(
+            book=book_id, rating__isnull=False
+        ).aggregate(
+            rating_sum=Sum("rating"),
+            rating_count=Count("rating"),
+            one_star=Count("rating", filter=Q(rating=1)),
+            two_stars=Count("rating", filter=Q(rating=2)),
+            three_stars=Count("rating", filter=Q(rating=3)),
+            four_stars=Count("rating", filter=Q(rating=4)),
+            five_stars=Count("rating", filter=Q(rating=5)),
+        )
+        totals["rating_sum"] = totals["rating_sum"] or 0
+        totals["average"] = (
+            totals["rating_sum"] / totals["rating_count"]
+            if totals["rating_count"]
+            else None
+        )
+        summary, _ = self.update_or_create(book_id=book_id, defaults=totals)
+        return summary
+
+    def for_books(self, book_ids: Iterable[int]) -> dict[int, "RatingSummary"]:
+        return self.in_bulk(list(book_ids))
+
+    def rebuild(self, batch_size: int = 1000) -> int:
+        # One grouped aggregate instead of refresh() per book; bulk_create
+        # sends no signals, so the cached versions are bumped by hand.
+        rating = "userrating__rating"
+        totals = (
+            Book.objects.values("pk")
+            .annotate(
+                rating_sum=Sum(rating, default=0),
+                rating_count=Count(rating),
+                one_star=Count(rating, filter=Q(**{rating: 1})),
+                two_stars=Count(rating, filter=Q(**{rating: 2})),
+                three_stars=Count(rating, filter=Q(**{rating: 3})),
+                four_stars=Count(rating, filter=Q(**{rating: 4})),
+                five_stars=Count(rating, filter=Q(**{rating: 5})),
+            )
+            .order_by()
+        )
+        summaries = [
+            RatingSummary(
+                book_id=row.pop("pk"),
+                average=(
+                    row["rating_sum"] / row["rating_count"]
+                    if row["rating_count"]
+                    else None
+                ),
+                **row,
+            )
+            for row in totals.iterator()
+        ]
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create(summaries, batch_size=batch_size)
+        invalidate_model(RatingSummary)
+        return len(summaries)
+
+
+class RatingSummary(models.Model):
+    book = models.OneToOneField(
+        Book,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="rating_summary",
+    )
+    rating_sum = models.PositiveIntegerField(default=0, verbose_name="Sum of ratings")
+    rating_count = models.PositiveIntegerField(
+        default=0, verbose_name="Amount of ratings"
+    )
+    average = models.FloatField(null=True, blank=True, verbose_name="Average rating")
+    one_star = models.PositiveIntegerField(default=0)
+    two_stars = models.PositiveIntegerField(default=0)
+    three_stars = models.PositiveIntegerField(default=0)
+    four_stars = models.PositiveIntegerField(default=0)
+    five_stars = models.PositiveIntegerField(default=0)
+    time_update = models.DateTimeField(auto_now=True, verbose_name="Update time")
+
+    objects = RatingSummaryManager()
+
+    def __str__(self) -> str:
+        return f"BookId={self.book_id} Average={self.average} Count={self.rating_count}"
+
+    @property
+    def histogram(self) -> dict[int, int]:
+        return {
+            1: self.one_star,
+            2: self.two_stars,
+            3: self.three_stars,
+            4: self.four_stars,
+            5: self.five_stars,
+        }
+
+
+class SearchDocumentField(models.TextField):
+    pass
+
+
+@SearchDocumentField.register_lookup
+class Match(models.Lookup):
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", lhs_params + rhs_params
+
+
+class BookSearchIndex(models.Model):
+    class Meta:
+        managed = False
+        db_table = "library_book_fts"
+
+    book = models.OneToOneField(
+        Book,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column="rowid",
+        db_constraint=False,
+        related_name="search_index",
+    )
+    name = models.TextField()
+    author = models.TextField()
+    category = models.TextField()
+    publisher = models.TextField()
+    description = models.TextField()
+    # FTS5 hidden columns: the one named after the table takes MATCH queries
+    # over every column, "rank" holds the bm25 score of the current match.
+    document = SearchDocumentField(db_column="library_book_fts")
+    rank = models.FloatField()
+
+
+class ImportJobManager(models.Manager):
+    def submit(
+        self, bibkey: str, method: str, user: Any = None
+    ) -> tuple["ImportJob", bool]:
+        active = self.filter(
+            bibkey=bibkey, method=method, status__in=ImportJob.ACTIVE_STATUSES
+        )
+        job = active.first()
+        created = False
+        if job is None:
+            try:
+                with transaction.atomic():
+                    job = self.create(bibkey=bibkey, method=method, user=user)
+                    created = True
+            except IntegrityError:
+                # Lost the race against an identical submission.
+                job = active.get()
+        if user is not None:
+            # Everyone who asked for the import may follow it.
+            job.submitters.add(user)
+        return job, created
+
+    def claim(self) -> Optional["ImportJob"]:
+        now = timezone.now()
+        candidates = (
+            self.filter(status=ImportJob.Status.QUEUED, run_after__lte=now)
+            .order_by("run_after", "pk")
+            .values_list("pk", flat=True)[:10]
+        )
+        for pk in candidates:
+            claimed = self.filter(
+                pk=pk, status=ImportJob.Status.QUEUED, run_after__lte=now
+            ).update(
+                status=ImportJob.Status.RUNNING,
+                attempts=F("attempts") + 1,
+                time_update=now,
+            )
+            if claimed:
+                return self.get(pk=pk)
+        return None
+
+    def requeue_stale(self, timeout: timedelta) -> int:
+        now = timezone.now()
+        stale = self.filter(
+            status=ImportJob.Status.RUNNING, time_update__lt=now - timeout
+        )
+        # A job that kills its worker or always overruns would come back forever.
+        stale.filter(attempts__gte=F("max_attempts")).update(
+            status=ImportJob.Status.FAILED,
+            error=f"Still running after {timeout} on the last attempt",
+            time_update=now,
+        )
+        return stale.update(status=ImportJob.Status.QUEUED, time_update=now)
+
+
+class ImportJob(models.Model):
+    class Status(models.TextChoices):
+        QUEUED = "queued", _("Queued")
+        RUNNING = "running", _("Running")
+        DONE = "done", _("Done")
+        FAILED = "failed", _("Failed")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["method", "bibkey"],
+                condition=Q(status__in=["queued", "running"]),
+                name="unique_active_import_job",
+            )
+        ]
+        indexes = [models.Index(fields=["status", "run_after"])]
+
+    ACTIVE_STATUSES = (Status.QUEUED, Status.RUNNING)
+    RETRY_DELAY = timedelta(seconds=30)
+
+    method = models.CharField(max_length=4, verbose_name="Bibkey type")
+    bibkey = models.CharField(max_length=20, verbose_name="Bibkey")
+    user = models.ForeignKey(
+        get_user_model(), models.SET_NULL, default=None, null=True, blank=True
+    )
+    submitters = models.ManyToManyField(
+        get_user_model(), related_name="submitted_import_jobs", blank=True
+    )
+    status = models.CharField(
+        max_length=7, choices=Status.choices, default=Status.QUEUED
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    error = models.TextField(blank=True, verbose_name="Last error")
+    book = models.ForeignKey(Book, models.SET_NULL, default=None, null=True, blank=True)
+    time_create = models.DateTimeField(auto_now_add=True, verbose_name="Create time")
+    time_update = models.DateTimeField(auto_now=True, verbose_name="Update time")
+
+    objects = ImportJobManager()
+
+    def __str__(self) -> str:
+        return f"{self.method}:{self.bibkey} ({self.status})"
+
+    def finish(self, book: Book) -> None:
+        self.status = ImportJob.Status.DONE
+        self.book = book
+        self.error = ""
+        self.save(update_fields=["status", "book", "error", "time_update"])
+
+    def fail(self, error: str) -> None:
+        self.status = ImportJob.Status.FAILED
+        self.error = error
+        self.save(update_fields=["status", "error", "time_update"])
+
+    def retry_or_fail(self, error: str) -> None:
+        if self.attempts >= self.max_attempts:
+            return self.fail(error)
+        self.status = ImportJob.Status.QUEUED
+        self.error = error
+        self.run_after = timezone.now() + self.RETRY_DELAY * 2 ** (self.attempts - 1)
+        self.save(update_fields=["status", "error", "run_after", "time_update"])
+
+
+class RequestProfile(models.Model):
+    """A sampled request, recorded by profiling.ProfilingMiddleware."""
+
+    class Meta:
+        ordering = ["-time_create"]
+        indexes = [models.Index(fields=["view_name", "time_create"])]
+
+    view_name = models.CharField(max_length=200, verbose_name="View")
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=2000)
+    status = models.PositiveSmallIntegerField()
+    total_ms = models.FloatField(verbose_name="Total, ms")
+    db_ms = models.FloatField(verbose_name="Database, ms")
+    queries = models.PositiveIntegerField()
+    template_ms = models.FloatField(verbose_name="Templates, ms")
+    # {"book_rating": [calls, ms], ...}
+    tags = models.JSONField(default=dict, blank=True, verbose_name="Template tags")
+    profile = models.TextField(blank=True, verbose_name="cProfile output")
+    time_create = models.DateTimeField(auto_now_add=True, verbose_name="Create time")
+
+    def __str__(self) -> str:
+        return f"{self.method} {self.path} ({self.total_ms:.1f} ms)"
@@ -1,7 +1,14 @@
+import asyncio
+import threading
 import urllib3
-from bs4 import BeautifulSoup
+from lxml import etree
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from . import metrics
+from .httpcache import Response, ResponseCache, get_default_cache
+
+T = TypeVar("T")
 
 
 @dataclass(slots=True)
@@ -169,13 +176,26 @@ class Book:
     def preview(self) -> str:
         return self.__preview[0].get("preview_url", None)
 
-    def get_ready_dict(self):
-
+    @property
+    def author_olid(self) -> str:
         author_url: str = self.__authors[0].get("url", None)
-        olid = author_url.split("/")[-2]
+        return author_url.split("/")[-2]
 
-        author = API().get_author(olid=olid).get_ready_dict()
+    def get_ready_dict(self, api: Optional["API"] = None):
+        api = api or API()
+        author = api.get_author(olid=self.author_olid).get_ready_dict()
+        desq, lang = api.get_details(url=self.__url)
+        return self.to_dict(author=author, desq=desq, lang=lang)
+
+    @staticmethod
+    def parse_details(html: bytes) -> tuple[str, Optional[str]]:
+        extractor = DetailsExtractor()
+        for i in range(0, len(html), DetailsExtractor.chunk_size):
+            if extractor.feed(html[i : i + DetailsExtractor.chunk_size]):
+                break
+        return extractor.close()
 
+    def to_dict(self, author: dict, desq: str, lang: Optional[str]) -> dict[str, Any]:
         if self.__publishers:
             publishers = [item["name"] for item in self.__publishers]
         else:
@@ -186,25 +206,11 @@ class Book:
         else:
             publisher_place = None
 
-        default_preview_url: str = self.__preview[0].get("preview_url", None)
-        embed_preview = default_preview_url.replace("/details/", "/embed/")
-
-        response = urllib3.request(method="GET", url=self.__url, timeout=10)
-        bs = BeautifulSoup(response.data, "lxml")
-        container = bs.find("div", attrs={"class": "read-more__content"})
-
-        desq = ""
-
-        for p in container.findAll("p"):  # type: ignore
-            desq += p.text.strip()
-
-        try:
-            language = bs.find("span", attrs={"itemprop": "inLanguage"})
-            for a in language.findAll("a"):  # type: ignore
-                lang = a.text.strip()
-                break
-        except:
-            lang = None
+        if self.__preview:
+            default_preview_url: str | None = self.__preview[0].get("preview_url", None)
+            embed_preview = default_preview_url.replace("/details/", "/embed/")
+        else:
+            default_preview_url = embed_preview = None
 
         book_data = {
             "url": self.__url,
@@ -217,7 +223,7 @@ class Book:
             "cover": self.__cover,
             "preview": {
                 "embed": embed_preview,
-                "external": self.__preview[0].get("preview_url", None),
+                "external": default_preview_url,
             },
             "desq": desq,
             "lang": lang,
@@ -256,20 +262,300 @@ class Book:
         return self.__title
 
 
-class API:
+class DetailsExtractor:
+    chunk_size = 16 * 1024
+
     def __init__(self) -> None:
+        self.parser = etree.HTMLPullParser(events=("start", "end"))
+        self.desq_parts: list[str] = []
+        self.lang: Optional[str] = None
+        self.desq_el = None
+        self.lang_el = None
+        self.desq_done = False
+        self.lang_done = False
+
+    @property
+    def done(self) -> bool:
+        return self.desq_done and self.lang_done
+
+    def feed(self, chunk: bytes) -> bool:
+        self.parser.feed(chunk)
+        return self.read_events()
+
+    def read_events(self) -> bool:
+        for event, el in self.parser.read_events():
+            if event == "start":
+                self.start(el)
+            else:
+                self.end(el)
+            if self.done:
+                break
+        return self.done
+
+    def start(self, el) -> None:
+        if self.desq_el is None and not self.desq_done and el.tag == "div":
+            if "read-more__content" in (el.get("class") or "").split():
+                self.desq_el = el
+        elif self.lang_el is None and not self.lang_done and el.tag == "span":
+            if el.get("itemprop") == "inLanguage":
+                self.lang_el = el
+
+    def end(self, el) -> None:
+        if self.desq_el is not None:
+            if el.tag == "p":
+                self.desq_parts.append("".join(el.itertext()).strip())
+            if el is self.desq_el:
+                self.desq_el = None
+                self.desq_done = True
+        if self.lang_el is not None:
+            if el.tag == "a" and self.lang is None:
+                self.lang = "".join(el.itertext()).strip()
+            if el is self.lang_el:
+                self.lang_el = None
+                self.lang_done = True
+        if self.desq_el is None and self.lang_el is None:
+            # Nothing above this element is a target, drop what was parsed so far.
+            el.clear()
+            parent = el.getparent()
+            while parent is not None and el.getprevious() is not None:
+                del parent[0]
+
+    def close(self) -> tuple[str, Optional[str]]:
+        if not self.done:
+            try:
+                self.parser.close()
+            except etree.XMLSyntaxError:
+                pass
+            self.read_events()
+        return "".join(self.desq_parts), self.lang
+
+
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_MAX_CONNECTIONS = 4
+DEFAULT_MAX_CONCURRENCY = 8
+
+_lock = threading.Lock()
+_pools: dict[tuple[int, float], urllib3.PoolManager] = {}
+_limiters: dict[int, threading.BoundedSemaphore] = {}
+
+
+def get_pool(
+    max_connections: int = DEFAULT_MAX_CONNECTIONS, timeout: float = DEFAULT_TIMEOUT
+) -> urllib3.PoolManager:
+    key = (max_connections, timeout)
+    with _lock:
+        if key not in _pools:
+            # block=True caps open connections per host at max_connections and
+            # keeps them alive between calls instead of dialing a new one each
+            # time. Requests wait at most API.timeout for one to come back.
+            _pools[key] = urllib3.PoolManager(
+                maxsize=max_connections,
+                block=True,
+                timeout=urllib3.Timeout(total=timeout),
+            )
+        return _pools[key]
+
+
+def get_limiter(
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+) -> threading.BoundedSemaphore:
+    # Shared by every AsyncAPI in the process, whatever loop or request
+    # built it, so views creating one per request still share the cap.
+    with _lock:
+        if max_concurrency not in _limiters:
+            _limiters[max_concurrency] = threading.BoundedSemaphore(max_concurrency)
+        return _limiters[max_concurrency]
+
+
+class API:
+    def __init__(
+        self,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        timeout: float = DEFAULT_TIMEOUT,
+        cache: Optional[ResponseCache] | bool = True,
+    ) -> None:
         self.base_url = "http://openlibrary.org/"
+        self.timeout = timeout
+        self.http = get_pool(max_connections=max_connections, timeout=timeout)
+        self.cache = get_default_cache() if cache is True else cache or None
+
+    @staticmethod
+    def conditional_headers(cached: Optional[Response]) -> dict[str, str]:
+        headers = {}
+        if cached and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+        return headers
+
+    def request(self, url: str, **kwargs: Any) -> urllib3.BaseHTTPResponse:
+        # Without pool_timeout a blocking pool waits for a free connection
+        # forever; EmptyPoolError is raised instead.
+        return self.http.request(
+            method="GET", url=url, pool_timeout=self.timeout, **kwargs
+        )
+
+    def fetch(self, url: str) -> Response:
+        cached = self.cache.get(url) if self.cache else None
+        if cached and self.cache.is_fresh(cached):
+            self.cache.count("hits")
+            return cached
+
+        response = self.request(url, headers=self.conditional_headers(cached))
+        metrics.registry.inc(metrics.OPENLIBRARY_RESPONSES, status=response.status)
+
+        if cached and response.status == 304:
+            self.cache.count("revalidated")
+            self.cache.touch(url, cached)
+            return cached
+
+        result = Response(
+            status=response.status,
+            data=response.data,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+        if self.cache:
+            self.cache.count("misses")
+            if response.status == 200:
+                self.cache.set(url, result)
+        return result
 
+    @metrics.observed("get_book")
     def get_book(self, id: str, bibkey: str = "ISBN", jscmd: str = "data"):
         url = (
             f"{self.base_url}api/books?bibkeys={bibkey}:{id}&jscmd={jscmd}&format=json"
         )
-        response = urllib3.request(method="GET", url=url, timeout=10)
+        response = self.fetch(url)
         json_data = response.json()[f"{bibkey}:{id}"]
         return Book.get_book_from_json(json_data)
 
+    @metrics.observed("get_books")
+    def get_books(
+        self, ids: List[str], bibkey: str = "ISBN", jscmd: str = "data"
+    ) -> Dict[str, Book]:
+        bibkeys = ",".join(f"{bibkey}:{id}" for id in ids)
+        url = f"{self.base_url}api/books?bibkeys={bibkeys}&jscmd={jscmd}&format=json"
+        response = self.fetch(url)
+        json_data = response.json()
+        return {
+            id: Book.get_book_from_json(json_data[f"{bibkey}:{id}"])
+            for id in ids
+            if f"{bibkey}:{id}" in json_data
+        }
+
+    @metrics.observed("get_author")
     def get_author(self, olid: str) -> Author:
         url = f"{self.base_url}authors/{olid}.json"
-        response = urllib3.request(method="GET", url=url)
+        response = self.fetch(url)
         json_data = response.json()
         return Author.get_author_from_json(json_data)
+
+    @metrics.observed("get_details")
+    def get_details(self, url: str) -> tuple[str, Optional[str]]:
+        cached = self.cache.get(url) if self.cache else None
+        if cached and self.cache.is_fresh(cached):
+            self.cache.count("hits")
+            return Book.parse_details(cached.data)
+
+        # Anything else is streamed and the download stops once both targets
+        # have been read. Only a page read to the end can be cached.
+        response = self.request(
+            url, headers=self.conditional_headers(cached), preload_content=False
+        )
+        metrics.registry.inc(metrics.OPENLIBRARY_RESPONSES, status=response.status)
+        if cached and response.status == 304:
+            response.drain_conn()
+            response.release_conn()
+            self.cache.count("revalidated")
+            self.cache.touch(url, cached)
+            return Book.parse_details(cached.data)
+
+        extractor = DetailsExtractor()
+        chunks = []
+        complete = False
+        try:
+            for chunk in response.stream(DetailsExtractor.chunk_size):
+                if self.cache:
+                    chunks.append(chunk)
+                if extractor.feed(chunk):
+                    # A short page may have come in whole with this chunk.
+                    complete = response.length_remaining == 0
+                    break
+            else:
+                complete = True
+        finally:
+            if not complete:
+                # The rest of the body is still on the socket, so the
+                # connection goes back to the pool closed and is redialed.
+                response.close()
+            response.release_conn()
+
+        if self.cache:
+            self.cache.count("misses")
+            if complete and response.status == 200:
+                self.cache.set(
+                    url,
+                    Response(
+                        status=response.status,
+                        data=b"".join(chunks),
+                        etag=response.headers.get("ETag"),
+                        last_modified=response.headers.get("Last-Modified"),
+                    ),
+                )
+        return extractor.close()
+
+    @metrics.observed("download")
+    def download(self, url: str) -> Optional[bytes]:
+        if "://" not in url:
+            url = "https://" + url
+        response = self.fetch(url)
+        if response.status != 200:
+            return None
+        return response.data
+
+
+class AsyncAPI:
+    def __init__(
+        self,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        timeout: float = DEFAULT_TIMEOUT,
+        cache: Optional[ResponseCache] | bool = True,
+    ) -> None:
+        self.api = API(max_connections=max_connections, timeout=timeout, cache=cache)
+        self.limiter = get_limiter(max_concurrency)
+
+    def _call(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        # Acquired in the worker thread: a threading semaphore is bound to no
+        # event loop, unlike asyncio's, and async_to_sync() runs each call on
+        # a loop of its own.
+        with self.limiter:
+            return func(*args, **kwargs)
+
+    async def _run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        return await asyncio.to_thread(self._call, func, *args, **kwargs)
+
+    async def get_book(self, id: str, bibkey: str = "ISBN", jscmd: str = "data"):
+        return await self._run(self.api.get_book, id=id, bibkey=bibkey, jscmd=jscmd)
+
+    async def get_books(
+        self, ids: List[str], bibkey: str = "ISBN", jscmd: str = "data"
+    ) -> Dict[str, Book]:
+        return await self._run(self.api.get_books, ids=ids, bibkey=bibkey, jscmd=jscmd)
+
+    async def get_author(self, olid: str) -> Author:
+        return await self._run(self.api.get_author, olid=olid)
+
+    async def get_details(self, url: str) -> tuple[str, Optional[str]]:
+        return await self._run(self.api.get_details, url=url)
+
+    async def download(self, url: str) -> Optional[bytes]:
+        return await self._run(self.api.download, url=url)
+
+    async def get_ready_dict(self, id: str, bibkey: str = "ISBN") -> dict[str, Any]:
+        book: Book = await self.get_book(id=id, bibkey=bibkey)
+        author, (desq, lang) = await asyncio.gather(
+            self.get_author(olid=book.author_olid), self.get_details(url=book.url)
+        )
+        return book.to_dict(author=author.get_ready_dict(), desq=desq, lang=lang)
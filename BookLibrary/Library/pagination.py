@@ -0,0 +1,320 @@
+import base64
+import hashlib
+import json
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Any, Optional, Sequence
+
+from django.core.cache import cache
+from django.core.exceptions import FieldError, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import F, Field, Q, QuerySet
+from django.db.models.expressions import Col, OrderBy
+from django.db.models.sql.constants import LOUTER
+from django.http import Http404
+
+COUNT_TIMEOUT = 300
+
+
+@dataclass(frozen=True, slots=True)
+class Key:
+    # One column of the sort tuple. NULLs sort as the smallest value, which is
+    # what SQLite does anyway and what the cursor conditions below assume.
+    name: str
+    expression: Any
+    descending: bool
+    nullable: bool = True
+    field: Optional[Field] = None
+
+    def order_by(self, reverse: bool = False) -> OrderBy:
+        if self.descending != reverse:
+            return self.expression.desc(nulls_last=True)
+        return self.expression.asc(nulls_first=True)
+
+    def after(self, value: Any, reverse: bool = False) -> Q:
+        descending = self.descending != reverse
+        if value is None:
+            # Nothing follows NULL going down; everything non-NULL does going up.
+            if descending:
+                return Q(pk__in=[])
+            return Q(**{f"{self.name}__isnull": False})
+        if descending:
+            after = Q(**{f"{self.name}__lt": value})
+            if self.nullable:
+                after |= Q(**{f"{self.name}__isnull": True})
+            return after
+        return Q(**{f"{self.name}__gt": value})
+
+    def bound(self, value: Any, reverse: bool = False) -> Optional[Q]:
+        """
+        A plain range condition implied by after() on the sort tuple, which
+        lets the database seek in an index instead of filtering every row
+        before the cursor.
+        """
+        descending = self.descending != reverse
+        if value is None or (descending and self.nullable):
+            return None
+        return Q(**{f"{self.name}__{'lte' if descending else 'gte'}": value})
+
+    def to_python(self, value: Any) -> Any:
+        # Cursors come from the client; a value the column can't hold would
+        # otherwise fail in the query.
+        if value is None:
+            return None
+        if self.field is None:
+            return value
+        try:
+            return self.field.to_python(value)
+        except (ValidationError, TypeError, ValueError):
+            raise Http404("Invalid cursor")
+
+    def equal(self, value: Any) -> Q:
+        if value is None:
+            return Q(**{f"{self.name}__isnull": True})
+        return Q(**{self.name: value})
+
+
+def is_nullable(query: Any, expression: Any) -> bool:
+    if not isinstance(expression, Col):
+        return True
+    join = query.alias_map.get(expression.alias)
+    return expression.target.null or getattr(join, "join_type", None) == LOUTER
+
+
+def get_output_field(expression: Any) -> Optional[Field]:
+    try:
+        return expression.output_field
+    except FieldError:
+        return None
+
+
+def get_keys(queryset: QuerySet) -> list[Key]:
+    keys = []
+    for i, field in enumerate(queryset.query.order_by):
+        if not isinstance(field, str) or field.lstrip("-") == "?":
+            raise ValueError(f"Can't paginate by cursor on ordering {field!r}")
+        name = field.lstrip("-")
+        keys.append(Key(f"_keyset_{i}", F(name), field.startswith("-")))
+        if name in ("pk", "id"):
+            return keys
+    # The primary key makes the sort tuple unique, so no row is skipped or
+    # repeated when several books share a rating or a timestamp.
+    keys.append(Key("_keyset_pk", F("pk"), bool(keys) and keys[0].descending))
+    return keys
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    def default(self, o: Any) -> Any:
+        # DjangoJSONEncoder drops microseconds past milliseconds, which would
+        # make the cursor miss rows created within the same millisecond.
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values: Sequence[Any], number: int) -> str:
+    data = json.dumps({"v": list(values), "n": number}, cls=CursorEncoder)
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[list[Any], int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded))
+        return list(data["v"]), int(data["n"])
+    except (ValueError, TypeError, KeyError):
+        raise Http404("Invalid cursor")
+
+
+def cached_count(queryset: QuerySet, timeout: int = COUNT_TIMEOUT) -> int:
+    queryset = queryset.order_by()
+    sql, params = queryset.query.sql_with_params()
+    key = hashlib.sha256(f"{sql}{params}".encode()).hexdigest()
+    key = f"Library:count:{key}"
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+def approximate_count(queryset: QuerySet) -> int:
+    # Only PostgreSQL exposes the planner's row estimate; elsewhere fall back
+    # to a cached exact count.
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return cached_count(queryset)
+    plan = json.loads(queryset.order_by().explain(format="json"))
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+COUNT_MODES = {"cached": cached_count, "approximate": approximate_count}
+
+
+class KeysetPaginator:
+    def __init__(
+        self, queryset: QuerySet, per_page: int, count_mode: Optional[str] = None
+    ) -> None:
+        self.keys = get_keys(queryset)
+        self.queryset = queryset.annotate(
+            **{key.name: key.expression for key in self.keys}
+        )
+        annotations = self.queryset.query.annotations
+        self.keys = [
+            replace(
+                key,
+                nullable=is_nullable(self.queryset.query, annotations[key.name]),
+                field=get_output_field(annotations[key.name]),
+            )
+            for key in self.keys
+        ]
+        self.per_page = per_page
+        self.count_mode = count_mode
+        self._queryset = queryset
+
+    @property
+    def count(self) -> Optional[int]:
+        if self.count_mode is None:
+            return None
+        if not hasattr(self, "_count"):
+            self._count = COUNT_MODES[self.count_mode](self._queryset)
+        return self._count
+
+    @property
+    def num_pages(self) -> Optional[int]:
+        if self.count is None:
+            return None
+        return max(1, -(-self.count // self.per_page))
+
+    def filter(self, values: list[Any], reverse: bool) -> Q:
+        condition = Q(pk__in=[])
+        for i, key in enumerate(self.keys):
+            q = key.after(values[i], reverse)
+            for previous, value in zip(self.keys[:i], values):
+                q &= previous.equal(value)
+            condition |= q
+        bound = self.keys[0].bound(values[0], reverse)
+        return condition if bound is None else bound & condition
+
+    def page_query(
+        self, after: Optional[str], before: Optional[str]
+    ) -> tuple[QuerySet, int]:
+        cursor = after or before
+        reverse = before is not None and after is None
+        queryset = self.queryset.order_by(*(key.order_by(reverse) for key in self.keys))
+        number = 1
+        if cursor:
+            values, number = decode_cursor(cursor)
+            if len(values) != len(self.keys):
+                raise Http404("Invalid cursor")
+            values = [key.to_python(value) for key, value in zip(self.keys, values)]
+            queryset = queryset.filter(self.filter(values, reverse))
+            number += -1 if reverse else 1
+        return queryset[: self.per_page + 1], number
+
+    def page(
+        self, after: Optional[str] = None, before: Optional[str] = None
+    ) -> "KeysetPage":
+        queryset, number = self.page_query(after, before)
+        return self.make_page(list(queryset), number, after, before)
+
+    async def apage(
+        self, after: Optional[str] = None, before: Optional[str] = None
+    ) -> "KeysetPage":
+        queryset, number = self.page_query(after, before)
+        rows = [row async for row in queryset]
+        return self.make_page(rows, number, after, before)
+
+    def make_page(
+        self,
+        rows: list[Any],
+        number: int,
+        after: Optional[str],
+        before: Optional[str],
+    ) -> "KeysetPage":
+        cursor = after or before
+        reverse = before is not None and after is None
+        more = len(rows) > self.per_page
+        rows = rows[: self.per_page]
+        if reverse:
+            rows.reverse()
+            return KeysetPage(self, rows, number, has_next=True, has_previous=more)
+        return KeysetPage(self, rows, number, has_next=more, has_previous=bool(cursor))
+
+
+class KeysetPage:
+    def __init__(
+        self,
+        paginator: KeysetPaginator,
+        object_list: list[Any],
+        number: int,
+        has_next: bool,
+        has_previous: bool,
+    ) -> None:
+        self.paginator = paginator
+        self.object_list = object_list
+        self.number = max(number, 1)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self) -> str:
+        return f"<Page {self.number}>"
+
+    def __len__(self) -> int:
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self) -> bool:
+        return self._has_next and bool(self.object_list)
+
+    def has_previous(self) -> bool:
+        return self._has_previous
+
+    def has_other_pages(self) -> bool:
+        return self.has_next() or self.has_previous()
+
+    def cursor(self, row: Any, number: int) -> str:
+        # Rows are model instances, or dicts for a values() queryset.
+        if isinstance(row, dict):
+            values = [row[key.name] for key in self.paginator.keys]
+        else:
+            values = [getattr(row, key.name) for key in self.paginator.keys]
+        return encode_cursor(values, number)
+
+    @property
+    def next_cursor(self) -> Optional[str]:
+        if not self.has_next():
+            return None
+        return self.cursor(self.object_list[-1], self.number)
+
+    @property
+    def previous_cursor(self) -> Optional[str]:
+        if not self.has_previous():
+            return None
+        return self.cursor(self.object_list[0], self.number)
+
+
+class KeysetPaginationMixin:
+    """
+    ListView mixin that pages with ?after=/?before= cursors over the
+    queryset's ordering instead of LIMIT/OFFSET. There is no COUNT(*) unless
+    count_mode is "cached" or "approximate".
+    """
+
+    count_mode: Optional[str] = None
+
+    def paginate_queryset(
+        self, queryset: QuerySet, page_size: int
+    ) -> tuple[Any, Any, Any, bool]:
+        paginator = KeysetPaginator(queryset, page_size, self.count_mode)
+        page = paginator.page(
+            after=self.request.GET.get("after"),
+            before=self.request.GET.get("before"),
+        )
+        return paginator, page, page.object_list, page.has_other_pages()
@@ -0,0 +1,147 @@
+import json
+import os
+import statistics
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable
+from unittest import SkipTest
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Book
+from .testdata import Scale, seed
+
+# Performance budget tests, kept apart from testdata so that the management
+# commands seeding data don't import django.test.
+
+
+@dataclass
+class Route:
+    """A request against a named URL and the budget it has to stay within."""
+
+    name: str
+    max_queries: int
+    max_seconds: float = 0.5
+    kwargs: dict[str, Any] | Callable[[Any], dict[str, Any]] = field(
+        default_factory=dict
+    )
+    query: str = ""
+    method: str = "get"
+    data: dict[str, Any] | Callable[[Any], dict[str, Any]] = field(default_factory=dict)
+    login: bool = False
+    status: tuple[int, ...] = (200,)
+    label: str = ""
+
+    @property
+    def id(self) -> str:
+        return self.label or self.name + (f"?{self.query}" if self.query else "")
+
+
+REPORT_PATH = Path(
+    os.environ.get("PERF_REPORT", settings.BASE_DIR / "perf-report.json")
+)
+_report: dict[str, Any] = {}
+
+
+def write_report(results: dict[str, Any]) -> None:
+    # Test classes of one run add to the same report.
+    _report.update(results)
+    REPORT_PATH.write_text(json.dumps(_report, indent=2, sort_keys=True))
+
+
+class PerformanceTestCase(TestCase):
+    """
+    Requests every route in routes against a seeded database and checks its
+    query count and median wall clock time, both measured with a cold cache.
+    Results go to perf-report.json (or $PERF_REPORT).
+    """
+
+    routes: list[Route] = []
+    runs = 3
+    scale = Scale.from_env()
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        # Seeding takes a while, and a subclass without routes (or this class,
+        # where a test module imports it) has nothing to measure.
+        if not cls.routes:
+            raise SkipTest("No routes to measure")
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        started = time.monotonic()
+        seed(cls.scale)
+        cls.seed_seconds = time.monotonic() - started
+        cls.user = get_user_model().objects.order_by("pk").first()
+        cls.book = Book.book.published().order_by("pk").first()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        write_report(getattr(cls, "results", {}))
+        super().tearDownClass()
+
+    def resolve(self, value: Any) -> Any:
+        return value(self) if callable(value) else value
+
+    def request(self, route: Route) -> tuple[Any, int, float]:
+        url = reverse(route.name, kwargs=self.resolve(route.kwargs))
+        if route.query:
+            url += f"?{route.query}"
+        # The form views redirect back to the page the form was posted from.
+        headers = {"referer": f"http://testserver{self.book.get_absolute_url()}"}
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(self.client, route.method)(
+                url, self.resolve(route.data), headers=headers
+            )
+            elapsed = time.perf_counter() - started
+        return response, len(queries), elapsed
+
+    def measure(self, route: Route) -> dict[str, Any]:
+        self.client.logout()
+        if route.login:
+            self.client.force_login(self.user)
+
+        samples = [self.request(route) for _ in range(self.runs)]
+        response, queries, _ = samples[0]
+        seconds = statistics.median(elapsed for _, _, elapsed in samples)
+        return {
+            "url": response.request["PATH_INFO"],
+            "status": response.status_code,
+            "queries": queries,
+            "max_queries": route.max_queries,
+            "seconds": round(seconds, 4),
+            "max_seconds": route.max_seconds,
+            "rows": {
+                "books": self.scale.books,
+                "ratings": self.scale.ratings,
+                "reviews": self.scale.reviews,
+            },
+        }
+
+    def test_routes_stay_within_budget(self) -> None:
+        type(self).results = {}
+        for route in self.routes:
+            with self.subTest(route.id):
+                result = self.measure(route)
+                type(self).results[route.id] = result
+                self.assertIn(result["status"], route.status, result)
+                self.assertLessEqual(result["queries"], route.max_queries, result)
+                self.assertLessEqual(result["seconds"], route.max_seconds, result)
+
+
+def book_slug(test: PerformanceTestCase) -> dict[str, Any]:
+    return {"slug": test.book.slug}
+
+
+def book_post(test: PerformanceTestCase) -> dict[str, Any]:
+    return {"book_id": test.book.pk}
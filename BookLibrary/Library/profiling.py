@@ -0,0 +1,377 @@
+import cProfile
+import io
+import math
+import pstats
+import random
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import wraps
+from typing import Any, Callable, Iterable, Optional, TypeVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+from django.http import HttpRequest, HttpResponse
+
+from .caching import atomic, bump_version, get_version
+from .models import RequestProfile
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+DEFAULTS = {
+    # Fraction of requests that are timed and stored.
+    "SAMPLE_RATE": 0.01,
+    # Staff requests carrying this header also get a cProfile capture.
+    "HEADER": "X-Profile",
+    "EXCLUDE_NAMESPACES": ("admin", "djdt"),
+    "PROFILE_LINES": 40,
+}
+
+CAPTURE_KEY = "Library:profiling:capture"
+# Seconds a process goes by the captures it last read before checking the
+# version of CAPTURE_KEY again.
+CAPTURE_CHECK_INTERVAL = 1.0
+
+_current: ContextVar[Optional["Sample"]] = ContextVar("profiling_sample", default=None)
+
+
+def get_config() -> dict[str, Any]:
+    return {**DEFAULTS, **getattr(settings, "PROFILING", {})}
+
+
+def percentile(values: list[float], p: float) -> float:
+    # Nearest rank on sorted values.
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+@dataclass
+class Sample:
+    started: float = field(default_factory=time.perf_counter)
+    db_seconds: float = 0.0
+    queries: int = 0
+    template_seconds: float = 0.0
+    # Tag name -> [calls, seconds]. Nested tags count towards both.
+    tags: dict[str, list] = field(default_factory=dict)
+    profiler: Optional[cProfile.Profile] = None
+    _stack: ExitStack = field(default_factory=ExitStack, repr=False)
+
+    def start(self) -> "Sample":
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self.execute))
+        return self
+
+    def stop(self) -> None:
+        if self.profiler:
+            self.profiler.disable()
+        self._stack.close()
+
+    def execute(self, execute, sql, params, many, context) -> Any:
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+            self.queries += 1
+
+    def add_tag(self, name: str, seconds: float) -> None:
+        calls, total = self.tags.get(name, (0, 0.0))
+        self.tags[name] = [calls + 1, total + seconds]
+
+    def profile(self) -> None:
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def profile_output(self, lines: int) -> str:
+        if not self.profiler:
+            return ""
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats("cumulative").print_stats(
+            lines
+        )
+        return out.getvalue()
+
+
+def timed(name: str) -> Callable[[F], F]:
+    """Adds the decorated template tag's time to the sampled request, if any."""
+
+    def decorator(func: F) -> F:
+        @wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            sample = _current.get()
+            if sample is None:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                sample.add_tag(name, time.perf_counter() - started)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+@dataclass(frozen=True)
+class PendingCaptures:
+    """What this process last read of the captures asked for."""
+
+    checked: float = -math.inf
+    version: Optional[int] = None
+    # View name -> captures asked for at this version.
+    counts: dict[str, int] = field(default_factory=dict)
+
+
+_pending = PendingCaptures()
+
+
+def capture_key(version: int, view_name: str) -> str:
+    # Counts the captures taken, so the check works with incr() alone.
+    return f"{CAPTURE_KEY}:{version}:{view_name}"
+
+
+def set_captures(counts: dict[str, int]) -> None:
+    global _pending
+    bump_version(CAPTURE_KEY)
+    version = get_version(CAPTURE_KEY)
+    # The counters go first: a process that sees the counts finds them.
+    cache.set_many({capture_key(version, name): 0 for name in counts}, None)
+    cache.set(f"{CAPTURE_KEY}:{version}", counts, None)
+    _pending = PendingCaptures()
+
+
+def request_captures(view_names: Iterable[str], count: int = 1) -> None:
+    """Profiles the next count requests to each view, whoever makes them."""
+    version = get_version(CAPTURE_KEY)
+    counts = cache.get(f"{CAPTURE_KEY}:{version}") or {}
+    taken = cache.get_many([capture_key(version, name) for name in counts])
+    # Captures still left of an earlier request carry over.
+    counts = {
+        name: left
+        for name, limit in counts.items()
+        if (left := limit - taken.get(capture_key(version, name), limit)) > 0
+    }
+    counts.update(dict.fromkeys(view_names, count))
+    set_captures(counts)
+
+
+def clear_captures() -> None:
+    set_captures({})
+
+
+def get_pending_captures() -> PendingCaptures:
+    global _pending
+    pending = _pending
+    now = time.monotonic()
+    if now - pending.checked < CAPTURE_CHECK_INTERVAL:
+        return pending
+    version = get_version(CAPTURE_KEY)
+    if version == pending.version:
+        _pending = PendingCaptures(now, pending.version, pending.counts)
+        return _pending
+    counts = cache.get(f"{CAPTURE_KEY}:{version}")
+    if counts is None:
+        # Read between the version bump and the counts write, or evicted.
+        _pending = PendingCaptures(now, pending.version, pending.counts)
+    else:
+        _pending = PendingCaptures(now, version, counts)
+    return _pending
+
+
+def take_capture(view_name: str) -> bool:
+    pending = get_pending_captures()
+    limit = pending.counts.get(view_name)
+    if not limit or pending.version is None:
+        return False
+    try:
+        with atomic():
+            taken = cache.incr(capture_key(pending.version, view_name))
+    except ValueError:
+        # The counter was evicted; nothing left to take.
+        taken = limit + 1
+    if taken >= limit:
+        # Every capture is taken, this process stops asking until the next
+        # version.
+        pending.counts.pop(view_name, None)
+    return taken <= limit
+
+
+class ProfilingMiddleware:
+    """
+    Times SAMPLE_RATE of requests: total, database time and query count,
+    template rendering and @timed template tags, stored as RequestProfile
+    rows. A staff request with the X-Profile header, or one the admin asked
+    a capture for, is sampled as well and runs under cProfile. Unsampled
+    requests pay for a random() call, plus a cache lookup once every
+    CAPTURE_CHECK_INTERVAL.
+
+    Goes after AuthenticationMiddleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        config = get_config()
+        self.sample_rate = config["SAMPLE_RATE"]
+        self.header = config["HEADER"]
+        self.exclude = set(config["EXCLUDE_NAMESPACES"])
+        self.profile_lines = config["PROFILE_LINES"]
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if self.is_async:
+            return self.__acall__(request)
+        sampled = self.sample_rate and random.random() < self.sample_rate
+        token = _current.set(Sample().start() if sampled else None)
+        try:
+            response = self.get_response(request)
+        finally:
+            # process_view() may have started one.
+            sample = _current.get()
+            _current.reset(token)
+            if sample is not None:
+                sample.stop()
+        if sample is not None:
+            self.record(request, response, sample)
+        return response
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        sampled = self.sample_rate and random.random() < self.sample_rate
+        # Started and stopped on the request's sync thread: its queries run
+        # there, and cProfile only sees the thread it was enabled on.
+        token = _current.set(await sync_to_async(Sample().start)() if sampled else None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            sample = _current.get()
+            _current.reset(token)
+            if sample is not None:
+                await sync_to_async(sample.stop)()
+        if sample is not None:
+            await sync_to_async(self.record)(request, response, sample)
+        return response
+
+    def record(
+        self, request: HttpRequest, response: HttpResponse, sample: Sample
+    ) -> None:
+        total = time.perf_counter() - sample.started
+        match = request.resolver_match
+        if match is None or self.exclude.intersection(match.namespaces):
+            return
+        try:
+            RequestProfile.objects.create(
+                view_name=match.view_name,
+                method=request.method,
+                path=request.path[:2000],
+                status=response.status_code,
+                total_ms=total * 1000,
+                db_ms=sample.db_seconds * 1000,
+                queries=sample.queries,
+                template_ms=sample.template_seconds * 1000,
+                tags={name: [n, s * 1000] for name, (n, s) in sample.tags.items()},
+                profile=sample.profile_output(self.profile_lines),
+            )
+        except DatabaseError:
+            # Losing a sample is better than failing the request.
+            pass
+
+    def process_view(
+        self,
+        request: HttpRequest,
+        view_func: Callable,
+        view_args: Any,
+        view_kwargs: Any,
+    ) -> None:
+        view_name = request.resolver_match.view_name
+        wanted = (
+            self.header in request.headers and request.user.is_staff
+        ) or take_capture(view_name)
+        if not wanted:
+            return None
+        sample = _current.get()
+        if sample is None:
+            # Starts at the view, so queries of earlier middleware are missed.
+            sample = Sample().start()
+            _current.set(sample)
+        sample.profile()
+        return None
+
+    def process_template_response(
+        self, request: HttpRequest, response: HttpResponse
+    ) -> HttpResponse:
+        sample = _current.get()
+        if sample is not None:
+            # Called right before render(), the callback right after it.
+            started = time.perf_counter()
+
+            def rendered(response: HttpResponse) -> None:
+                sample.template_seconds += time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+@dataclass
+class ViewSummary:
+    view_name: str
+    requests: int
+    total_ms: list[float]
+    db_ms: float
+    queries: float
+    template_ms: float
+    tags: dict[str, tuple[float, float]]
+
+    @property
+    def p50_ms(self) -> float:
+        return percentile(self.total_ms, 50)
+
+    @property
+    def p95_ms(self) -> float:
+        return percentile(self.total_ms, 95)
+
+    @property
+    def mean_ms(self) -> float:
+        return sum(self.total_ms) / self.requests
+
+
+def summarize(profiles: Iterable[RequestProfile]) -> list[ViewSummary]:
+    """
+    Per request averages of the given samples by view, the views with the
+    most time in total first.
+    """
+    rows: dict[str, list[RequestProfile]] = {}
+    for profile in profiles:
+        rows.setdefault(profile.view_name, []).append(profile)
+
+    summaries = []
+    for view_name, samples in rows.items():
+        n = len(samples)
+        tags: dict[str, list[float]] = {}
+        for sample in samples:
+            for name, (calls, ms) in sample.tags.items():
+                totals = tags.setdefault(name, [0, 0.0])
+                totals[0] += calls
+                totals[1] += ms
+        summaries.append(
+            ViewSummary(
+                view_name=view_name,
+                requests=n,
+                total_ms=sorted(s.total_ms for s in samples),
+                db_ms=sum(s.db_ms for s in samples) / n,
+                queries=sum(s.queries for s in samples) / n,
+                template_ms=sum(s.template_ms for s in samples) / n,
+                tags={
+                    name: (calls / n, ms / n)
+                    for name, (calls, ms) in sorted(tags.items())
+                },
+            )
+        )
+    return sorted(summaries, key=lambda s: sum(s.total_ms), reverse=True)
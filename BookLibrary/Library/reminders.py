@@ -0,0 +1,86 @@
+import smtplib
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Callable, Optional
+
+from django.core.mail import EmailMessage, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import Loan
+
+
+@dataclass
+class SweepReport:
+    loans: int = 0
+    sent: int = 0
+    batches: int = 0
+    backfilled: int = 0
+    failed: dict[int, str] = field(default_factory=dict)
+
+    def summary(self) -> str:
+        return (
+            f"{self.loans} overdue loans marked, {self.sent} reminders sent "
+            f"in {self.batches} batches, {len(self.failed)} failed, "
+            f"{self.backfilled} loans backfilled"
+        )
+
+
+def reminder(loan: Loan) -> Optional[EmailMessage]:
+    if not loan.user.email:
+        return None
+    body = render_to_string(
+        "Library/overdue_reminder_email.html",
+        {"loan": loan, "book": loan.book, "user": loan.user},
+    )
+    return EmailMessage(f'Please return "{loan.book.name}"', body, to=[loan.user.email])
+
+
+def sweep_overdue(
+    today: Optional[date] = None,
+    batch_size: int = 500,
+    max_batches: Optional[int] = None,
+    connection: Optional[BaseEmailBackend] = None,
+    progress: Optional[Callable[[SweepReport], None]] = None,
+) -> SweepReport:
+    """
+    Sends a reminder for every loan that was due before today and marks it,
+    batch_size loans at a time over one EMAIL_BACKEND connection. A batch is
+    marked only after its messages went out, so an interrupted sweep resends
+    at most one batch and the next run carries on where it stopped. Each
+    batch is an index range read, whatever the size of the loan history.
+
+    Messages go out one at a time: a refused recipient is reported in
+    failed and left unmarked for the next run, the rest of the batch is
+    marked as usual.
+    """
+    today = today or timezone.localdate()
+    report = SweepReport(backfilled=Loan.objects.backfill(today))
+    connection = connection or get_connection()
+    with connection:
+        while max_batches is None or report.batches < max_batches:
+            loans = list(
+                Loan.objects.overdue(today)
+                .exclude(pk__in=report.failed)
+                .select_related("book__author", "user")[:batch_size]
+            )
+            if not loans:
+                break
+            reminded = []
+            for loan in loans:
+                message = reminder(loan)
+                if message:
+                    try:
+                        report.sent += connection.send_messages([message]) or 0
+                    except (smtplib.SMTPException, OSError) as e:
+                        report.failed[loan.pk] = str(e)
+                        continue
+                reminded.append(loan.pk)
+            report.loans += Loan.objects.filter(pk__in=reminded).update(
+                time_reminded=timezone.now()
+            )
+            report.batches += 1
+            if progress:
+                progress(report)
+    return report
@@ -0,0 +1,133 @@
+import re
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.db import connection
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.utils.module_loading import import_string
+
+from .models import Author, Book, BookSearchIndex, Category
+
+
+def get_terms(query: str) -> list[str]:
+    return re.findall(r"\w+", query)
+
+
+class SearchBackend:
+    def setup(self) -> None:
+        pass
+
+    def index_books(self, **filters) -> None:
+        pass
+
+    def remove_books(self, book_ids: Iterable[int]) -> None:
+        pass
+
+    def rebuild(self) -> None:
+        pass
+
+    def filter(self, queryset: QuerySet, query: str, ranked: bool = False) -> QuerySet:
+        raise NotImplementedError
+
+
+class ContainsSearchBackend(SearchBackend):
+    def filter(self, queryset: QuerySet, query: str, ranked: bool = False) -> QuerySet:
+        q = Q()
+        for term in get_terms(query):
+            q &= (
+                Q(name__icontains=term)
+                | Q(author__full_name__icontains=term)
+                | Q(category__name__icontains=term)
+                | Q(publisher__icontains=term)
+                | Q(description__icontains=term)
+            )
+        if not q:
+            return queryset.none()
+        return queryset.filter(q)
+
+
+class SQLiteSearchBackend(SearchBackend):
+    table = BookSearchIndex._meta.db_table
+    # bm25 weights in column order: name, author, category, publisher, description
+    weights = (10.0, 5.0, 3.0, 2.0, 1.0)
+
+    def setup(self) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+                "name, author, category, publisher, description, "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+            cursor.execute(
+                f"INSERT INTO {self.table}({self.table}, rank) VALUES ('rank', %s)",
+                ["bm25(" + ", ".join(map(str, self.weights)) + ")"],
+            )
+
+    def index_books(self, **filters) -> None:
+        queryset = Book.objects.filter(**filters).values_list("pk", flat=True)
+        try:
+            where, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return
+        book = Book._meta.db_table
+        author = Author._meta.db_table
+        category = Category._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT OR REPLACE INTO {self.table}"
+                "(rowid, name, author, category, publisher, description) "
+                f'SELECT b."id", b."name", a."full_name", c."name", b."publisher", '
+                f'b."description" FROM "{book}" b '
+                f'JOIN "{author}" a ON a."id" = b."author_id" '
+                f'JOIN "{category}" c ON c."id" = b."category_id" '
+                f'WHERE b."id" IN ({where})',
+                params,
+            )
+
+    def remove_books(self, book_ids: Iterable[int]) -> None:
+        book_ids = list(book_ids)
+        if not book_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {self.table} WHERE rowid IN "
+                f"({', '.join(['%s'] * len(book_ids))})",
+                book_ids,
+            )
+
+    def rebuild(self) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+        self.index_books()
+
+    def filter(self, queryset: QuerySet, query: str, ranked: bool = False) -> QuerySet:
+        terms = get_terms(query)
+        if not terms:
+            return queryset.none()
+        match = " ".join(f'"{term}"*' for term in terms)
+        queryset = queryset.filter(search_index__document__match=match)
+        if ranked:
+            queryset = queryset.order_by("search_index__rank", "-pk")
+        return queryset
+
+
+_backend: Optional[SearchBackend] = None
+
+
+def get_backend() -> SearchBackend:
+    global _backend
+    if _backend is None:
+        path = getattr(settings, "LIBRARY_SEARCH_BACKEND", None)
+        if path:
+            _backend = import_string(path)()
+        elif connection.vendor == "sqlite":
+            _backend = SQLiteSearchBackend()
+        else:
+            _backend = ContainsSearchBackend()
+    return _backend
+
+
+def search_books(queryset: QuerySet, query: str, ranked: bool = False) -> QuerySet:
+    return get_backend().filter(queryset, query, ranked=ranked)
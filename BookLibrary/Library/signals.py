@@ -0,0 +1,129 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from . import homepage
+from .caching import invalidate_model
+from .images import IMAGE_FIELDS, needs_variants, schedule_variants
+from .models import Author, Book, Category, RatingSummary, Review, UserRating
+from .search import get_backend
+
+# Models behind CachedManager lookups (or select_related into them).
+CACHED_MODELS = (Book, Author, Category, RatingSummary)
+
+# Deleting any of these cascades to the book itself, so its summary goes with it.
+BOOK_CASCADE_MODELS = (Book, Author, Category)
+
+
+@receiver(post_save, sender=UserRating)
+def refresh_rating_summary(sender, instance: UserRating, **kwargs) -> None:
+    homepage.invalidate_rating(RatingSummary.objects.refresh(instance.book_id))
+
+
+@receiver(post_delete, sender=UserRating)
+def refresh_rating_summary_on_delete(sender, instance: UserRating, **kwargs) -> None:
+    origin = kwargs.get("origin")
+    if isinstance(origin, BOOK_CASCADE_MODELS):
+        return
+    if getattr(origin, "model", None) in BOOK_CASCADE_MODELS:
+        return
+    homepage.invalidate_rating(RatingSummary.objects.refresh(instance.book_id))
+
+
+def count_review(book_id: int, delta: int) -> None:
+    # A single UPDATE, so concurrent comments don't lose each other's count.
+    books = Book.objects.filter(pk=book_id, review_count__gte=-delta)
+    if not books.update(review_count=F("review_count") + delta):
+        # The counter is behind the reviews (they were bulk inserted, or
+        # came before it), and would go below zero.
+        Book.book.recount_reviews(pk=book_id)
+    invalidate_model(Book)
+
+
+@receiver(post_save, sender=Review)
+def count_added_review(
+    sender, instance: Review, created: bool, raw: bool = False, **kwargs
+) -> None:
+    if created and not raw:
+        count_review(instance.book_id, 1)
+
+
+@receiver(post_delete, sender=Review)
+def count_deleted_review(sender, instance: Review, **kwargs) -> None:
+    origin = kwargs.get("origin")
+    if isinstance(origin, BOOK_CASCADE_MODELS):
+        return
+    if getattr(origin, "model", None) in BOOK_CASCADE_MODELS:
+        return
+    count_review(instance.book_id, -1)
+
+
+@receiver(post_migrate)
+def setup_search_index(sender, **kwargs) -> None:
+    if sender.name == "Library":
+        get_backend().setup()
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance: Book, raw: bool = False, **kwargs) -> None:
+    if not raw:
+        get_backend().index_books(pk=instance.pk)
+
+
+@receiver(post_save, sender=Author)
+def index_author_books(sender, instance: Author, raw: bool = False, **kwargs) -> None:
+    if not raw:
+        get_backend().index_books(author=instance)
+
+
+@receiver(post_save, sender=Category)
+def index_category_books(
+    sender, instance: Category, raw: bool = False, **kwargs
+) -> None:
+    if not raw:
+        get_backend().index_books(category=instance)
+
+
+@receiver(post_delete, sender=Book)
+def remove_book_from_index(sender, instance: Book, **kwargs) -> None:
+    get_backend().remove_books([instance.pk])
+
+
+@receiver(post_save, sender=Book)
+def invalidate_home_book(sender, instance: Book, **kwargs) -> None:
+    published = instance.is_published == Book.Status.PUBLISHED
+    homepage.invalidate_books([instance.pk], published=published)
+
+
+@receiver(post_delete, sender=Book)
+def invalidate_home_book_on_delete(sender, instance: Book, **kwargs) -> None:
+    homepage.invalidate_books([instance.pk])
+
+
+@receiver(post_save, sender=Author)
+def invalidate_home_author(sender, instance: Author, **kwargs) -> None:
+    homepage.invalidate_author(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_home_categories(sender, **kwargs) -> None:
+    homepage.invalidate("cats")
+
+
+def build_image_variants(sender, instance, raw: bool = False, **kwargs) -> None:
+    if not raw and needs_variants(instance):
+        schedule_variants(instance)
+
+
+for model in IMAGE_FIELDS:
+    post_save.connect(build_image_variants, sender=model)
+
+
+def invalidate_model_cache(sender, **kwargs) -> None:
+    invalidate_model(sender)
+
+
+for model in CACHED_MODELS:
+    post_save.connect(invalidate_model_cache, sender=model)
+    post_delete.connect(invalidate_model_cache, sender=model)
@@ -1,8 +1,15 @@
+import sys
+from typing import Iterable, Optional
 from django import template
+from django.core.files.storage import default_storage
+from django.db.models import prefetch_related_objects
+from django.db.models.fields.files import FieldFile
+from django.utils.html import format_html, format_html_join
 from django.utils.safestring import SafeText, mark_safe
 
-from Library.models import UserRating
-
+from Library import homepage
+from Library.models import Book, RatingSummary
+from Library.profiling import timed
 
 register = template.Library()
 
@@ -25,44 +32,157 @@ star = """<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox
         </svg>"""
 
 
+def build_stars(full: int, half: bool) -> str:
+    return star * full + (half_star if half else "") + empty_star * (5 - full - half)
+
+
+# Every visual state in half-star steps, rendered once at import.
+STAR_FRAGMENTS: dict[tuple[int, bool], str] = {
+    (full, half): sys.intern(build_stars(full, half))
+    for full in range(6)
+    for half in (False, True)
+    if full + half <= 5
+}
+
+
+# Complete markup per displayed mark, filled on first use (a few dozen entries).
+RATING_FRAGMENTS: dict[tuple[int, bool, float], SafeText] = {}
+
+
+def render_rating(
+    total_rating: int, total_review: int, show_rating_amount: bool
+) -> SafeText:
+    mark = min(total_rating / total_review, 5.0)
+    full = int(mark)
+    half = mark - full >= 0.5
+    average = mark if mark.is_integer() else round(mark, 1)
+
+    res = RATING_FRAGMENTS.get((full, half, average))
+    if res is None:
+        res = RATING_FRAGMENTS[full, half, average] = mark_safe(
+            f"{STAR_FRAGMENTS[full, half]}<span>{average}/5</span>"
+        )
+
+    if show_rating_amount:
+        return res + mark_safe(
+            f'<span class="dot">·</span><span>{total_review} Ratings</span>'
+        )
+    return res
+
+
+def get_rating_summary(book: Book | int) -> Optional[RatingSummary]:
+    if isinstance(book, Book):
+        if Book.rating_summary.is_cached(book):  # type: ignore
+            return getattr(book, "rating_summary", None)
+        book = book.pk
+    return RatingSummary.objects.filter(book_id=book).first()
+
+
 @register.simple_tag()
-def book_rating(book_id: int, show_rating_amount: bool = False) -> SafeText:
-    total_rating, total_review = UserRating.book_rating.select_related("user", "book").book_total(
-        book_id=book_id
-    ).values()
+@timed("prefetch_ratings")
+def prefetch_ratings(books: Iterable[Book]) -> str:
+    prefetch_related_objects(list(books), "rating_summary")
+    return ""
+
 
-    review_num_string = f'<span class="dot">·</span><span>{total_review} Ratings</span>'
+@register.simple_tag()
+@timed("book_rating")
+def book_rating(book: Book | int, show_rating_amount: bool = False) -> SafeText:
+    summary = get_rating_summary(book)
 
-    if total_rating == None or total_review == None:
+    if summary is None or not summary.rating_count:
         return mark_safe("Not rated yet")
 
-    mark = int(total_rating) / int(total_review)
+    return render_rating(summary.rating_sum, summary.rating_count, show_rating_amount)
 
-    if mark >= 5:
-        mark = 5
 
-    average_mark_string = (
-        f"<span>{ mark if mark.is_integer() else round(mark, 1)}/5</span>"
+def srcset(variants: list[list]) -> str:
+    return ", ".join(
+        f"{default_storage.url(name)} {width}w" for width, name in variants
     )
-    d = mark - int(mark)
-    starts = star * int(mark)
-
-    if d >= 0.5:
-        empty_stars = empty_star * int(4 - int(mark))
-        res = "".join(
-            starts
-            + half_star
-            + empty_stars
-            + average_mark_string
-            + (review_num_string if show_rating_amount else "")
-        )
-    else:
-        empty_stars = empty_star * int(5 - int(mark))
-        res = "".join(
-            starts
-            + empty_stars
-            + average_mark_string
-            + (review_num_string if show_rating_amount else "")
+
+
+@register.simple_tag()
+@timed("picture")
+def picture(
+    image: FieldFile,
+    variants: dict,
+    alt: str = "",
+    css_class: str = "",
+    sizes: str = "240px",
+    eager: bool = False,
+    fetchpriority: str = "",
+) -> SafeText:
+    # Images above the fold pass eager=True, and the largest one on the page
+    # fetchpriority="high": lazy ones wait for layout before loading.
+    loading = format_html(' loading="{}"', "eager" if eager else "lazy")
+    if fetchpriority:
+        loading += format_html(' fetchpriority="{}"', fetchpriority)
+
+    if not variants or variants.get("source") != image.name or "jpeg" not in variants:
+        return format_html(
+            '<img class="{}" src="{}" alt="{}"{}>',
+            css_class,
+            default_storage.url(image.name),
+            alt,
+            loading,
         )
 
-    return mark_safe(res)
+    sources = format_html_join(
+        "",
+        '<source type="image/{}" srcset="{}" sizes="{}">',
+        (
+            (ext, srcset(variants[ext]), sizes)
+            for ext in ("avif", "webp")
+            if variants.get(ext)
+        ),
+    )
+    return format_html(
+        '<picture>{}<img class="{}" src="{}" srcset="{}" sizes="{}" alt="{}"{}></picture>',
+        sources,
+        css_class,
+        default_storage.url(variants["jpeg"][0][1]),
+        srcset(variants["jpeg"]),
+        sizes,
+        alt,
+        loading,
+    )
+
+
+@register.simple_tag(takes_context=True)
+def cursor_url(context, direction: str, cursor: str) -> str:
+    # Keeps sort/q/publisher and swaps the cursor parameter.
+    query = context["request"].GET.copy()
+    for param in ("after", "before", "page"):
+        query.pop(param, None)
+    query[direction] = cursor
+    return "?" + query.urlencode()
+
+
+class HomeSectionNode(template.Node):
+    def __init__(self, section: str, nodelist: template.NodeList) -> None:
+        self.section = section
+        self.nodelist = nodelist
+
+    @timed("home_section")
+    def render(self, context) -> str:
+        return homepage.get_html(self.section, lambda: self.nodelist.render(context))
+
+
+@register.tag
+def home_section(parser, token) -> HomeSectionNode:
+    """
+    {% home_section "top_books" %}...{% endhome_section %} caches the
+    rendered block until the section is invalidated.
+    """
+    bits = token.split_contents()
+    if len(bits) != 2 or bits[1][0] not in "'\"" or bits[1][-1] != bits[1][0]:
+        raise template.TemplateSyntaxError(
+            f"{bits[0]} takes a single quoted section name"
+        )
+    section = bits[1][1:-1]
+    if section not in homepage.SECTIONS:
+        raise template.TemplateSyntaxError(f"Unknown home section {section!r}")
+    nodelist = parser.parse(("endhome_section",))
+    parser.delete_first_token()
+    return HomeSectionNode(section, nodelist)
@@ -0,0 +1,206 @@
+import itertools
+import os
+import random
+from dataclasses import asdict, dataclass
+from functools import partial
+from typing import Callable, Iterable, Iterator, Optional
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db.models import Model
+
+from . import homepage
+from .caching import invalidate_model
+from .models import Author, Book, Category, RatingSummary, Review, UserRating
+from .search import get_backend
+
+WORDS = (
+    "shadow river garden winter empire silent glass iron letter night "
+    "ocean forest secret stone summer house crown city journey dream "
+    "fire north island storm memory mountain road star wolf harbor"
+).split()
+
+# Readers rate generously: mostly fours and fives.
+RATING_WEIGHTS = (4, 6, 18, 36, 36)
+
+
+@dataclass
+class Scale:
+    categories: int = 40
+    authors: int = 500
+    users: int = 300
+    books: int = 2000
+    ratings: int = 20000
+    reviews: int = 10000
+
+    @classmethod
+    def from_env(cls, var: str = "PERF_SCALE") -> "Scale":
+        factor = float(os.environ.get(var, 1))
+        return cls(**{k: max(1, int(v * factor)) for k, v in asdict(cls()).items()})
+
+
+def title(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def zipf_weights(n: int, skew: float) -> list[float]:
+    """
+    Cumulative weights where the k-th item is picked in proportion to
+    1 / k**skew: a few categories, authors and books get most of the
+    traffic and the rest form a long tail. skew=0 is uniform.
+    """
+    return list(itertools.accumulate(1 / k**skew for k in range(1, n + 1)))
+
+
+def bulk_insert(
+    model: type[Model],
+    objects: Iterable[Model],
+    batch_size: int,
+    progress: Optional[Callable[[str, int], None]] = None,
+) -> int:
+    # bulk_create() builds a list of everything first; feeding it chunks
+    # keeps memory flat for millions of rows.
+    total = 0
+    objects = iter(objects)
+    while chunk := list(itertools.islice(objects, batch_size)):
+        model.objects.bulk_create(chunk)
+        total += len(chunk)
+        if progress:
+            progress(model._meta.verbose_name_plural, total)
+    return total
+
+
+def seed(
+    scale: Optional[Scale] = None,
+    rng_seed: int = 0,
+    batch_size: int = 1000,
+    skew: float = 1.1,
+    prefix: str = "",
+    progress: Optional[Callable[[str, int], None]] = None,
+) -> None:
+    """
+    Adds scale's row counts through chunked bulk_create. Category sizes,
+    author output, book popularity (ratings and reviews) and user activity
+    follow a Zipf distribution. Slugs and usernames start with prefix.
+    Signals don't run, so summaries, the search index and cache versions
+    are rebuilt at the end.
+    """
+    scale = scale or Scale()
+    rng = random.Random(rng_seed)
+    User = get_user_model()
+    insert = partial(bulk_insert, batch_size=batch_size, progress=progress)
+
+    insert(
+        Category,
+        (
+            Category(name=f"{title(rng, 2)} {i}", slug=f"{prefix}category-{i}")
+            for i in range(scale.categories)
+        ),
+    )
+    insert(
+        Author,
+        (
+            Author(full_name=f"{title(rng, 2)} {i}", slug=f"{prefix}author-{i}")
+            for i in range(scale.authors)
+        ),
+    )
+    password = make_password("password")
+    insert(
+        User,
+        (
+            User(
+                username=f"{prefix}user{i}",
+                email=f"{prefix}user{i}@example.com",
+                password=password,
+            )
+            for i in range(scale.users)
+        ),
+    )
+    category_ids = list(
+        Category.objects.filter(slug__startswith=f"{prefix}category-")
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    author_ids = list(
+        Author.objects.filter(slug__startswith=f"{prefix}author-")
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    user_ids = list(
+        User.objects.filter(username__startswith=f"{prefix}user")
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    category_weights = zipf_weights(len(category_ids), skew)
+    author_weights = zipf_weights(len(author_ids), skew)
+    user_weights = zipf_weights(len(user_ids), skew)
+
+    def book(i: int) -> Book:
+        return Book(
+            name=title(rng, rng.randint(1, 4)),
+            slug=f"{prefix}book-{i}",
+            author_id=rng.choices(author_ids, cum_weights=author_weights)[0],
+            category_id=rng.choices(category_ids, cum_weights=category_weights)[0],
+            user_id=rng.choice(user_ids) if rng.random() < 0.1 else None,
+            is_taken=False,
+            publisher=title(rng, 1),
+            publisher_slug=rng.choice(WORDS),
+            description=title(rng, 30),
+            pages=rng.randint(50, 900),
+            is_published=rng.random() < 0.95,
+        )
+
+    insert(Book, (book(i) for i in range(scale.books)))
+    book_ids = list(
+        Book.objects.filter(slug__startswith=f"{prefix}book-")
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    # Shuffled so popularity doesn't follow insertion (and publication) order.
+    rng.shuffle(book_ids)
+    book_weights = zipf_weights(len(book_ids), skew)
+
+    def rated_pairs() -> Iterator[tuple[int, int]]:
+        seen: set[tuple[int, int]] = set()
+        target = min(scale.ratings, len(user_ids) * len(book_ids))
+        attempts = 0
+        # Popular books run out of unrated users, so give up after a while.
+        while len(seen) < target and attempts < target * 20:
+            attempts += 1
+            pair = (
+                rng.choices(user_ids, cum_weights=user_weights)[0],
+                rng.choices(book_ids, cum_weights=book_weights)[0],
+            )
+            if pair not in seen:
+                seen.add(pair)
+                yield pair
+
+    insert(
+        UserRating,
+        (
+            UserRating(
+                user_id=user_id,
+                book_id=book_id,
+                rating=rng.choices(range(1, 6), RATING_WEIGHTS)[0],
+            )
+            for user_id, book_id in rated_pairs()
+        ),
+    )
+    insert(
+        Review,
+        (
+            Review(
+                user_id=rng.choices(user_ids, cum_weights=user_weights)[0],
+                book_id=rng.choices(book_ids, cum_weights=book_weights)[0],
+                review_text=title(rng, rng.randint(3, 40)),
+            )
+            for _ in range(scale.reviews)
+        ),
+    )
+
+    RatingSummary.objects.rebuild()
+    Book.book.recount_reviews()
+    get_backend().rebuild()
+    # Versions, not cache.clear(): the cache is shared with everything else.
+    invalidate_model(Book, Author, Category, RatingSummary)
+    homepage.invalidate(*homepage.SECTIONS)
@@ -1,3 +1,2028 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import re
+import shutil
+import smtplib
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Any, Optional
+from urllib.parse import parse_qs, urlsplit
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import urllib3
+from asgiref.sync import async_to_sync, sync_to_async
+from PIL import Image as PILImage
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connection, connections
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.models import Avg, Count, F, Model, QuerySet, Sum
+from django.db.models.functions import Coalesce
+from django.http import Http404, HttpResponse
+from django.middleware.csrf import get_token
+from django.template import Context, Template
+from django.test import (
+    AsyncRequestFactory,
+    Client,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import homepage, images, jobs, metrics, openlibrary, profiling, search
+from .async_views import (
+    AsyncAuthorView,
+    AsyncBookView,
+    AsyncCategoryView,
+    AsyncIndexView,
+    AsyncSearchView,
+)
+from .importer import import_bibkeys, insert_new
+from .models import (
+    Author,
+    Book,
+    Category,
+    ImportJob,
+    Loan,
+    RatingSummary,
+    RequestProfile,
+    Review,
+    UserRating,
+)
+from .caching import bump_version, get_cached, get_or_build, get_version
+from .httpcache import ResponseCache
+from .openlibrary import API, AsyncAPI
+from .pagination import KeysetPaginator, encode_cursor
+from .reminders import sweep_overdue
+from .search import ContainsSearchBackend, SQLiteSearchBackend, search_books
+from .templatetags import tag
+from .views import AuthorView, BookView, CategoryView, IndexView, SearchView
+from .perf import PerformanceTestCase, Route, book_post, book_slug
+
+# "SCAN Library_book" without "USING ... INDEX" reads the whole table.
+FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+
+@skipUnless(connection.vendor == "sqlite", "Query plans are SQLite specific")
+class ListingQueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.category = Category.objects.create(name="Category", slug="category")
+        cls.author = Author.objects.create(full_name="Author", slug="author")
+        cls.user = get_user_model().objects.create_user(
+            username="reader", password="password"
+        )
+        cls.book = Book.objects.create(
+            name="Book",
+            slug="book",
+            author=cls.author,
+            category=cls.category,
+            user=cls.user,
+            publisher="Publisher",
+            publisher_slug="publisher",
+            is_published=Book.Status.PUBLISHED,
+        )
+
+    def plan(self, queryset: QuerySet) -> list[str]:
+        return [line.split(maxsplit=3)[-1] for line in queryset.explain().splitlines()]
+
+    def pages(self, queryset: QuerySet) -> list[QuerySet]:
+        """The first page and a page after a cursor, as KeysetPaginator runs them."""
+        paginator = KeysetPaginator(queryset, 8)
+        ordered = paginator.queryset.order_by(
+            *(key.order_by() for key in paginator.keys)
+        )
+        values = [
+            getattr(paginator.queryset.get(pk=self.book.pk), key.name)
+            for key in paginator.keys
+        ]
+        return [
+            ordered[:9],
+            ordered.filter(paginator.filter(values, reverse=False))[:9],
+        ]
+
+    def assertNoFullScan(self, queryset: QuerySet) -> list[str]:
+        plan = self.plan(queryset)
+        for line in plan:
+            self.assertIsNone(FULL_SCAN.match(line), f"{line!r} in {plan}")
+        return plan
+
+    def listings(self) -> dict[str, QuerySet]:
+        sorts = ("top_rated", "unpopular", "new_books", "old_books")
+        filters = {
+            "": {},
+            "category": {"category__slug": self.category.slug},
+            "author": {"author": self.author},
+            "shelf": {"user": self.user},
+        }
+        return {
+            f"{sort} {name}".strip(): getattr(Book.book, sort)().filter(**lookup)
+            for sort in sorts
+            for name, lookup in filters.items()
+        }
+
+    def test_listings_use_an_index(self) -> None:
+        for name, queryset in self.listings().items():
+            for page in self.pages(queryset):
+                with self.subTest(name):
+                    self.assertNoFullScan(page)
+
+    def test_filtered_listings_seek_books(self) -> None:
+        for name, queryset in self.listings().items():
+            if " " not in name:
+                continue
+            for page in self.pages(queryset):
+                with self.subTest(name):
+                    plan = self.assertNoFullScan(page)
+                    self.assertTrue(
+                        any(line.startswith("SEARCH Library_book ") for line in plan),
+                        plan,
+                    )
+
+    def test_date_listings_are_ordered_by_the_index(self) -> None:
+        for name, queryset in self.listings().items():
+            if not name.startswith(("new_books", "old_books")):
+                continue
+            for page in self.pages(queryset):
+                with self.subTest(name):
+                    plan = self.assertNoFullScan(page)
+                    self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", plan)
+
+    def test_search_uses_the_full_text_index(self) -> None:
+        queryset = search_books(Book.book.top_rated(), "book", ranked=True)
+        for page in self.pages(queryset):
+            plan = self.assertNoFullScan(page)
+            self.assertTrue(any("VIRTUAL TABLE" in line for line in plan), plan)
+
+    def test_overdue_loans_use_the_partial_index(self) -> None:
+        queryset = Loan.objects.overdue(timezone.localdate())[:500]
+        plan = self.assertNoFullScan(queryset)
+        self.assertTrue(any("loan_overdue_idx" in line for line in plan), plan)
+        self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", plan)
+
+    def test_comment_pages_use_the_book_index(self) -> None:
+        Review.objects.create(
+            user=self.user, book=self.book, review_text="A fine review"
+        )
+        for page in self.pages(Review.objects.for_book(self.book.pk)):
+            plan = self.assertNoFullScan(page)
+            self.assertTrue(any("review_book_time_idx" in line for line in plan), plan)
+            self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", plan)
+
+    def test_rating_summary_aggregate_is_covered(self) -> None:
+        queryset = (
+            UserRating.objects.filter(book=self.book, rating__isnull=False)
+            .values("book")
+            .annotate(rating_sum=Sum("rating"), rating_count=Count("rating"))
+        )
+        plan = self.assertNoFullScan(queryset)
+        self.assertTrue(
+            any("USING COVERING INDEX rating_book_rating_idx" in line for line in plan),
+            plan,
+        )
+
+
+class SearchBackendTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        novels = Category.objects.create(name="Novels", slug="novels")
+        stories = Category.objects.create(name="Stories", slug="stories")
+        cls.dostoyevsky = Author.objects.create(
+            full_name="Fyodor Dostoyevsky", slug="fyodor-dostoyevsky"
+        )
+        chekhov = Author.objects.create(full_name="Anton Chekhov", slug="chekhov")
+        cls.crime = Book.objects.create(
+            name="Crime and Punishment",
+            slug="crime-and-punishment",
+            author=cls.dostoyevsky,
+            category=novels,
+            description="A student in Petersburg",
+        )
+        cls.notes = Book.objects.create(
+            name="Notes",
+            slug="notes",
+            author=chekhov,
+            category=stories,
+            publisher="Penguin",
+            description="On crime and Petersburg",
+        )
+        cls.cafe = Book.objects.create(
+            name="Café Stories",
+            slug="cafe-stories",
+            author=chekhov,
+            category=stories,
+        )
+
+    def search(self, backend: search.SearchBackend, query: str, **kwargs) -> list:
+        return list(backend.filter(Book.objects.all(), query, **kwargs))
+
+    def test_full_text_ranks_names_first(self) -> None:
+        backend = SQLiteSearchBackend()
+        self.assertEqual(
+            self.search(backend, "crime", ranked=True), [self.crime, self.notes]
+        )
+        self.assertEqual(
+            self.search(backend, "petersburg penguin", ranked=True), [self.notes]
+        )
+
+    def test_full_text_matches_prefixes_and_folds_diacritics(self) -> None:
+        backend = SQLiteSearchBackend()
+        self.assertEqual(self.search(backend, "dostoy"), [self.crime])
+        self.assertEqual(self.search(backend, "cafe"), [self.cafe])
+        self.assertEqual(self.search(backend, "--"), [])
+
+    def test_full_text_index_follows_changes(self) -> None:
+        backend = SQLiteSearchBackend()
+        self.dostoyevsky.full_name = "F. M. Dostoevsky"
+        self.dostoyevsky.save()
+        self.assertEqual(self.search(backend, "dostoevsky"), [self.crime])
+        self.assertEqual(self.search(backend, "dostoyevsky"), [])
+
+        self.notes.delete()
+        self.assertEqual(self.search(backend, "crime"), [self.crime])
+
+    def test_fallback_matches_every_term_in_any_field(self) -> None:
+        backend = ContainsSearchBackend()
+        self.assertEqual(
+            sorted(self.search(backend, "crime petersburg"), key=lambda b: b.pk),
+            [self.crime, self.notes],
+        )
+        self.assertEqual(self.search(backend, "crime student"), [self.crime])
+        self.assertEqual(self.search(backend, "chekhov penguin"), [self.notes])
+        self.assertEqual(self.search(backend, ""), [])
+
+    def test_backend_comes_from_settings(self) -> None:
+        path = "Library.search.ContainsSearchBackend"
+        with mock.patch.object(search, "_backend", None), override_settings(
+            LIBRARY_SEARCH_BACKEND=path
+        ):
+            self.assertIsInstance(search.get_backend(), ContainsSearchBackend)
+        with mock.patch.object(search, "_backend", None):
+            self.assertIsInstance(search.get_backend(), SQLiteSearchBackend)
+
+
+class KeysetPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        category = Category.objects.create(name="Category", slug="category")
+        author = Author.objects.create(full_name="Author", slug="author")
+        cls.books = [
+            Book.objects.create(
+                name=f"Book {i}",
+                slug=f"book-{i}",
+                author=author,
+                category=category,
+                is_published=Book.Status.PUBLISHED,
+            )
+            for i in range(7)
+        ]
+        reader = get_user_model().objects.create_user(username="reader")
+        # Two share a rating; the last four have none.
+        for book, rating in zip(cls.books, (5, 3, 3)):
+            UserRating.objects.create(user=reader, book=book, rating=rating)
+
+    def walk(self, queryset: QuerySet, per_page: int) -> list[Any]:
+        paginator = KeysetPaginator(queryset, per_page)
+        page = paginator.page()
+        rows = list(page)
+        while page.has_next():
+            page = paginator.page(after=page.next_cursor)
+            rows += page
+        return rows
+
+    def test_null_ratings_across_page_boundaries(self) -> None:
+        for name in ("top_rated", "unpopular"):
+            queryset = getattr(Book.book, name)()
+            # One page is in the paginator's order, ties broken by pk.
+            expected = self.walk(queryset, len(self.books))
+            self.assertCountEqual(expected, self.books)
+            for per_page in (2, 3, 4):
+                with self.subTest(name, per_page=per_page):
+                    self.assertEqual(self.walk(queryset, per_page), expected)
+
+    def test_before_returns_the_page_after_came_from(self) -> None:
+        paginator = KeysetPaginator(Book.book.top_rated(), 2)
+        first = paginator.page()
+        second = paginator.page(after=first.next_cursor)
+        third = paginator.page(after=second.next_cursor)
+        back = paginator.page(before=third.previous_cursor)
+        self.assertEqual(back.object_list, second.object_list)
+        self.assertEqual(back.number, second.number)
+        back = paginator.page(before=back.previous_cursor)
+        self.assertEqual(back.object_list, first.object_list)
+        self.assertFalse(back.has_previous())
+        self.assertEqual(
+            paginator.page(after=back.next_cursor).object_list, second.object_list
+        )
+
+    def test_tampered_cursors_are_not_found(self) -> None:
+        cursors = {
+            "top_rated": ["x", 1, 1],
+            "unpopular": [[1], 1, 1],
+            "new_books": ["yesterday", 1],
+        }
+        for name, values in cursors.items():
+            with self.subTest(name):
+                paginator = KeysetPaginator(getattr(Book.book, name)(), 2)
+                with self.assertRaises(Http404):
+                    paginator.page(after=encode_cursor(values, 1))
+        paginator = KeysetPaginator(Book.book.top_rated(), 2)
+        for cursor in ("garbage", encode_cursor([5.0], 1)):
+            with self.subTest(cursor), self.assertRaises(Http404):
+                paginator.page(after=cursor)
+
+        url = reverse("Lib:library")
+        response = self.client.get(url, {"after": encode_cursor(["x", 1, 1], 1)})
+        self.assertEqual(response.status_code, 404)
+
+
+class UserRatingConstraintTests(TestCase):
+    def test_one_rating_per_user_and_book(self) -> None:
+        category = Category.objects.create(name="Category", slug="category")
+        author = Author.objects.create(full_name="Author", slug="author")
+        user = get_user_model().objects.create_user(username="reader")
+        book = Book.objects.create(
+            name="Book", slug="book", author=author, category=category
+        )
+        UserRating.objects.create(user=user, book=book, rating=5)
+        with self.assertRaises(IntegrityError):
+            UserRating.objects.create(user=user, book=book, rating=4)
+
+
+class RatingSummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        category = Category.objects.create(name="Category", slug="category")
+        author = Author.objects.create(full_name="Author", slug="author")
+        cls.books = [
+            Book.objects.create(
+                name=f"Book {i}",
+                slug=f"book-{i}",
+                author=author,
+                category=category,
+                is_published=Book.Status.PUBLISHED,
+            )
+            for i in range(3)
+        ]
+        User = get_user_model()
+        cls.readers = [User.objects.create_user(username=f"r{i}") for i in range(3)]
+
+    def rate(self, reader: Model, book: Book, **data: Any) -> None:
+        self.client.force_login(reader)
+        url = reverse("Lib:book_rate", kwargs={"slug": book.slug})
+        self.client.post(url, {"book_id": book.pk, **data})
+
+    def assertSummaryMatchesRatings(self, book: Book) -> None:
+        ratings = UserRating.objects.filter(book=book, rating__isnull=False)
+        expected = ratings.aggregate(
+            rating_sum=Coalesce(Sum("rating"), 0),
+            rating_count=Count("rating"),
+            average=Avg("rating"),
+        )
+        for stars, name in enumerate(
+            ("one_star", "two_stars", "three_stars", "four_stars", "five_stars"), 1
+        ):
+            expected[name] = ratings.filter(rating=stars).count()
+        summary = RatingSummary.objects.get(book=book)
+        self.assertEqual({name: getattr(summary, name) for name in expected}, expected)
+
+    def test_summary_follows_ratings_through_the_view(self) -> None:
+        book = self.books[0]
+        self.rate(self.readers[0], book, rate=5)
+        self.assertSummaryMatchesRatings(book)
+        self.rate(self.readers[1], book, rate=2)
+        self.assertSummaryMatchesRatings(book)
+        # Changed, not added.
+        self.rate(self.readers[0], book, rate=3)
+        self.assertSummaryMatchesRatings(book)
+        self.assertEqual(RatingSummary.objects.get(book=book).rating_count, 2)
+
+        self.rate(self.readers[1], book, delete="1")
+        self.assertSummaryMatchesRatings(book)
+        self.rate(self.readers[0], book, delete="1")
+        self.assertSummaryMatchesRatings(book)
+        self.assertIsNone(RatingSummary.objects.get(book=book).average)
+
+    def test_ratings_only_invalidate_cached_models(self) -> None:
+        with mock.patch("Library.signals.invalidate_model") as invalidate:
+            self.rate(self.readers[0], self.books[0], rate=4)
+        invalidated = {
+            model for call in invalidate.call_args_list for model in call.args
+        }
+        self.assertIn(RatingSummary, invalidated)
+        self.assertNotIn(UserRating, invalidated)
+
+    def test_listings_order_by_the_summary(self) -> None:
+        for reader, rating in zip(self.readers, (5, 4, 3)):
+            self.rate(reader, self.books[1], rate=rating)
+        self.rate(self.readers[0], self.books[2], rate=2)
+        # Rated books by a fresh aggregate; SQLite puts the unrated book
+        # (NULL) last in descending order, first in ascending.
+        fresh = (
+            Book.objects.annotate(average=Avg("userrating__rating"))
+            .filter(average__isnull=False)
+            .order_by("-average")
+        )
+        expected = [*fresh, self.books[0]]
+        self.assertEqual(list(Book.book.top_rated()), expected)
+        self.assertEqual(list(Book.book.unpopular()), expected[::-1])
+
+        top = Book.book.top_rated().get(pk=self.books[1].pk)
+        self.assertEqual((top.top, top.total_view), (4.0, 3))
+
+        # A changed rating moves the book.
+        self.rate(self.readers[0], self.books[2], rate=5)
+        self.assertEqual(Book.book.top_rated()[0], self.books[2])
+
+
+class CacheVersionTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.name = f"tests:{uuid.uuid4().hex}"
+
+    def test_concurrent_bumps_are_all_counted(self) -> None:
+        start = get_version(self.name)
+
+        def bump(_: int) -> None:
+            for _ in range(25):
+                bump_version(self.name)
+
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(bump, range(8)))
+        self.assertEqual(get_version(self.name), start + 200)
+
+    def test_one_worker_builds(self) -> None:
+        builds = []
+
+        def build() -> str:
+            builds.append(1)
+            time.sleep(0.1)
+            return "value"
+
+        with ThreadPoolExecutor(8) as pool:
+            values = list(pool.map(lambda _: get_or_build(self.name, build), range(8)))
+        self.assertEqual(values, ["value"] * 8)
+        self.assertEqual(len(builds), 1)
+
+    def test_stale_value_is_served_while_another_process_builds(self) -> None:
+        self.assertEqual(get_or_build(self.name, lambda: "old"), "old")
+        bump_version(self.name)
+        # What the worker rebuilding it holds, as add_lock() takes it.
+        lock = f"{self.name}:{get_version(self.name)}:lock"
+        cache.add(lock, 1)
+        self.addCleanup(cache.delete, lock)
+        build = mock.Mock(return_value="new")
+        self.assertEqual(get_or_build(self.name, build), "old")
+        build.assert_not_called()
+
+
+class HomepageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.category = Category.objects.create(name="Category", slug="category")
+        cls.author = Author.objects.create(full_name="Old Name", slug="author")
+        cls.books = [
+            Book.objects.create(
+                name=f"Book {i}",
+                slug=f"book-{i}",
+                author=cls.author,
+                category=cls.category,
+                is_published=Book.Status.PUBLISHED,
+            )
+            for i in range(5)
+        ]
+        cls.reader = get_user_model().objects.create_user(username="reader")
+
+    def setUp(self) -> None:
+        homepage.invalidate(*homepage.SECTIONS)
+        self.render()
+
+    def render(self) -> None:
+        self.assertEqual(self.client.get(reverse("Lib:home")).status_code, 200)
+
+    def fragment(self, section: str) -> Optional[str]:
+        return get_cached(f"{homepage.PREFIX}:{section}:html")
+
+    def test_new_published_book_invalidates_the_fragment(self) -> None:
+        Book.objects.create(
+            name="Draft", slug="draft", author=self.author, category=self.category
+        )
+        self.assertIsNotNone(self.fragment("new_books"))
+
+        Book.objects.create(
+            name="Fresh Book",
+            slug="fresh-book",
+            author=self.author,
+            category=self.category,
+            is_published=Book.Status.PUBLISHED,
+        )
+        self.assertIsNone(self.fragment("new_books"))
+        self.render()
+        self.assertIn("Fresh Book", self.fragment("new_books"))
+
+    def test_rating_change_invalidates_the_fragment(self) -> None:
+        top = self.fragment("top_books")
+        # Four of the five unrated books are shown.
+        [outsider] = [b for b in self.books if f'title="{b.name}"' not in top]
+        UserRating.objects.create(user=self.reader, book=outsider, rating=5)
+        self.assertIsNone(self.fragment("top_books"))
+        self.render()
+        self.assertIn(f'title="{outsider.name}"', self.fragment("top_books"))
+
+    def test_author_rename_invalidates_the_fragment(self) -> None:
+        self.assertIn("Old Name", self.fragment("new_books"))
+        self.author.full_name = "New Name"
+        self.author.save()
+        self.assertIsNone(self.fragment("new_books"))
+        self.render()
+        self.assertIn("New Name", self.fragment("new_books"))
+        self.assertNotIn("Old Name", self.fragment("new_books"))
+
+
+class ProfilingMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        category = Category.objects.create(name="Category", slug="category")
+        author = Author.objects.create(full_name="Author", slug="author")
+        cls.book = Book.objects.create(
+            name="Book",
+            slug="book",
+            author=author,
+            category=category,
+            is_published=Book.Status.PUBLISHED,
+        )
+        cls.staff = get_user_model().objects.create_superuser(
+            username="staff", password="password"
+        )
+
+    def setUp(self) -> None:
+        profiling.clear_captures()
+
+    @override_settings(PROFILING={"SAMPLE_RATE": 1})
+    def test_sampled_request_is_broken_down(self) -> None:
+        self.client.get(reverse("Lib:category", kwargs={"slug": "category"}))
+        profile = RequestProfile.objects.get()
+        self.assertEqual(profile.view_name, "Lib:category")
+        self.assertEqual(profile.status, 200)
+        self.assertGreater(profile.queries, 0)
+        self.assertGreater(profile.template_ms, 0)
+        self.assertGreaterEqual(profile.total_ms, profile.template_ms)
+        self.assertEqual(profile.tags["prefetch_ratings"][0], 1)
+        self.assertEqual(profile.profile, "")
+
+    def test_unsampled_requests_are_not_recorded(self) -> None:
+        self.client.get(self.book.get_absolute_url(), headers={"x-profile": "1"})
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_staff_header_captures_a_profile(self) -> None:
+        self.client.force_login(self.staff)
+        self.client.get(self.book.get_absolute_url(), headers={"x-profile": "1"})
+        profile = RequestProfile.objects.get()
+        self.assertEqual(profile.view_name, "Lib:book")
+        self.assertIn("function calls", profile.profile)
+
+    def test_admin_capture_profiles_the_next_request(self) -> None:
+        profiling.request_captures(["Lib:book"])
+        self.client.get(self.book.get_absolute_url())
+        self.client.get(self.book.get_absolute_url())
+        self.assertEqual(RequestProfile.objects.get().view_name, "Lib:book")
+
+    def test_concurrent_requests_take_each_capture_once(self) -> None:
+        profiling.request_captures(["Lib:book"], count=3)
+        pending = profiling.get_pending_captures()
+        with ThreadPoolExecutor(8) as executor:
+            taken = list(
+                executor.map(lambda _: profiling.take_capture("Lib:book"), range(16))
+            )
+        self.assertEqual(taken.count(True), 3)
+        self.assertNotIn("Lib:book", pending.counts)
+
+        # An earlier request that isn't used up carries over.
+        profiling.request_captures(["Lib:author"])
+        profiling.request_captures(["Lib:category"])
+        self.assertTrue(profiling.take_capture("Lib:author"))
+        self.assertFalse(profiling.take_capture("Lib:book"))
+
+    def test_unrequested_views_skip_the_cache(self) -> None:
+        profiling.take_capture("Lib:book")
+        with mock.patch.object(profiling.cache, "get_many") as get_many:
+            for _ in range(10):
+                self.assertFalse(profiling.take_capture("Lib:book"))
+        get_many.assert_not_called()
+
+    @override_settings(PROFILING={"SAMPLE_RATE": 1})
+    def test_admin_summarizes_views(self) -> None:
+        self.client.get(self.book.get_absolute_url())
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("admin:Library_requestprofile_changelist"))
+        self.assertEqual(RequestProfile.objects.count(), 1)
+        [summary] = response.context["view_summaries"]
+        self.assertEqual((summary.view_name, summary.requests), ("Lib:book", 1))
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        category = Category.objects.create(name="Category", slug="category")
+        author = Author.objects.create(full_name="Author", slug="author")
+        Book.objects.create(
+            name="Book",
+            slug="book",
+            author=author,
+            category=category,
+            is_published=Book.Status.PUBLISHED,
+        )
+
+    def setUp(self) -> None:
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = override_settings(
+            METRICS={"DIR": self.directory, "ALLOWED_IPS": ["127.0.0.1"]}
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        metrics.registry.reset()
+
+    def scrape(self) -> str:
+        response = self.client.get(reverse("Lib:metrics"))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_views_and_book_querysets_are_measured(self) -> None:
+        self.client.get(reverse("Lib:category", kwargs={"slug": "category"}))
+        text = self.scrape()
+        self.assertIn(
+            'library_http_requests_total{method="GET",status="200",'
+            'view="Lib:category"} 1',
+            text,
+        )
+        self.assertIn(
+            'library_http_request_duration_seconds_count{view="Lib:category"} 1',
+            text,
+        )
+        self.assertRegex(text, r'library_db_queries_total\{view="Lib:category"\} [1-9]')
+        self.assertIn(
+            'library_book_queryset_duration_seconds_count{method="top_rated"} 1', text
+        )
+
+    def test_values_of_other_processes_are_added(self) -> None:
+        self.client.get(reverse("Lib:home"))
+        other = [
+            [
+                "library_http_requests_total",
+                {"method": "GET", "status": "200", "view": "Lib:home"},
+                [2],
+            ],
+            [
+                "library_openlibrary_calls_total",
+                {"call": "get_book", "outcome": "error"},
+                [3],
+            ],
+        ]
+        (self.directory / "1-other.json").write_text(json.dumps(other))
+        text = self.scrape()
+        self.assertIn(
+            'library_http_requests_total{method="GET",status="200",view="Lib:home"} 3',
+            text,
+        )
+        self.assertIn(
+            'library_openlibrary_calls_total{call="get_book",outcome="error"} 3', text
+        )
+
+    async def test_async_requests_are_measured(self) -> None:
+        async def view(request: Any) -> HttpResponse:
+            await Book.objects.acount()
+            return HttpResponse()
+
+        middleware = metrics.MetricsMiddleware(view)
+        response = await middleware(AsyncRequestFactory().get("/"))
+        self.assertEqual(response.status_code, 200)
+        key = (metrics.DB_QUERIES.name, (("view", "none"),))
+        self.assertEqual(metrics.registry.values[key], [1])
+
+    def test_histogram_buckets_are_cumulative(self) -> None:
+        for seconds in (0.001, 0.2, 30):
+            metrics.registry.observe(
+                metrics.OPENLIBRARY_SECONDS, seconds, call="download"
+            )
+        text = metrics.render(metrics.registry.collect())
+        for le, count in (
+            ("0.005", 1),
+            ("0.1", 1),
+            ("0.25", 2),
+            ("10", 2),
+            ("+Inf", 3),
+        ):
+            self.assertIn(
+                f'library_openlibrary_call_duration_seconds_bucket{{call="download",le="{le}"}} {count}',
+                text,
+            )
+
+    @override_settings(METRICS={"ALLOWED_IPS": ()})
+    def test_endpoint_needs_an_allowed_address_or_staff(self) -> None:
+        response = self.client.get(reverse("Lib:metrics"))
+        self.assertEqual(response.status_code, 403)
+
+
+class LoanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        category = Category.objects.create(name="Category", slug="category")
+        author = Author.objects.create(full_name="Author", slug="author")
+        cls.book = Book.objects.create(
+            name="Book", slug="book", author=author, category=category
+        )
+        User = get_user_model()
+        cls.reader = User.objects.create_user(username="reader")
+        cls.other = User.objects.create_user(username="other")
+        cls.due = timezone.now().date() + timedelta(days=7)
+
+    def test_a_taken_book_cannot_be_borrowed(self) -> None:
+        self.assertIsNotNone(Loan.objects.borrow(self.book.pk, self.reader, self.due))
+        self.assertIsNone(Loan.objects.borrow(self.book.pk, self.other, self.due))
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.user, self.book.is_taken), (self.reader, True))
+        self.assertEqual(self.book.return_date, self.due)
+
+    def test_returns_are_kept_in_the_ledger(self) -> None:
+        Loan.objects.borrow(self.book.pk, self.reader, self.due)
+        self.assertFalse(Loan.objects.give_back(self.book.pk, self.other))
+        self.assertTrue(Loan.objects.give_back(self.book.pk, self.reader))
+        Loan.objects.borrow(self.book.pk, self.other, self.due)
+        returned, current = Loan.objects.order_by("pk")
+        self.assertEqual((returned.user, current.user), (self.reader, self.other))
+        self.assertIsNotNone(returned.time_returned)
+        self.assertIsNone(current.time_returned)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.user, self.other)
+
+    def test_borrow_writes_only_loan_columns(self) -> None:
+        with self.assertNumQueries(4) as queries:
+            Loan.objects.borrow(self.book.pk, self.reader, self.due)
+        update = next(q["sql"] for q in queries if q["sql"].startswith("UPDATE"))
+        self.assertNotIn('"name"', update)
+        self.assertIn('"is_taken"', update.split("WHERE")[1])
+
+
+class OverdueReminderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        category = Category.objects.create(name="Category", slug="category")
+        author = Author.objects.create(full_name="Author", slug="author")
+        User = get_user_model()
+        cls.today = timezone.localdate()
+        loans = [
+            # (email, days overdue, returned, reminded)
+            ("a@example.com", 3, False, False),
+            ("b@example.com", 1, False, False),
+            ("", 2, False, False),
+            ("c@example.com", -1, False, False),
+            ("d@example.com", 5, True, False),
+            ("e@example.com", 5, False, True),
+        ]
+        for i, (email, overdue, returned, reminded) in enumerate(loans):
+            book = Book.objects.create(
+                name=f"Book {i}", slug=f"book-{i}", author=author, category=category
+            )
+            user = User.objects.create_user(username=f"reader{i}", email=email)
+            Loan.objects.create(
+                book=book,
+                user=user,
+                due_date=cls.today - timedelta(days=overdue),
+                time_returned=timezone.now() if returned else None,
+                time_reminded=timezone.now() if reminded else None,
+            )
+
+    def test_overdue_loans_are_reminded_once_in_batches(self) -> None:
+        report = sweep_overdue(batch_size=2)
+        self.assertEqual((report.loans, report.sent, report.batches), (3, 2, 2))
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            ["a@example.com", "b@example.com"],
+        )
+        self.assertIn('"Book 0"', mail.outbox[0].subject)
+        self.assertEqual(Loan.objects.overdue(self.today).count(), 0)
+
+        self.assertEqual(sweep_overdue().loans, 0)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_interrupted_sweep_resumes(self) -> None:
+        self.assertEqual(sweep_overdue(batch_size=1, max_batches=1).loans, 1)
+        report = sweep_overdue(batch_size=1)
+        self.assertEqual((report.loans, report.batches), (2, 2))
+
+    def test_batches_share_one_connection(self) -> None:
+        connection = mail.get_connection()
+        with mock.patch.object(
+            connection, "open", wraps=connection.open
+        ) as opened, mock.patch.object(
+            connection, "send_messages", wraps=connection.send_messages
+        ) as sent:
+            sweep_overdue(batch_size=2, connection=connection)
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual([len(call.args[0]) for call in sent.call_args_list], [1, 1])
+
+    def test_refused_recipients_dont_hold_up_the_rest(self) -> None:
+        connection = mail.get_connection()
+        send_messages = connection.send_messages
+
+        def refuse(messages: list[mail.EmailMessage]) -> int:
+            if messages[0].to == ["a@example.com"]:
+                raise smtplib.SMTPRecipientsRefused({"a@example.com": (550, b"")})
+            return send_messages(messages)
+
+        with mock.patch.object(connection, "send_messages", side_effect=refuse):
+            report = sweep_overdue(batch_size=1, connection=connection)
+        self.assertEqual((report.loans, report.sent), (2, 1))
+        self.assertEqual(
+            list(report.failed), [Loan.objects.get(user__email="a@example.com").pk]
+        )
+        self.assertEqual([message.to for message in mail.outbox], [["b@example.com"]])
+
+        # The next run tries again.
+        report = sweep_overdue(connection=connection)
+        self.assertEqual((report.loans, report.sent, report.failed), (1, 1, {}))
+
+    def test_loans_from_before_loan_rows_are_backfilled(self) -> None:
+        user = get_user_model().objects.create_user(
+            username="early", email="early@example.com"
+        )
+        Book.objects.create(
+            name="Early",
+            slug="early",
+            author=Author.objects.get(),
+            category=Category.objects.get(),
+            user=user,
+            is_taken=True,
+            return_date=self.today - timedelta(days=10),
+        )
+        report = sweep_overdue()
+        self.assertEqual(report.backfilled, 1)
+        self.assertIn(["early@example.com"], [message.to for message in mail.outbox])
+        self.assertEqual(sweep_overdue().backfilled, 0)
+
+
+class FakeOpenLibrary:
+    """
+    Stands in for openlibrary.API: book N is "Book N" by author N % authors,
+    every author has a photo and every book a cover.
+    """
+
+    def __init__(self, authors: int = 12) -> None:
+        self.authors = authors
+        self.names: dict[str, str] = {}
+        self.downloads = 0
+        self.lock = threading.Lock()
+        # Set to a connection, the transaction depth it had at each download.
+        self.connection: Optional[BaseDatabaseWrapper] = None
+        self.download_depths: list[int] = []
+
+    def get_books(self, ids: list[str], bibkey: str = "ISBN", jscmd: str = "data"):
+        return {
+            id: openlibrary.Book.get_book_from_json(
+                {
+                    "url": f"https://openlibrary.org/books/OL{id}M/book",
+                    "title": f"Book {id}",
+                    "authors": [
+                        {
+                            "url": "https://openlibrary.org/authors/"
+                            f"OL{int(id) % self.authors}A/author"
+                        }
+                    ],
+                    "publishers": [{"name": "Publisher"}],
+                    "cover": {"medium": f"covers.openlibrary.org/b/id/{id}-M.jpg"},
+                }
+            )
+            for id in ids
+        }
+
+    def get_author(self, olid: str) -> openlibrary.Author:
+        name = self.names.get(olid, f"Author {olid}")
+        return openlibrary.Author.get_author_from_json({"name": name, "photos": [1]})
+
+    def get_details(self, url: str) -> tuple[str, Optional[str]]:
+        return "A description", "English"
+
+    def download(self, url: str) -> bytes:
+        with self.lock:
+            self.downloads += 1
+            if self.connection is not None:
+                self.download_depths.append(len(self.connection.atomic_blocks))
+        return b"image"
+
+
+class OpenLibraryStub:
+    """
+    Serves pages from memory on localhost, with an ETag per page that
+    If-None-Match is answered with 304 for. Keeps the paths requested, and
+    the ones answered with 304.
+    """
+
+    def __init__(self, pages: dict[str, bytes]) -> None:
+        self.pages = pages
+        self.requested: list[str] = []
+        self.not_modified: list[str] = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                stub.requested.append(self.path)
+                body = stub.pages.get(self.path)
+                etag = f'"{hashlib.md5(body).hexdigest()}"' if body else None
+                if body is None:
+                    self.send_response(404)
+                    body = b""
+                elif etag == self.headers.get("If-None-Match"):
+                    stub.not_modified.append(self.path)
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                else:
+                    self.send_response(200)
+                    self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def use_metrics_dir(test: SimpleTestCase) -> Path:
+    directory = Path(tempfile.mkdtemp())
+    test.addCleanup(shutil.rmtree, directory)
+    metrics_settings = override_settings(METRICS={**settings.METRICS, "DIR": directory})
+    metrics_settings.enable()
+    test.addCleanup(metrics_settings.disable)
+    metrics.registry.reset()
+    return directory
+
+
+def details_page(description: str, filler: int = 0) -> bytes:
+    return (
+        "<html><body>"
+        f'<div class="read-more__content"><p>{description}</p></div>'
+        '<span itemprop="inLanguage"><a href="#">English</a></span>'
+        f"<div>{'x' * filler}</div>"
+        "</body></html>"
+    ).encode()
+
+
+class OpenLibraryDetailsTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.stub = OpenLibraryStub(
+            {
+                "/short": details_page("Short"),
+                "/long": details_page("Long", filler=4 * 2**20),
+            }
+        )
+        self.addCleanup(self.stub.close)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.cache = ResponseCache(directory)
+        self.api = API(max_connections=1, cache=self.cache)
+        use_metrics_dir(self)
+
+    def test_pages_read_to_the_end_are_cached(self) -> None:
+        url = f"{self.stub.url}/short"
+        self.assertEqual(self.api.get_details(url), ("Short", "English"))
+        self.assertEqual(self.api.get_details(url), ("Short", "English"))
+        self.assertEqual(self.stub.requested, ["/short"])
+        stats = self.cache.stats()
+        self.assertEqual((stats["misses"], stats["hits"]), (1, 1))
+
+    def test_cache_misses_stop_reading_early(self) -> None:
+        url = f"{self.stub.url}/long"
+        # One pooled connection: the half read one has to be given back.
+        for _ in range(3):
+            self.assertEqual(self.api.get_details(url), ("Long", "English"))
+        self.assertEqual(self.stub.requested, ["/long"] * 3)
+        self.assertIsNone(self.cache.get(url))
+
+
+FIXTURES = Path(__file__).parent / "fixtures" / "openlibrary"
+ISBN = "9780140449136"
+DETAILS_PATH = "/books/OL7353617M/Crime_and_Punishment"
+
+
+class ResponseCacheTests(SimpleTestCase):
+    """OpenLibrary responses recorded in fixtures/openlibrary, served locally."""
+
+    def setUp(self) -> None:
+        self.stub = OpenLibraryStub(
+            {
+                f"/api/books?bibkeys=ISBN:{ISBN}&jscmd=data&format=json": (
+                    FIXTURES / "books.json"
+                ).read_bytes(),
+                "/authors/OL22242A.json": (FIXTURES / "author.json").read_bytes(),
+                DETAILS_PATH: (FIXTURES / "details.html").read_bytes(),
+            }
+        )
+        self.addCleanup(self.stub.close)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        use_metrics_dir(self)
+
+    def get_api(self, **kwargs: Any) -> API:
+        api = API(cache=ResponseCache(self.directory, **kwargs))
+        api.base_url = f"{self.stub.url}/"
+        return api
+
+    def test_fresh_entries_are_read_from_disk(self) -> None:
+        api = self.get_api(ttl=60)
+        for _ in range(2):
+            book = api.get_book(ISBN)
+            self.assertEqual(book.title, "Crime and Punishment")
+        author = api.get_author(book.author_olid)
+        self.assertEqual(author.name, "Fyodor Dostoyevsky")
+        # A new cache over the directory, as another process would have.
+        self.get_api(ttl=60).get_book(ISBN)
+        self.assertEqual(len(self.stub.requested), 2)
+
+        stats = api.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 2))
+        self.assertEqual(stats["entries"], 2)
+
+    def test_stale_entries_are_revalidated(self) -> None:
+        api = self.get_api(ttl=0)
+        details_url = f"{self.stub.url}{DETAILS_PATH}"
+        for _ in range(2):
+            self.assertEqual(api.get_book(ISBN).title, "Crime and Punishment")
+            desq, lang = api.get_details(details_url)
+            self.assertTrue(desq.startswith("Raskolnikov"))
+            self.assertEqual(lang, "English")
+        self.assertEqual(len(self.stub.requested), 4)
+        self.assertEqual(len(self.stub.not_modified), 2)
+
+        stats = api.cache.stats()
+        self.assertEqual((stats["misses"], stats["revalidated"]), (2, 2))
+
+    def test_entries_evicted_while_read_are_misses(self) -> None:
+        api = self.get_api(ttl=60)
+        api.get_book(ISBN)
+        # Another process deletes the body between the read and the touch.
+        with mock.patch("Library.httpcache.os.utime", side_effect=FileNotFoundError):
+            api.get_book(ISBN)
+        self.assertEqual(len(self.stub.requested), 2)
+        stats = api.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (0, 2))
+
+    def test_least_recently_used_entries_are_evicted(self) -> None:
+        sizes = [
+            (FIXTURES / name).stat().st_size for name in ("books.json", "author.json")
+        ]
+        api = self.get_api(max_size=sum(sizes) - 1)
+        book = api.get_book(ISBN)
+        # mtimes are the LRU clock, and not finer than a few milliseconds.
+        time.sleep(0.05)
+        api.get_author(book.author_olid)
+        api.get_book(ISBN)
+
+        self.assertEqual(len(self.stub.requested), 3)
+        stats = api.cache.stats()
+        self.assertEqual((stats["evicted"], stats["entries"]), (2, 1))
+
+    def test_counts_of_every_process_add_up(self) -> None:
+        self.get_api().get_book(ISBN)
+        metrics.registry.flush()
+        # What a new process starts with.
+        metrics.registry.reset()
+        api = self.get_api()
+        api.get_book(ISBN)
+        stats = api.cache.stats()
+        self.assertEqual((stats["misses"], stats["hits"]), (1, 1))
+
+
+class OpenLibraryPoolTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.stub = OpenLibraryStub({"/page": b"page"})
+        self.addCleanup(self.stub.close)
+
+    def test_waiting_for_a_connection_times_out(self) -> None:
+        api = API(max_connections=1, timeout=0.2, cache=False)
+        held = api.request(f"{self.stub.url}/page", preload_content=False)
+        self.addCleanup(held.release_conn)
+        self.addCleanup(held.drain_conn)
+        with self.assertRaises(urllib3.exceptions.EmptyPoolError):
+            api.fetch(f"{self.stub.url}/page")
+
+    def test_pools_are_shared_between_threads(self) -> None:
+        with ThreadPoolExecutor(8) as executor:
+            pools = list(executor.map(lambda _: openlibrary.get_pool(3, 1.5), range(8)))
+        self.assertTrue(all(pool is pools[0] for pool in pools))
+
+    def test_concurrency_is_capped_across_instances(self) -> None:
+        running = peak = 0
+        lock = threading.Lock()
+
+        def call() -> None:
+            nonlocal running, peak
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.02)
+            with lock:
+                running -= 1
+
+        async def burst() -> None:
+            # A new client per call, as a view building one per request would.
+            await asyncio.gather(
+                *(
+                    AsyncAPI(max_concurrency=3, cache=False)._run(call)
+                    for _ in range(12)
+                )
+            )
+
+        async_to_sync(burst)()
+        self.assertEqual(peak, 3)
+
+
+class ImporterTests(TestCase):
+    def setUp(self) -> None:
+        self.category = Category.objects.create(name="Category", slug="category")
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.fake = FakeOpenLibrary()
+        self.api = AsyncAPI(cache=False)
+        self.api.api = self.fake
+
+    def test_batches_share_the_api(self) -> None:
+        # More tasks than max_concurrency wait on the limiter in every
+        # batch, and every batch runs on an event loop of its own.
+        keys = [str(i) for i in range(30)]
+        report = import_bibkeys(
+            keys, category=self.category, batch_size=10, api=self.api
+        )
+        self.assertEqual(report.failed, {})
+        self.assertEqual(report.processed, 30)
+        self.assertEqual((report.books_created, report.authors_created), (30, 12))
+        self.assertEqual(self.fake.downloads, 42)
+        self.assertEqual(Book.objects.exclude(book_cover__endswith=".svg").count(), 30)
+
+    def test_downloads_hold_no_transaction(self) -> None:
+        # The fake downloads on worker threads, the inserts run on this one.
+        self.fake.connection = connections[DEFAULT_DB_ALIAS]
+        depth = len(self.fake.connection.atomic_blocks)
+        report = import_bibkeys(["1", "2"], category=self.category, api=self.api)
+        self.assertEqual(report.books_created, 2)
+        self.assertEqual(self.fake.download_depths, [depth] * 4)
+
+    def test_taken_slugs_are_reused(self) -> None:
+        author = Author.objects.create(
+            full_name="J. R. R. Tolkien", slug="j-r-r-tolkien"
+        )
+        book = Book.objects.create(
+            name="Book 2", slug="book-2", author=author, category=self.category
+        )
+        self.fake.names["OL1A"] = "J.R.R. Tolkien"
+        report = import_bibkeys(["1", "2", "3"], category=self.category, api=self.api)
+        self.assertEqual(report.failed, {})
+        self.assertEqual((report.books_created, report.authors_created), (2, 2))
+        self.assertEqual(report.books, {"1": "book-1", "2": "book-2", "3": "book-3"})
+        self.assertEqual(Book.objects.get(slug="book-1").author, author)
+        self.assertEqual(Book.objects.get(slug="book-2"), book)
+        # Only the new books' covers and the new authors' photos.
+        self.assertEqual(self.fake.downloads, 4)
+
+    def test_rows_inserted_meanwhile_are_not_counted(self) -> None:
+        Author.objects.create(full_name="Other", slug="author")
+        obj = Author(full_name="Author", slug="author")
+        obj.photo.save("photo.jpg", ContentFile(b"image"), save=False)
+        path = Path(obj.photo.path)
+        self.assertTrue(path.exists())
+        self.assertEqual(insert_new([obj], "photo", "full_name"), [])
+        self.assertFalse(path.exists())
+        self.assertEqual(Author.objects.get(slug="author").full_name, "Other")
+
+
+class ImportJobTests(TestCase):
+    def setUp(self) -> None:
+        User = get_user_model()
+        self.owner = User.objects.create_user(username="owner", password="pw")
+        self.other = User.objects.create_user(username="other", password="pw")
+        self.job, _ = ImportJob.objects.submit(
+            bibkey="9780140449136", method="ISBN", user=self.owner
+        )
+        self.url = reverse("Lib:contribute_job", kwargs={"pk": self.job.pk})
+
+    def test_jobs_are_shown_to_their_submitter_only(self) -> None:
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        self.client.force_login(self.owner)
+        response = self.client.get(self.url, {"format": "json"})
+        self.assertEqual(response.json()["status"], ImportJob.Status.QUEUED)
+
+    def test_everyone_submitting_a_queued_bibkey_sees_the_job(self) -> None:
+        self.client.force_login(self.other)
+        response = self.client.post(
+            reverse("Lib:contribute"), {"method": "ISBN", "bibkey": "9780140449136"}
+        )
+        self.assertRedirects(response, self.url, fetch_redirect_response=False)
+        self.assertEqual(ImportJob.objects.count(), 1)
+        for user in (self.owner, self.other):
+            with self.subTest(user.username):
+                self.client.force_login(user)
+                response = self.client.get(self.url, {"format": "json"})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()["id"], self.job.pk)
+
+    def test_staff_see_every_job(self) -> None:
+        self.other.is_staff = True
+        self.other.save()
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_stale_jobs_fail_once_out_of_attempts(self) -> None:
+        retried, _ = ImportJob.objects.submit(bibkey="0140449132", method="ISBN")
+        long_ago = timezone.now() - jobs.STALE_TIMEOUT * 2
+        ImportJob.objects.update(status=ImportJob.Status.RUNNING, time_update=long_ago)
+        ImportJob.objects.filter(pk=self.job.pk).update(attempts=F("max_attempts"))
+        ImportJob.objects.filter(pk=retried.pk).update(attempts=1)
+
+        self.assertEqual(ImportJob.objects.requeue_stale(jobs.STALE_TIMEOUT), 1)
+        self.job.refresh_from_db()
+        retried.refresh_from_db()
+        self.assertEqual(self.job.status, ImportJob.Status.FAILED)
+        self.assertIn("last attempt", self.job.error)
+        self.assertEqual(retried.status, ImportJob.Status.QUEUED)
+
+    def test_stale_jobs_are_requeued_while_workers_run(self) -> None:
+        def work(*args: Any) -> int:
+            time.sleep(1.2)
+            return 0
+
+        with mock.patch.object(jobs, "work", work), mock.patch.object(
+            jobs, "REQUEUE_INTERVAL", 0
+        ), mock.patch.object(ImportJob.objects, "requeue_stale") as requeue_stale:
+            jobs.run_workers(workers=1)
+        # Once on start, then on each pass of the supervisor loop.
+        self.assertGreaterEqual(requeue_stale.call_count, 3)
+        requeue_stale.assert_called_with(jobs.STALE_TIMEOUT)
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        category = Category.objects.create(name="Category", slug="category")
+        author = Author.objects.create(full_name="Author", slug="author")
+        cls.book = Book.objects.create(
+            name="Book",
+            slug="book",
+            author=author,
+            category=category,
+            is_published=Book.Status.PUBLISHED,
+        )
+        cls.reader = get_user_model().objects.create_user(username="reader")
+        cls.urls = [
+            cls.book.get_absolute_url(),
+            author.get_absolute_url(),
+            reverse("Lib:category", kwargs={"slug": category.slug}),
+        ]
+
+    def test_unchanged_pages_are_not_rendered(self) -> None:
+        for url in self.urls:
+            with self.subTest(url):
+                etag = self.client.get(url)["ETag"]
+                response = self.client.get(url, headers={"if-none-match": etag})
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.templates, [])
+
+    def test_changes_make_a_new_etag(self) -> None:
+        url = self.book.get_absolute_url()
+        etag = self.client.get(url)["ETag"]
+        Review.objects.create(
+            user=self.reader, book=self.book, review_text="A fine review"
+        )
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+
+        etag = response["ETag"]
+        UserRating.objects.create(user=self.reader, book=self.book, rating=4)
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_listings_follow_author_renames(self) -> None:
+        url = self.urls[2]
+        etag = self.client.get(url)["ETag"]
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        author = self.book.author
+        author.full_name = "Renamed Author"
+        author.save()
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Renamed Author")
+
+    def test_viewers_get_their_own_pages(self) -> None:
+        url = self.book.get_absolute_url()
+        anonymous = self.client.get(url)
+        self.assertIn("public", anonymous["Cache-Control"])
+        self.assertIn("s-maxage=60", anonymous["Cache-Control"])
+        self.assertIn("Cookie", anonymous["Vary"])
+        # Nothing a shared cache would hand to the next visitor.
+        self.assertNotIn(settings.CSRF_COOKIE_NAME, anonymous.cookies)
+        self.assertContains(anonymous, "Sign in to comment")
+
+        self.client.force_login(self.reader)
+        response = self.client.get(url, headers={"if-none-match": anonymous["ETag"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("private", response["Cache-Control"])
+
+    def test_pages_setting_cookies_are_private(self) -> None:
+        request = RequestFactory().get(self.book.get_absolute_url())
+        request.user = AnonymousUser()
+        get_token(request)
+        response = BookView().finalize(request, HttpResponse(), etag=None)
+        self.assertIn("private", response["Cache-Control"])
+        self.assertNotIn("public", response["Cache-Control"])
+
+
+class BookCommentsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        category = Category.objects.create(name="Category", slug="category")
+        author = Author.objects.create(full_name="Author", slug="author")
+        cls.book = Book.objects.create(
+            name="Book",
+            slug="book",
+            author=author,
+            category=category,
+            is_published=Book.Status.PUBLISHED,
+        )
+        cls.reader = get_user_model().objects.create_user(username="reader")
+        for i in range(45):
+            Review.objects.create(
+                user=cls.reader, book=cls.book, review_text=f"Review number {i}"
+            )
+
+    def test_reviews_are_counted(self) -> None:
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.review_count, 45)
+        Review.objects.filter(book=self.book)[0].delete()
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.review_count, 44)
+
+        Book.objects.update(review_count=0)
+        Book.book.recount_reviews()
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.review_count, 44)
+
+    def test_deleting_from_a_stale_counter_recounts(self) -> None:
+        # bulk_create() sends no signals, so the counter stays behind.
+        Review.objects.bulk_create(
+            Review(user=self.reader, book=self.book, review_text="Bulk")
+            for _ in range(3)
+        )
+        Book.objects.update(review_count=0)
+        Review.objects.filter(book=self.book)[0].delete()
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.review_count, 47)
+
+    def test_book_page_inlines_the_first_page(self) -> None:
+        response = self.client.get(self.book.get_absolute_url())
+        self.assertEqual(len(response.context["comments"]), 20)
+        self.assertContains(response, "Comments (45)")
+        self.assertContains(response, "Review number 44")
+        self.assertNotContains(response, "Review number 24<")
+        self.assertContains(response, "More comments")
+
+    def test_pages_follow_each_other(self) -> None:
+        url = reverse("Lib:book_comments", kwargs={"slug": self.book.slug})
+        texts = []
+        url += "?format=json"
+        while url:
+            data = self.client.get(url).json()
+            self.assertEqual(data["count"], 45)
+            texts += [comment["text"] for comment in data["comments"]]
+            url = data["next"]
+        self.assertEqual(texts, [f"Review number {i}" for i in range(44, -1, -1)])
+
+    def test_fragment_links_to_the_next_page(self) -> None:
+        url = reverse("Lib:book_comments", kwargs={"slug": self.book.slug})
+        response = self.client.get(url)
+        self.assertTemplateUsed(response, "Library/comments.html")
+        self.assertNotContains(response, "<html")
+        self.assertContains(response, f"{url}?after=")
+
+
+class BookDetailQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        category = Category.objects.create(name="Category", slug="category")
+        author = Author.objects.create(full_name="Author", slug="author")
+        cls.reader = get_user_model().objects.create_user(username="reader")
+        cls.book = Book.objects.create(
+            name="Book",
+            slug="book",
+            author=author,
+            category=category,
+            is_published=Book.Status.PUBLISHED,
+            is_taken=True,
+            user=cls.reader,
+            return_date=date.today(),
+        )
+        UserRating.objects.create(user=cls.reader, book=cls.book, rating=4)
+        for i in range(3):
+            Review.objects.create(
+                user=cls.reader, book=cls.book, review_text=f"Review number {i}"
+            )
+
+    def setUp(self) -> None:
+        cache.clear()
+
+    def test_anonymous_page_takes_two_queries(self) -> None:
+        # The book with everything it shows, then the first comments.
+        with self.assertNumQueries(2):
+            response = self.client.get(self.book.get_absolute_url())
+        self.assertIsNone(response.context["book"].user_rating)
+        self.assertContains(response, "Review number 2")
+
+    def test_signed_in_page_takes_four_queries(self) -> None:
+        # The session and the user, then as for anyone else.
+        self.client.force_login(self.reader)
+        with self.assertNumQueries(4):
+            response = self.client.get(self.book.get_absolute_url())
+        self.assertEqual(response.context["book"].user_rating, 4)
+        self.assertContains(response, 'value="4" checked')
+        self.assertContains(response, "Delete my")
+
+    def test_images_above_the_fold_load_eagerly(self) -> None:
+        self.client.force_login(self.reader)
+        response = self.client.get(self.book.get_absolute_url())
+        # The header avatar and the cover; the cover alone is fetched first.
+        self.assertContains(response, 'loading="eager"', count=2)
+        self.assertContains(response, 'fetchpriority="high"', count=1)
+        # The avatars of the three comments.
+        self.assertContains(response, 'loading="lazy"', count=3)
+
+    def test_detail_carries_the_validators(self) -> None:
+        book = Book.book.detail(self.reader).get(slug="book")
+        latest = Review.objects.filter(book=self.book).latest("time_create")
+        with self.assertNumQueries(0):
+            self.assertEqual(book.latest_review, latest.time_create)
+            self.assertEqual(book.author.full_name, "Author")
+            self.assertEqual(book.rating_summary.rating_count, 1)
+            self.assertEqual(book.user_rating, 4)
+
+
+class RatingTagTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        category = Category.objects.create(name="Category", slug="category")
+        author = Author.objects.create(full_name="Author", slug="author")
+        cls.books = [
+            Book.objects.create(
+                name=f"Book {i}",
+                slug=f"book-{i}",
+                author=author,
+                category=category,
+                is_published=Book.Status.PUBLISHED,
+            )
+            for i in range(3)
+        ]
+        User = get_user_model()
+        readers = [User.objects.create_user(username=f"r{i}") for i in range(2)]
+        # 4.5 from two ratings, 5 from one, the last book unrated.
+        for reader, rating in zip(readers, (4, 5)):
+            UserRating.objects.create(user=reader, book=cls.books[0], rating=rating)
+        UserRating.objects.create(user=readers[0], book=cls.books[1], rating=5)
+
+    def render(self, source: str, **context: Any) -> str:
+        return Template("{% load tag %}" + source).render(Context(context))
+
+    def test_prefetch_ratings_loads_a_page_in_one_query(self) -> None:
+        books = list(Book.objects.order_by("pk"))
+        source = (
+            "{% prefetch_ratings books %}"
+            "{% for book in books %}[{% book_rating book %}]{% endfor %}"
+        )
+        with self.assertNumQueries(1):
+            html = self.render(source, books=books)
+        self.assertEqual(
+            re.findall(r"\[.*?<span>([^<]*)</span>\]|\[(Not rated yet)\]", html, re.S),
+            [("4.5/5", ""), ("5.0/5", ""), ("", "Not rated yet")],
+        )
+
+    def test_listing_querysets_carry_the_ratings(self) -> None:
+        source = "{% for book in books %}{% book_rating book %}{% endfor %}"
+        # The listing query itself, nothing per book.
+        with self.assertNumQueries(1):
+            html = self.render(source, books=Book.book.top_rated())
+        self.assertEqual(html.count("/5</span>"), 2)
+        self.assertEqual(html.count("Not rated yet"), 1)
+
+        # A bare id is looked up on its own.
+        with self.assertNumQueries(1):
+            html = self.render("{% book_rating pk %}", pk=self.books[0].pk)
+        self.assertIn("<span>4.5/5</span>", html)
+
+    def test_book_rating_markup(self) -> None:
+        book = Book.book.top_rated().get(pk=self.books[0].pk)
+        with self.assertNumQueries(0):
+            html = self.render("{% book_rating book True %}", book=book)
+        self.assertEqual(
+            html,
+            tag.build_stars(4, True)
+            + "<span>4.5/5</span>"
+            + '<span class="dot">·</span><span>2 Ratings</span>',
+        )
+        book = Book.book.top_rated().get(pk=self.books[1].pk)
+        with self.assertNumQueries(0):
+            html = self.render("{% book_rating book %}", book=book)
+        self.assertEqual(html, tag.build_stars(5, False) + "<span>5.0/5</span>")
+        # Every call for a mark shares one string.
+        self.assertIs(tag.render_rating(9, 2, False), tag.render_rating(18, 4, False))
+
+
+def image_file(name: str, width: int, height: int) -> ContentFile:
+    buffer = BytesIO()
+    PILImage.new("RGB", (width, height), "teal").save(buffer, "PNG")
+    return ContentFile(buffer.getvalue(), name=name)
+
+
+class ImageVariantTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.category = Category.objects.create(name="Category", slug="category")
+
+    def setUp(self) -> None:
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        media_settings = override_settings(MEDIA_ROOT=media)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        # Built on this thread, with this test's connection.
+        executor = mock.patch.object(
+            images, "executor", mock.Mock(submit=lambda task, *args: task(*args))
+        )
+        executor.start()
+        self.addCleanup(executor.stop)
+        task = mock.patch.object(images, "store_variants_task", images.store_variants)
+        task.start()
+        self.addCleanup(task.stop)
+
+    def save_book(self, cover: ContentFile) -> Book:
+        with self.captureOnCommitCallbacks(execute=True):
+            author = Author.objects.create(full_name="Author", slug="author")
+            book = Book.objects.create(
+                name="Book",
+                slug="book",
+                author=author,
+                category=self.category,
+                book_cover=cover,
+            )
+        book.refresh_from_db()
+        return book
+
+    def render(self, image: Any, variants: dict) -> str:
+        template = Template(
+            "{% load tag %}{% picture image variants alt='Cover' sizes='480px' %}"
+        )
+        return template.render(Context({"image": image, "variants": variants}))
+
+    def test_saving_a_cover_builds_the_variants(self) -> None:
+        book = self.save_book(image_file("cover.png", 1000, 1500))
+        variants = book.cover_variants
+        self.assertEqual(variants["source"], book.book_cover.name)
+        for ext in images.FORMATS:
+            with self.subTest(ext):
+                self.assertEqual([w for w, _ in variants[ext]], list(images.WIDTHS))
+                for width, name in variants[ext]:
+                    self.assertTrue(default_storage.exists(name))
+                    with PILImage.open(default_storage.path(name)) as variant:
+                        self.assertEqual(variant.width, width)
+
+    def test_saving_a_photo_builds_the_variants(self) -> None:
+        # No variant is wider than the photo itself.
+        with self.captureOnCommitCallbacks(execute=True):
+            author = Author.objects.create(
+                full_name="Author", slug="author", photo=image_file("a.png", 300, 400)
+            )
+        author.refresh_from_db()
+        self.assertEqual(author.photo_variants["source"], author.photo.name)
+        self.assertEqual([w for w, _ in author.photo_variants["jpeg"]], [240])
+
+    def test_picture_renders_the_srcsets(self) -> None:
+        book = self.save_book(image_file("cover.png", 1000, 1500))
+        html = self.render(book.book_cover, book.cover_variants)
+        for ext in ("webp", "jpeg"):
+            expected = ", ".join(
+                f"{default_storage.url(name)} {width}w"
+                for width, name in book.cover_variants[ext]
+            )
+            self.assertIn(f'srcset="{expected}"', html)
+        self.assertIn('<source type="image/webp"', html)
+        # A <source> per other format, and the <img>.
+        self.assertEqual(html.count('sizes="480px"'), len(images.FORMATS))
+        self.assertIn(
+            f'src="{default_storage.url(book.cover_variants["jpeg"][0][1])}"', html
+        )
+
+    def test_picture_falls_back_to_the_original(self) -> None:
+        book = self.save_book(image_file("cover.png", 1000, 1500))
+        stale = {**book.cover_variants, "source": "Lib/book/cover/old.png"}
+        no_jpeg = {"source": book.book_cover.name}
+        for variants in ({}, stale, no_jpeg):
+            with self.subTest(variants=variants):
+                html = self.render(book.book_cover, variants)
+                self.assertHTMLEqual(
+                    html,
+                    f'<img class="" src="{book.book_cover.url}" alt="Cover" '
+                    'loading="lazy">',
+                )
+
+
+class CatalogAPITests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        category = Category.objects.create(name="Category", slug="category")
+        author = Author.objects.create(full_name="Author", slug="author")
+        cls.books = [
+            Book.objects.create(
+                name=f"Book {i}",
+                slug=f"book-{i}",
+                author=author,
+                category=category,
+                description="A long description",
+                is_published=Book.Status.PUBLISHED,
+            )
+            for i in range(5)
+        ]
+        Book.objects.create(
+            name="Draft", slug="draft", author=author, category=category
+        )
+        reader = get_user_model().objects.create_user(username="reader")
+        UserRating.objects.create(user=reader, book=cls.books[0], rating=4)
+
+    def get(self, **query: Any) -> dict[str, Any]:
+        response = self.client.get(reverse("Lib:api_books"), query)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_default_fields(self) -> None:
+        book = self.get(slug="book-0")["results"][0]
+        self.assertEqual(
+            book,
+            {
+                "id": self.books[0].pk,
+                "slug": "book-0",
+                "name": "Book 0",
+                "author": "author",
+                "category": "category",
+                "rating": 4.0,
+            },
+        )
+
+    def test_only_asked_fields_are_read(self) -> None:
+        with CaptureQueriesContext(connection) as queries:
+            data = self.get(fields="slug,rating_count", limit=1)
+        self.assertEqual(data["results"], [{"slug": "book-0", "rating_count": 1}])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("description", queries[0]["sql"])
+        self.assertNotIn("Library_author", queries[0]["sql"])
+
+    def test_bulk_lookup_is_one_query_in_the_asked_order(self) -> None:
+        with CaptureQueriesContext(connection) as queries:
+            data = self.get(slug="book-3,draft,missing,book-1", fields="slug")
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(
+            data, {"results": [{"slug": "book-3"}, {"slug": "book-1"}], "next": None}
+        )
+
+        ids = f"{self.books[2].pk},{self.books[4].pk}"
+        data = self.get(id=ids, fields="id")
+        self.assertEqual(
+            [book["id"] for book in data["results"]],
+            [self.books[2].pk, self.books[4].pk],
+        )
+
+    def test_pages_follow_each_other(self) -> None:
+        for sort in ("id", "newest", "oldest"):
+            with self.subTest(sort):
+                slugs = []
+                url = f"{reverse('Lib:api_books')}?fields=slug&limit=2&sort={sort}"
+                while url:
+                    data = self.client.get(url).json()
+                    slugs += [book["slug"] for book in data["results"]]
+                    url = data["next"]
+                expected = [book.slug for book in self.books]
+                if sort == "newest":
+                    expected.reverse()
+                self.assertEqual(slugs, expected)
+
+    def test_bad_requests(self) -> None:
+        url = reverse("Lib:api_books")
+        newest = self.get(fields="slug", sort="newest", limit=1)["next"]
+        newest = parse_qs(urlsplit(newest).query)["after"][0]
+        queries = (
+            "fields=slug,password",
+            "sort=random",
+            "id=1,x",
+            "limit=all",
+            f"id=1,{2**63}",
+            f"id={'9' * 400}",
+            "after=garbage",
+            f"sort=id&after={newest}",
+        )
+        for query in queries:
+            with self.subTest(query):
+                response = self.client.get(f"{url}?{query}")
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.json())
+
+    def test_authors_and_categories(self) -> None:
+        data = self.client.get(reverse("Lib:api_authors")).json()
+        self.assertEqual(
+            data["results"],
+            [{"id": self.books[0].author_id, "slug": "author", "full_name": "Author"}],
+        )
+        data = self.client.get(
+            reverse("Lib:api_categories"), {"fields": "slug,cover"}
+        ).json()
+        self.assertEqual(
+            data["results"],
+            [{"slug": "category", "cover": "/media/Lib/category/cover/default.png"}],
+        )
+
+
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.category = Category.objects.create(name="Category", slug="category")
+        cls.author = Author.objects.create(full_name="Author", slug="author")
+        cls.book = Book.objects.create(
+            name="Shadow river",
+            slug="book",
+            author=cls.author,
+            category=cls.category,
+            publisher="Publisher",
+            publisher_slug="publisher",
+            is_published=Book.Status.PUBLISHED,
+        )
+        cls.reader = get_user_model().objects.create_user(username="reader")
+        UserRating.objects.create(user=cls.reader, book=cls.book, rating=5)
+        Review.objects.create(
+            user=cls.reader, book=cls.book, review_text="A fine review"
+        )
+
+    async def get(self, view: Any, path: str, headers: Any = None, **kwargs: Any):
+        request = AsyncRequestFactory().get(path, headers=headers)
+        request.user = self.reader
+
+        async def auser() -> Any:
+            return self.reader
+
+        request.auser = auser
+        response = await view.as_view()(request, **kwargs)
+        if hasattr(response, "render"):
+            await sync_to_async(response.render)()
+        return response
+
+    def sync_get(self, view: Any, path: str, **kwargs: Any):
+        request = RequestFactory().get(path)
+        request.user = self.reader
+        response = view.as_view()(request, **kwargs)
+        response.render()
+        return response
+
+    async def test_async_views_show_what_sync_ones_do(self) -> None:
+        pages = [
+            (AsyncIndexView, IndexView, "/", {}, ()),
+            (
+                AsyncBookView,
+                BookView,
+                "/book/book/",
+                {"slug": "book"},
+                ("book", "comments"),
+            ),
+            (
+                AsyncAuthorView,
+                AuthorView,
+                "/author/author",
+                {"slug": "author"},
+                ("author", "related_books"),
+            ),
+            (
+                AsyncCategoryView,
+                CategoryView,
+                "/category/category",
+                {"slug": "category"},
+                ("category", "books"),
+            ),
+            (AsyncSearchView, SearchView, "/search/?q=shadow", {}, ("books",)),
+        ]
+
+        def listed(value: Any) -> Any:
+            return value if isinstance(value, Model) else list(value)
+
+        for async_view, sync_view, path, kwargs, names in pages:
+            with self.subTest(path):
+                response = await self.get(async_view, path, **kwargs)
+                expected = await sync_to_async(self.sync_get)(sync_view, path, **kwargs)
+                self.assertEqual(response.status_code, 200)
+                # ListView adds a fallback from the object list's model.
+                self.assertEqual(response.template_name[0], expected.template_name[0])
+                for name in names:
+                    value = listed(response.context_data[name])
+                    self.assertTrue(value)
+                    self.assertEqual(value, listed(expected.context_data[name]))
+
+    async def test_book_shows_the_viewers_rating(self) -> None:
+        response = await self.get(AsyncBookView, "/book/book/", slug="book")
+        self.assertEqual(response.context_data["book"].user_rating, 5)
+
+    async def test_conditional_get(self) -> None:
+        response = await self.get(AsyncBookView, "/book/book/", slug="book")
+        response = await self.get(
+            AsyncBookView,
+            "/book/book/",
+            headers={"if-none-match": response["ETag"]},
+            slug="book",
+        )
+        self.assertEqual(response.status_code, 304)
+
+    async def test_missing_objects(self) -> None:
+        for view in (AsyncBookView, AsyncAuthorView, AsyncCategoryView):
+            with self.subTest(view.__name__), self.assertRaises(Http404):
+                await self.get(view, "/", slug="missing")
+
+
+class ConcurrentBorrowTests(TransactionTestCase):
+    readers = 8
+
+    def setUp(self) -> None:
+        category = Category.objects.create(name="Category", slug="category")
+        author = Author.objects.create(full_name="Author", slug="author")
+        self.book = Book.objects.create(
+            name="Book",
+            slug="book",
+            author=author,
+            category=category,
+            is_published=Book.Status.PUBLISHED,
+        )
+        self.users = [
+            get_user_model().objects.create_user(username=f"reader{i}")
+            for i in range(self.readers)
+        ]
+
+    def test_one_of_parallel_borrows_wins(self) -> None:
+        url = reverse("Lib:book_borrow", kwargs={"slug": self.book.slug})
+        return_date = (timezone.now().date() + timedelta(days=7)).isoformat()
+        barrier = threading.Barrier(self.readers, timeout=10)
+
+        def borrow(user: Any) -> bool:
+            client = Client(headers={"referer": self.book.get_absolute_url()})
+            client.force_login(user)
+            try:
+                barrier.wait()
+                response = client.post(
+                    url, {"book_id": self.book.pk, "return_date": return_date}
+                )
+                return response.status_code == 302
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(self.readers) as executor:
+            results = list(executor.map(borrow, self.users))
+
+        self.assertEqual(results.count(True), 1, results)
+        loan = Loan.objects.get()
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.user, loan.user)
+        self.assertEqual(loan.user, self.users[results.index(True)])
+
+
+def borrow(test: PerformanceTestCase) -> dict[str, Any]:
+    return_date = timezone.now().date() + timedelta(days=7)
+    return {"book_id": test.book.pk, "return_date": return_date.isoformat()}
+
+
+def contribute_job(test: PerformanceTestCase) -> dict[str, int]:
+    job, _ = ImportJob.objects.submit(
+        bibkey="9780140449136", method="ISBN", user=test.user
+    )
+    return {"pk": job.pk}
+
+
+class LibraryPerformanceTests(PerformanceTestCase):
+    routes = [
+        Route("Lib:home", max_queries=3),
+        Route("Lib:book", max_queries=2, kwargs=book_slug),
+        Route(
+            "Lib:book",
+            max_queries=4,
+            kwargs=book_slug,
+            login=True,
+            label="Lib:book (signed in)",
+        ),
+        Route("Lib:book_comments", max_queries=2, kwargs=book_slug),
+        Route(
+            "Lib:author",
+            max_queries=3,
+            kwargs=lambda test: {"slug": test.book.author.slug},
+        ),
+        Route(
+            "Lib:category",
+            max_queries=4,
+            kwargs=lambda test: {"slug": test.book.category.slug},
+        ),
+        Route(
+            "Lib:category",
+            max_queries=4,
+            kwargs=lambda test: {"slug": test.book.category.slug},
+            query="sort=newest",
+        ),
+        Route("Lib:library", max_queries=2),
+        Route("Lib:library", max_queries=2, query="sort=oldest"),
+        Route("Lib:search", max_queries=1),
+        Route("Lib:search", max_queries=1, query="q=shadow"),
+        Route("Lib:search", max_queries=1, query="q=shadow&sort=newest"),
+        Route("Lib:search", max_queries=1, query="publisher=storm"),
+        Route("Lib:api_books", max_queries=1),
+        Route("Lib:api_books", max_queries=1, query="sort=newest&limit=100"),
+        Route(
+            "Lib:api_books",
+            max_queries=1,
+            query="slug=book-1,book-2,book-3&fields=slug,rating,rating_count",
+        ),
+        Route("Lib:api_authors", max_queries=1),
+        Route("Lib:api_categories", max_queries=1),
+        Route("Lib:metrics", max_queries=0),
+        Route("Lib:my_shelf", max_queries=4, login=True),
+        Route("Lib:my_shelf", max_queries=4, login=True, query="q=shadow"),
+        Route("Lib:contribute", max_queries=2, login=True),
+        Route("Lib:contribute_job", max_queries=3, kwargs=contribute_job, login=True),
+        Route(
+            "Lib:book_add",
+            max_queries=6,
+            kwargs=book_slug,
+            method="post",
+            data=lambda test: {"book_id": test.book.pk, "text": "A fine review"},
+            login=True,
+            status=(302,),
+        ),
+        Route(
+            "Lib:book_rate",
+            max_queries=15,
+            kwargs=book_slug,
+            method="post",
+            data=lambda test: {"book_id": test.book.pk, "rate": 4},
+            login=True,
+            status=(302,),
+        ),
+        Route(
+            "Lib:book_borrow",
+            max_queries=6,
+            kwargs=book_slug,
+            method="post",
+            data=borrow,
+            login=True,
+            status=(302,),
+        ),
+        Route(
+            "Lib:book_return",
+            max_queries=7,
+            kwargs=book_slug,
+            method="post",
+            data=book_post,
+            login=True,
+            status=(302,),
+        ),
+    ]
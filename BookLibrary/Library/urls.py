@@ -1,34 +1,60 @@
+from django.conf import settings
 from django.urls import path
 
+from .api import AuthorAPIView, BookAPIView, CategoryAPIView
 from .views import (
     AddCommentView,
     AuthorView,
+    BookCommentsView,
     BookView,
     BorrowBookView,
     CategoryView,
+    ContributeJobView,
     ContributeView,
     IndexView,
     LibraryView,
+    MetricsView,
     MyShelfView,
     RateBookView,
     ReturnBookView,
     SearchView,
 )
 
+if settings.LIBRARY_ASYNC_VIEWS:
+    from .async_views import AsyncAuthorView as AuthorView
+    from .async_views import AsyncBookView as BookView
+    from .async_views import AsyncCategoryView as CategoryView
+    from .async_views import AsyncIndexView as IndexView
+    from .async_views import AsyncSearchView as SearchView
+
 
 app_name = "Lib"
 
 urlpatterns = [
     path("", IndexView.as_view(), name="home"),
     path("book/<slug:slug>/", BookView.as_view(), name="book"),
+    path(
+        "book/<slug:slug>/comments/",
+        BookCommentsView.as_view(),
+        name="book_comments",
+    ),
     path("book/<slug:slug>/add-comment/", AddCommentView.as_view(), name="book_add"),
     path("book/<slug:slug>/rate/", RateBookView.as_view(), name="book_rate"),
     path("book/<slug:slug>/borrow/", BorrowBookView.as_view(), name="book_borrow"),
     path("book/<slug:slug>/return/", ReturnBookView.as_view(), name="book_return"),
     path("my-shelf/", MyShelfView.as_view(), name="my_shelf"),
     path("contribute/", ContributeView.as_view(), name="contribute"),
+    path(
+        "contribute/job/<int:pk>/",
+        ContributeJobView.as_view(),
+        name="contribute_job",
+    ),
     path("author/<slug:slug>", AuthorView.as_view(), name="author"),
     path("library/", LibraryView.as_view(), name="library"),
     path("category/<slug:slug>", CategoryView.as_view(), name="category"),
     path("search/", SearchView.as_view(), name="search"),
+    path("metrics", MetricsView.as_view(), name="metrics"),
+    path("api/books/", BookAPIView.as_view(), name="api_books"),
+    path("api/authors/", AuthorAPIView.as_view(), name="api_authors"),
+    path("api/categories/", CategoryAPIView.as_view(), name="api_categories"),
 ]
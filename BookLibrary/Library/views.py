@@ -1,24 +1,24 @@
 from datetime import date, datetime
-from io import BytesIO
 from pickle import NONE
 from typing import Any, Optional
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.core import files
-from django.db.models import F, Q, Count, Sum
+from django.core.exceptions import PermissionDenied
 from django.db.models.query import QuerySet
-from django.http import HttpRequest, HttpResponseRedirect, JsonResponse
+from django.http import Http404, HttpRequest, HttpResponseRedirect, JsonResponse
 from django.http.response import HttpResponse as HttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.template.response import TemplateResponse
 from django.urls import reverse_lazy
-from django.views.generic import ListView, RedirectView, TemplateView
+from django.views.generic import ListView, RedirectView, TemplateView, View
 
-import requests
-from slugify import slugify
-from .openlibrary import API
+from . import homepage, metrics
+from .conditional import ConditionalGetMixin, listing_validators
+from .pagination import KeysetPaginationMixin, KeysetPaginator
+from .search import search_books
 
-from .models import Author, Book, Category, Review, UserRating
+from .models import Author, Book, Category, ImportJob, Loan, Review, UserRating
 
 
 class IndexView(TemplateView):
@@ -28,25 +28,33 @@ class IndexView(TemplateView):
 
     def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
         context = super().get_context_data(**kwargs)
-        top_rated_books = Book.book.top_rated()[:4]
-        new_books = Book.book.new_books()[:15]
-        cats = Category.objects.all().order_by("name")
         nkwargs = {
-            "top_books": top_rated_books,
-            "new_books": new_books,
-            "cats": cats,
+            "top_books": homepage.lazy_section("top_books"),
+            "new_books": homepage.lazy_section("new_books"),
+            "cats": homepage.lazy_section("cats"),
         }
         context.update(nkwargs)
         return context
 
 
-class AuthorView(TemplateView):
+class AuthorView(ConditionalGetMixin, TemplateView):
     template_name = "Library/author.html"
     http_method_names = ["get"]
 
+    def get_validators(self) -> Optional[tuple[Any, ...]]:
+        try:
+            author = Author.objects.get_cached(slug=self.kwargs["slug"])
+        except Author.DoesNotExist:
+            return None
+        books = Book.book.published().filter(author=author)
+        return author.time_update, *listing_validators(books)
+
     def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
         context = super().get_context_data(**kwargs)
-        author = get_object_or_404(Author.objects, slug=self.kwargs["slug"])
+        try:
+            author = Author.objects.get_cached(slug=self.kwargs["slug"])
+        except Author.DoesNotExist:
+            raise Http404("No Author matches the given query.")
         related_books = Book.book.top_rated().filter(author=author)
         nkwargs = {
             "title": author.full_name,
@@ -57,13 +65,22 @@ class AuthorView(TemplateView):
         return context
 
 
-class CategoryView(ListView):
+class CategoryView(ConditionalGetMixin, KeysetPaginationMixin, ListView):
     model = Book
     paginate_by = 8
+    count_mode = "cached"
     context_object_name = "books"
     http_method_names = ["get"]
     template_name = "Library/category.html"
 
+    def get_validators(self) -> Optional[tuple[Any, ...]]:
+        try:
+            category = Category.objects.get_cached(slug=self.kwargs["slug"])
+        except Category.DoesNotExist:
+            return None
+        books = Book.book.published().filter(category=category)
+        return category.time_update, *listing_validators(books)
+
     def get_queryset(self) -> QuerySet[Any]:
 
         sort = self.request.GET.get("sort", None)
@@ -87,15 +104,16 @@ class CategoryView(ListView):
 
     def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
         context = super().get_context_data(**kwargs)
-        category = Category.objects.values("name").get(slug=self.kwargs["slug"])
+        category = Category.objects.get_cached(slug=self.kwargs["slug"])
         nkwargs = {"category": category}
         context.update(nkwargs)
         return context
 
 
-class LibraryView(ListView):
+class LibraryView(KeysetPaginationMixin, ListView):
     model = Book
     paginate_by = 8
+    count_mode = "cached"
     context_object_name = "books"
     http_method_names = ["get"]
     template_name = "Library/search.html"
@@ -115,7 +133,7 @@ class LibraryView(ListView):
                 return Book.book.top_rated()
 
 
-class SearchView(ListView):
+class SearchView(KeysetPaginationMixin, ListView):
     model = Book
     paginate_by = 8
     context_object_name = "books"
@@ -129,60 +147,40 @@ class SearchView(ListView):
             match sort:
                 case "popular":
                     return Book.book.top_rated().filter(
-                        Q(publisher_slug__icontains=publisher)
+                        publisher_slug__icontains=publisher
                     )
                 case "not_popular":
                     return Book.book.unpopular().filter(
-                        Q(publisher_slug__icontains=publisher)
+                        publisher_slug__icontains=publisher
                     )
                 case "newest":
                     return Book.book.new_books().filter(
-                        Q(publisher_slug__icontains=publisher)
+                        publisher_slug__icontains=publisher
                     )
                 case "oldest":
                     return Book.book.old_books().filter(
-                        Q(publisher_slug__icontains=publisher)
+                        publisher_slug__icontains=publisher
                     )
                 case _:
                     return Book.book.top_rated().filter(
-                        Q(publisher_slug__icontains=publisher)
+                        publisher_slug__icontains=publisher
                     )
 
         search = self.request.GET.get("q", None)
         if search:
             match sort:
                 case "popular":
-                    return Book.book.top_rated().filter(
-                        Q(name__icontains=search)
-                        | Q(category__name__icontains=search)
-                        | Q(author__full_name__icontains=search)
-                    )
+                    return search_books(Book.book.top_rated(), search)
                 case "not_popular":
-                    return Book.book.unpopular().filter(
-                        Q(name__icontains=search)
-                        | Q(category__name__icontains=search)
-                        | Q(author__full_name__icontains=search)
-                    )
+                    return search_books(Book.book.unpopular(), search)
                 case "newest":
-                    return Book.book.new_books().filter(
-                        Q(name__icontains=search)
-                        | Q(category__name__icontains=search)
-                        | Q(author__full_name__icontains=search)
-                    )
+                    return search_books(Book.book.new_books(), search)
                 case "oldest":
-                    return Book.book.old_books().filter(
-                        Q(name__icontains=search)
-                        | Q(category__name__icontains=search)
-                        | Q(author__full_name__icontains=search)
-                    )
+                    return search_books(Book.book.old_books(), search)
                 case _:
-                    return Book.book.top_rated().filter(
-                        Q(name__icontains=search)
-                        | Q(category__name__icontains=search)
-                        | Q(author__full_name__icontains=search)
-                    )
+                    return search_books(Book.book.top_rated(), search, ranked=True)
 
-        return super().get_queryset()
+        return super().get_queryset().select_related("author", "rating_summary")
 
     def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
         context = super().get_context_data(**kwargs)
@@ -196,10 +194,36 @@ class SearchView(ListView):
         return context
 
 
-class BookView(TemplateView):
+class BookView(ConditionalGetMixin, TemplateView):
     template_name = "Library/book.html"
     http_method_names = ["get", "post"]
 
+    def get_book(self) -> Book:
+        # Shared by the ETag and the context, so the page takes one query.
+        if not hasattr(self, "book"):
+            try:
+                self.book = Book.book.detail(self.request.user).get(
+                    slug=self.kwargs["slug"]
+                )
+            except Book.DoesNotExist:
+                raise Http404("No Book matches the given query.")
+        return self.book
+
+    def get_validators(self) -> Optional[tuple[Any, ...]]:
+        try:
+            book = self.get_book()
+        except Http404:
+            return None
+        summary = getattr(book, "rating_summary", None)
+        # The viewer's own rating changes the summary as well.
+        return (
+            book.time_update,
+            book.author.time_update,
+            summary and summary.time_update,
+            book.review_count,
+            book.latest_review,
+        )
+
     def get(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
         error = self.request.GET.get("error", None)
 
@@ -216,31 +240,75 @@ class BookView(TemplateView):
     def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
         error = self.request.GET.get("error", None)
         context = super().get_context_data(**kwargs)
-        book = get_object_or_404(Book.book, slug=self.kwargs["slug"])
-        comments = Review.objects.select_related("user").filter(book=book)
-
-        if self.request.user.is_authenticated:
-            try:
-                user_rate = UserRating.objects.values("rating").get(
-                    user=self.request.user, book=book
-                )
-            except UserRating.DoesNotExist as e:
-                user_rate = None
-        else:
-            user_rate = None
+        book = self.get_book()
+        # The first page of comments; the rest come from BookCommentsView.
+        comments = KeysetPaginator(
+            Review.objects.for_book(book.pk), BookCommentsView.paginate_by
+        ).page()
 
         arr = range(5, 0, -1)
         nkwargs = {
             "book": book,
-            "comments": comments,
+            "comments": comments.object_list,
+            "page_obj": comments,
             "error": error,
-            "user_rate": user_rate,
             "stars": arr,
         }
         context.update(nkwargs)
         return context
 
 
+class BookCommentsView(KeysetPaginationMixin, ListView):
+    """
+    A page of a book's comments after the ?after= cursor, as the HTML
+    fragment the book page appends, or as JSON with ?format=json.
+    """
+
+    paginate_by = 20
+    context_object_name = "comments"
+    http_method_names = ["get"]
+    template_name = "Library/comments.html"
+
+    def get_queryset(self) -> QuerySet[Any]:
+        try:
+            self.book = Book.book.get_cached(slug=self.kwargs["slug"])
+        except Book.DoesNotExist:
+            raise Http404("No Book matches the given query.")
+        return Review.objects.for_book(self.book.pk)
+
+    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
+        context = super().get_context_data(**kwargs)
+        context["book"] = self.book
+        return context
+
+    def render_to_response(self, context: dict[str, Any], **response_kwargs: Any):
+        if self.request.GET.get("format") != "json":
+            return super().render_to_response(context, **response_kwargs)
+
+        page = context["page_obj"]
+        next_url = None
+        if page.has_next():
+            next_url = f"{self.request.path}?format=json&after={page.next_cursor}"
+        data = {
+            "count": self.book.review_count,
+            "next": next_url,
+            "comments": [
+                {
+                    "id": comment.pk,
+                    "user": {
+                        "username": comment.user.username,
+                        "url": comment.user.get_absolute_url(),
+                        "photo": comment.user.get_photo_url(),
+                    },
+                    "text": comment.review_text,
+                    "time_create": comment.time_create,
+                }
+                for comment in context["comments"]
+            ],
+        }
+        return JsonResponse(data)
+
+
 class AddCommentView(LoginRequiredMixin, RedirectView):
     http_method_names = ["post", "put", "patch"]
     error_message = None
@@ -264,7 +332,7 @@ class AddCommentView(LoginRequiredMixin, RedirectView):
 
     def post(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
         user_id = int(self.request.user.pk)
-        book_id = int(self.request.POST.get("book_id")[0])  # type:ignore
+        book_id = int(self.request.POST.get("book_id"))  # type:ignore
         comment_text = self.request.POST.get("text", None)
 
         if not comment_text:
@@ -320,9 +388,9 @@ class RateBookView(LoginRequiredMixin, RedirectView):
             print(e)
             return super().post(request, *args, **kwargs)
 
-        user_rate, created = UserRating.objects.get_or_create(user=user, book=book)
-        user_rate.rating = int(rate_value)
-        user_rate.save()
+        UserRating.objects.update_or_create(
+            user=user, book=book, defaults={"rating": int(rate_value)}
+        )
 
         return super().post(request, *args, **kwargs)
 
@@ -363,74 +431,9 @@ class ContributeView(LoginRequiredMixin, TemplateView):
                 )
                 return self.render_to_response(context=context)
 
-        try:
-            api = API()
-            book = api.get_book(id=key, bibkey=method).get_ready_dict()
-        except Exception as e:
-            print(e)
-            return TemplateResponse(
-                request,
-                "Library/error.html",
-                context={"message": "Cant't connect to openlibrary api"},
-            )
-
-        print(book)
-        author, is_created = Author.objects.get_or_create(
-            full_name=book["author"]["name"]
-        )
-
-        if is_created:
-            author.bio = book["author"]["bio"]
-            author.wiki_page = book["author"]["wikipedia"]
-            author.slug = slugify(book["author"]["name"])
-            try:
-                url = book["author"]["photo"]
-                resp = requests.get("https://" + url)
-                if resp.status_code == requests.codes.ok:
-                    print("Author created")
-                    fp = BytesIO()
-                    fp.write(resp.content)
-                    file_name = url.split("/")[-1]
-                    author.photo.save(file_name, files.File(fp))
-            except:
-                pass
-
-            author.save()
-
-        cat = Category.objects.get(pk=1)
-        _book, is_created = Book.objects.get_or_create(
-            name=book["title"], author=author, category=cat
-        )
-
-        if is_created:
-            _book.name = book["title"]
-            _book.slug = slugify(book["title"])
-            _book.author = author
-            _book.category = cat
-            _book.description = book["desq"]
-            _book.pages = book["num_pages"]
-            _book.publisher = book["publishers"][0]
-            _book.publisher_slug = slugify(book["publishers"][0])
-            _book.preview = book["preview"]["embed"]
-            _book.language = book["lang"]
-            _book.is_published = Book.Status.PUBLISHED  # type: ignore
-            _book.publish_date = book["publish_date"]
-
-            try:
-                url = book["cover"]["medium"]
-                resp = requests.get(url)
-                if resp.status_code == requests.codes.ok:
-                    print("Book created")
-                    fp = BytesIO()
-                    fp.write(resp.content)
-                    file_name = url.split("/")[-1]
-                    _book.book_cover.save(file_name, files.File(fp))
-            except:
-                pass
-
-            _book.save()
+        job, _ = ImportJob.objects.submit(bibkey=key, method=method, user=request.user)
 
-        return redirect(reverse_lazy("Lib:book", kwargs={"slug": _book.slug}))
+        return redirect(reverse_lazy("Lib:contribute_job", kwargs={"pk": job.pk}))
 
     def isISBN_valid(self, isbn: str):
         if len(isbn) != 10 and len(isbn) != 13:
@@ -451,6 +454,33 @@ class ContributeView(LoginRequiredMixin, TemplateView):
         return True
 
 
+class ContributeJobView(LoginRequiredMixin, TemplateView):
+    template_name = "Library/contribute_job.html"
+    http_method_names = ["get"]
+
+    def get(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        jobs = ImportJob.objects.select_related("book")
+        if not request.user.is_staff:
+            jobs = jobs.filter(submitters=request.user)
+        job = get_object_or_404(jobs, pk=self.kwargs["pk"])
+        data = {
+            "id": job.pk,
+            "bibkey": f"{job.method}:{job.bibkey}",
+            "status": job.status,
+            "attempts": job.attempts,
+            "error": job.error,
+            "url": job.book.get_absolute_url() if job.book else None,
+        }
+
+        if request.GET.get("format") == "json":
+            return JsonResponse(data)
+
+        if job.status == ImportJob.Status.DONE and job.book:
+            return redirect(job.book.get_absolute_url())
+
+        return self.render_to_response(self.get_context_data(job=job, **kwargs))
+
+
 class BorrowBookView(LoginRequiredMixin, RedirectView):
     http_method_names = ["post", "put", "patch"]
 
@@ -480,14 +510,9 @@ class BorrowBookView(LoginRequiredMixin, RedirectView):
         converted_date = datetime.strptime(str(return_date), "%Y-%m-%d").date()
 
         is_valid, message = self.is_date_valid(converted_date)
-        if is_valid:
-            book = Book.objects.get(pk=book_id)
-            user = get_user_model().objects.get(pk=request.user.pk)
-            book.user = user
-            book.is_taken = True
-            book.return_date = converted_date
-            book.save()
-        else:
+        if is_valid and not Loan.objects.borrow(book_id, request.user, converted_date):
+            is_valid, message = False, "This book is already taken"
+        if not is_valid:
             return TemplateResponse(
                 request,
                 "Library/error.html",
@@ -522,19 +547,12 @@ class ReturnBookView(LoginRequiredMixin, RedirectView):
 
     def post(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
         book_id = self.request.POST.get("book_id", None)
-        user_id = self.request.user.pk
-        user = get_user_model().objects.get(pk=user_id)
-
-        book = Book.objects.get(pk=book_id)
-        if book.user == user:
-            book.user = None
-            book.is_taken = False
-            book.save()
+        Loan.objects.give_back(book_id, request.user)
 
         return super().post(request, *args, **kwargs)
 
 
-class MyShelfView(LoginRequiredMixin, ListView):
+class MyShelfView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Book
     paginate_by = 8
     context_object_name = "books"
@@ -549,39 +567,16 @@ class MyShelfView(LoginRequiredMixin, ListView):
         if search:
             match sort:
                 case "popular":
-                    return Book.book.top_rated().filter(
-                        Q(name__icontains=search)
-                        | Q(category__name__icontains=search)
-                        | Q(author__full_name__icontains=search),
-                        user=user,
-                    )
+                    return search_books(Book.book.top_rated().filter(user=user), search)
                 case "not_popular":
-                    return Book.book.unpopular().filter(
-                        Q(name__icontains=search)
-                        | Q(category__name__icontains=search)
-                        | Q(author__full_name__icontains=search),
-                        user=user,
-                    )
+                    return search_books(Book.book.unpopular().filter(user=user), search)
                 case "newest":
-                    return Book.book.new_books().filter(
-                        Q(name__icontains=search)
-                        | Q(category__name__icontains=search)
-                        | Q(author__full_name__icontains=search),
-                        user=user,
-                    )
+                    return search_books(Book.book.new_books().filter(user=user), search)
                 case "oldest":
-                    return Book.book.old_books().filter(
-                        Q(name__icontains=search)
-                        | Q(category__name__icontains=search)
-                        | Q(author__full_name__icontains=search),
-                        user=user,
-                    )
+                    return search_books(Book.book.old_books().filter(user=user), search)
                 case _:
-                    return Book.book.top_rated().filter(
-                        Q(name__icontains=search)
-                        | Q(category__name__icontains=search)
-                        | Q(author__full_name__icontains=search),
-                        user=user,
+                    return search_books(
+                        Book.book.top_rated().filter(user=user), search, ranked=True
                     )
 
         match sort:
@@ -604,3 +599,16 @@ class MyShelfView(LoginRequiredMixin, ListView):
         }
         context.update(nkwargs)
         return context
+
+
+class MetricsView(View):
+    http_method_names = ["get"]
+
+    def get(self, request: HttpRequest) -> HttpResponse:
+        allowed_ips = settings.METRICS.get("ALLOWED_IPS", ())
+        if request.META["REMOTE_ADDR"] not in allowed_ips and not request.user.is_staff:
+            raise PermissionDenied
+        return HttpResponse(
+            metrics.render(metrics.registry.collect()),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
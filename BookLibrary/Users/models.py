@@ -48,6 +48,7 @@ class User(AbstractUser):
         default="Users/photo/default.png",
         verbose_name="User avatar",
     )
+    photo_variants = models.JSONField(default=dict, blank=True, editable=False)
     birthday = models.DateField(
         null=True, blank=True, verbose_name="User birthday date"
     )
@@ -1,3 +1,41 @@
-from django.test import TestCase
+from typing import Any
 
-# Create your tests here.
+from django.contrib.auth.tokens import default_token_generator
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from Library.perf import PerformanceTestCase, Route
+
+
+def other_user(test: PerformanceTestCase) -> dict[str, Any]:
+    return {"pk": test.user.pk + 1}
+
+
+def reset_token(test: PerformanceTestCase) -> dict[str, Any]:
+    return {
+        "uidb64": urlsafe_base64_encode(force_bytes(test.user.pk)),
+        "token": default_token_generator.make_token(test.user),
+    }
+
+
+class UsersPerformanceTests(PerformanceTestCase):
+    routes = [
+        Route("User:user-profile", max_queries=1, kwargs=other_user),
+        Route("User:profile", max_queries=2, login=True),
+        Route("User:profile-edit", max_queries=2, login=True),
+        Route("User:login", max_queries=0),
+        Route("User:logout", max_queries=4, method="post", login=True, status=(302,)),
+        Route("User:registr", max_queries=0),
+        Route("User:password-change", max_queries=2, login=True),
+        # Without a referer from the change form the view redirects to the profile.
+        Route("User:password-change-done", max_queries=2, login=True, status=(302,)),
+        Route("User:password-reset", max_queries=0),
+        Route("User:password-reset-done", max_queries=0, status=(302,)),
+        Route(
+            "User:password-reset-confirm",
+            max_queries=5,
+            kwargs=reset_token,
+            status=(302,),
+        ),
+        Route("User:password-reset-complete", max_queries=0),
+    ]